@@ -1,25 +1,34 @@
 from flask import Flask, render_template, request, jsonify, session
 from flask_cors import CORS
 from config import Config
-from database.models import db, User, Destination, Attraction, TravelPlan, Itinerary, ItineraryItem, TravelNote, Friend, FriendRequest, Message, Expense, ExpenseBudget, ExpenseCategory, Moment, MomentLike, MomentComment
+from database.models import db, User, Attraction, TravelPlan, Itinerary, ItineraryItem, TravelNote, Friend, FriendRequest, Message, Expense, ExpenseBudget, ExpenseCategory, Moment, MomentLike, MomentComment
 import json
 from openai import OpenAI
 from datetime import datetime, date, timedelta
-import requests
-from math import radians, cos, sin, sqrt, atan2
 from werkzeug.utils import secure_filename
 import os
 from werkzeug.security import check_password_hash, generate_password_hash
 from functools import wraps
-from flask import redirect, url_for
-import threading
-import uuid
+from flask import redirect, url_for, Response, abort
 import time
+import hashlib
 from flask_migrate import Migrate
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload
 from ocr_service import ocr_service
-
-# 任务存储
-tasks = {}
+from upstream import upstream_stats
+from geo_service import geo_service, encode_polyline, simplify_polyline, zoom_tolerance, RouteError
+from task_queue import task_queue, QueueFull
+from plan_service import apply_budget_limits, build_itinerary, build_itinerary_items, model_rows, parse_itinerary_item_fields, plan_cache_key, rebase_plan_dates, serialize_plan, DayStreamParser
+from cache import TTLCache
+from route_optimizer import optimize_visit_order
+from geo_distance import merge_nearby_points
+from geo_index import bbox_filter, nearby, nearest
+from moment_service import adjust_moment_counters, feed_query, reconcile_moment_counters, serialize_feed_row, visible_moments_filter
+from pagination import InvalidCursor, keyset_page, keyset_requested, parse_keyset_args
+from friend_service import friend_graph
+from timeline_service import fan_out_moment, link_friends, rebuild_timelines, remove_moment, sync_moment_visibility, timeline_enabled, timeline_page, unlink_friends
+from destination_service import destination_catalog, DESTINATION_FIELDS, DEFAULT_DESTINATION_FIELDS
 
 def create_app():
     """创建Flask应用"""
@@ -33,6 +42,12 @@ def create_app():
     # 初始化Flask-Migrate
     migrate = Migrate(app, db)
     
+    # 初始化后台任务队列
+    task_queue.init_app(app)
+    geo_service.init_app(app)
+    destination_catalog.init_app(app)
+    friend_graph.init_app(app)
+    
     return app
 
 app = create_app()
@@ -43,6 +58,12 @@ deepseek_client = OpenAI(
     base_url=app.config['DEEPSEEK_BASE_URL']
 )
 
+# AI计划生成结果缓存（按规范化输入缓存模型原始输出）
+plan_cache = TTLCache(maxsize=app.config['PLAN_CACHE_SIZE'], ttl=app.config['PLAN_CACHE_TTL'])
+
+# 计划详情响应缓存（按计划ID缓存序列化后的JSON及其ETag）
+plan_detail_cache = TTLCache(maxsize=app.config['PLAN_DETAIL_CACHE_SIZE'], ttl=app.config['PLAN_DETAIL_CACHE_TTL'])
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -51,6 +72,16 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def queue_full_response(e, key='error'):
+    """任务线程池排队已满时返回429，并通过Retry-After提示客户端稍后重试"""
+    response = jsonify({
+        'success': False,
+        key: f'当前排队任务过多，请{e.retry_after}秒后重试',
+        'retry_after': e.retry_after
+    })
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
 def login_required_page(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -63,8 +94,6 @@ def login_required_page(f):
 def process_plan_generation_task(task_id, user_id, data):
     """后台处理AI生成计划任务"""
     try:
-        tasks[task_id]['status'] = 'processing'
-        
         # 获取用户输入，优先自定义
         destinations = data.get('destinations', [])
         days = data.get('days', 3)
@@ -82,8 +111,7 @@ def process_plan_generation_task(task_id, user_id, data):
         with app.app_context():
             user = User.query.get(user_id)
             if not user:
-                tasks[task_id]['status'] = 'failed'
-                tasks[task_id]['error'] = '用户不存在'
+                task_queue.fail(task_id, '用户不存在')
                 return
                 
             # 构建AI提示词
@@ -109,6 +137,7 @@ def process_plan_generation_task(task_id, user_id, data):
                 {{
                     "time": "09:00",
                     "activity": "参观故宫",
+                    "activity_type": "visit",
                     "location": "故宫博物院",
                     "duration": "3小时",
                     "cost": 60,
@@ -140,6 +169,7 @@ def process_plan_generation_task(task_id, user_id, data):
 - 其他杂费
 
 确保total_cost = 所有items的cost之和，且在{budget_min}-{budget_max}元范围内。
+activity_type取值：visit（景点游览、购物等）、meal（早餐/午餐/晚餐等用餐）、rest（入住酒店、休息）、transport（往返交通、换乘）。
 """
             
             user_prompt = f"""
@@ -159,129 +189,154 @@ def process_plan_generation_task(task_id, user_id, data):
                 {"role": "user", "content": user_prompt}
             ]
             
+            # 相同输入（目的地、天数、预算档位、主题、交通）命中缓存时直接复用之前的生成结果；
+            # use_cache=false时既不读取缓存，也不把本次生成结果写入缓存
+            use_cache = data.get('use_cache', True)
+            cache_key = plan_cache_key(destinations, days, budget_min, budget_max, theme, transport,
+                                       app.config['PLAN_CACHE_BUDGET_BAND']) if use_cache else None
+            cached = plan_cache.get(cache_key) if cache_key else None
+            
             try:
-                # 调用AI API生成内容
-                response = deepseek_client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=messages,
-                    response_format={'type': 'json_object'}
-                )
-                
-                ai_result = json.loads(response.choices[0].message.content)
-                
-                # 验证预算控制
-                total_cost = ai_result.get('total_cost', 0)
-                calculated_cost = 0
-                
-                # 计算所有行程项目的实际费用
-                for day_data in ai_result.get('days', []):
-                    for item in day_data.get('items', []):
-                        calculated_cost += item.get('cost', 0)
-                
-                # 预算验证和修正
-                if total_cost > budget_max or calculated_cost > budget_max:
-                    print(f"预算超出限制，AI生成费用: {total_cost}, 计算费用: {calculated_cost}, 预算上限: {budget_max}")
-                    # 按比例缩减费用
-                    scale_factor = budget_max * 0.9 / max(total_cost, calculated_cost)
+                if cached:
+                    ai_result = rebase_plan_dates(json.loads(cached), start_date)
+                    apply_budget_limits(ai_result, budget_min, budget_max)
+                    travel_plan = save_generated_plan(
+                        user, ai_result, destinations, days,
+                        budget_min, budget_max, theme, transport, start_date
+                    )
+                elif data.get('stream', app.config['PLAN_STREAMING']):
+                    # 流式生成：每解析出一天就写入任务结果，生成完成后一次性入库
+                    travel_plan, ai_result = generate_plan_streaming(
+                        task_id, user, messages, destinations, days,
+                        budget_min, budget_max, theme, transport, start_date, cache_key
+                    )
+                else:
+                    # 调用AI API生成内容
+                    response = deepseek_client.chat.completions.create(
+                        model="deepseek-chat",
+                        messages=messages,
+                        response_format={'type': 'json_object'}
+                    )
                     
-                    # 修正每个项目的费用
-                    for day_data in ai_result.get('days', []):
-                        for item in day_data.get('items', []):
-                            item['cost'] = round(item.get('cost', 0) * scale_factor)
+                    content = response.choices[0].message.content
+                    ai_result = json.loads(content)
+                    if cache_key:
+                        plan_cache.set(cache_key, content)
                     
-                    # 重新计算总费用
-                    calculated_cost = 0
-                    for day_data in ai_result.get('days', []):
-                        for item in day_data.get('items', []):
-                            calculated_cost += item.get('cost', 0)
+                    # 验证预算控制
+                    apply_budget_limits(ai_result, budget_min, budget_max)
                     
-                    ai_result['total_cost'] = calculated_cost
-                    total_cost = calculated_cost
-                
-                # 最终验证
-                if total_cost < budget_min * 0.8:
-                    print(f"预算过低，调整为最低预算的80%: {budget_min * 0.8}")
-                    ai_result['total_cost'] = int(budget_min * 0.8)
-                
-                # 创建旅行计划
-                travel_plan = TravelPlan(
-                    title=ai_result.get('title', f"{', '.join(destinations)}{days}日游"),
-                    start_date=start_date,
-                    end_date=start_date + timedelta(days=days-1),
-                    total_days=days,
-                    budget_min=budget_min,
-                    budget_max=budget_max,
-                    travel_theme=theme,
-                    transport_mode=transport,
-                    status='draft',
-                    ai_generated=True,
-                    user_id=user.id
-                )
-                
-                db.session.add(travel_plan)
-                db.session.commit()
-                
-                # 保存每日行程
-                for day_data in ai_result.get('days', []):
-                    itinerary = Itinerary(
-                        day_number=day_data.get('day', 1),
-                        date=start_date + timedelta(days=day_data.get('day', 1) - 1),
-                        theme=day_data.get('theme', ''),
-                        travel_plan_id=travel_plan.id
+                    travel_plan = save_generated_plan(
+                        user, ai_result, destinations, days,
+                        budget_min, budget_max, theme, transport, start_date
                     )
-                    db.session.add(itinerary)
-                    db.session.commit()
-                    
-                    # 保存行程项目
-                    for idx, item in enumerate(day_data.get('items', [])):
-                        # 处理时间格式，将中文冒号转换为英文冒号
-                        time_str = item.get('time', '09:00')
-                        if time_str:
-                            time_str = time_str.replace('：', ':')
-                        
-                        itinerary_item = ItineraryItem(
-                            start_time=datetime.strptime(time_str, '%H:%M').time(),
-                            activity_type='visit',
-                            title=item.get('activity', ''),
-                            description=item.get('description', ''),
-                            location=item.get('location', ''),
-                            latitude=item.get('latitude'),
-                            longitude=item.get('longitude'),
-                            estimated_cost=item.get('cost', 0),
-                            order_index=idx,
-                            itinerary_id=itinerary.id
-                        )
-                        db.session.add(itinerary_item)
-                
-                db.session.commit()
                 
                 # 更新任务状态
-                tasks[task_id]['status'] = 'completed'
-                tasks[task_id]['result'] = {
+                task_queue.complete(task_id, {
                     'plan_id': travel_plan.id,
-                    'plan': ai_result
-                }
+                    'plan': ai_result,
+                    'cached': bool(cached)
+                })
                 
             except Exception as e:
                 print(f"AI生成计划失败: {str(e)}")
-                tasks[task_id]['status'] = 'failed'
-                tasks[task_id]['error'] = f'生成计划失败: {str(e)}'
+                task_queue.fail(task_id, f'生成计划失败: {str(e)}')
                 
     except Exception as e:
         print(f"任务处理异常: {str(e)}")
-        tasks[task_id]['status'] = 'failed'
-        tasks[task_id]['error'] = f'任务处理异常: {str(e)}'
+        task_queue.fail(task_id, f'任务处理异常: {str(e)}')
+
+def save_generated_plan(user, ai_result, destinations, days,
+                        budget_min, budget_max, theme, transport, start_date):
+    """
+    保存AI生成（或缓存命中）的完整计划及其每日行程
+    计划、行程和行程项目在同一个事务中批量写入，只提交一次；任一步失败则整体回滚
+    """
+    try:
+        # 创建旅行计划，flush后即可拿到计划ID
+        travel_plan = TravelPlan(
+            title=ai_result.get('title', f"{', '.join(destinations)}{days}日游"),
+            start_date=start_date,
+            end_date=start_date + timedelta(days=days-1),
+            total_days=days,
+            budget_min=budget_min,
+            budget_max=budget_max,
+            travel_theme=theme,
+            transport_mode=transport,
+            status='draft',
+            ai_generated=True,
+            user_id=user.id
+        )
+        db.session.add(travel_plan)
+        db.session.flush()
+        
+        # 批量插入每日行程，按参数顺序返回行程ID（空参数列表会被当作一条全默认值的INSERT，需跳过）
+        days_data = ai_result.get('days', [])
+        itinerary_ids = db.session.scalars(
+            insert(Itinerary).returning(Itinerary.id, sort_by_parameter_order=True),
+            model_rows([build_itinerary(day_data, start_date, travel_plan.id) for day_data in days_data])
+        ).all() if days_data else []
+        
+        # 批量插入所有行程项目（executemany，不需要回读主键）
+        items = []
+        for itinerary_id, day_data in zip(itinerary_ids, days_data):
+            items.extend(build_itinerary_items(day_data, itinerary_id))
+        if items:
+            db.session.execute(insert(ItineraryItem), model_rows(items))
+        
+        db.session.commit()
+        return travel_plan
+    except Exception:
+        db.session.rollback()
+        raise
+
+def generate_plan_streaming(task_id, user, messages, destinations, days,
+                            budget_min, budget_max, theme, transport, start_date, cache_key=None):
+    """
+    流式调用AI生成计划：模型每输出完整的一天就把已生成的天数写入任务结果，前端可以在后续天数生成期间先展示前几天。
+    全部生成并修正预算后再用save_generated_plan批量写入，只提交一次，中途失败也不会留下不完整的计划
+    """
+    title = f"{', '.join(destinations)}{days}日游"
+    stream = deepseek_client.chat.completions.create(
+        model="deepseek-chat",
+        messages=messages,
+        response_format={'type': 'json_object'},
+        stream=True
+    )
+    
+    parser = DayStreamParser()
+    streamed_days = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        content = chunk.choices[0].delta.content
+        if not content:
+            continue
+        for day_data in parser.feed(content):
+            streamed_days.append(day_data)
+            task_queue.update(task_id, result={
+                'partial': True,
+                'plan': {'title': title, 'days': streamed_days}
+            })
+    
+    ai_result = json.loads(parser.buffer)
+    if cache_key:
+        plan_cache.set(cache_key, parser.buffer)
+    apply_budget_limits(ai_result, budget_min, budget_max)
+    
+    travel_plan = save_generated_plan(
+        user, ai_result, destinations, days,
+        budget_min, budget_max, theme, transport, start_date
+    )
+    return travel_plan, ai_result
 
 def process_report_generation_task(task_id, user_id):
     """后台处理AI生成报告任务"""
     try:
-        tasks[task_id]['status'] = 'processing'
-        
         with app.app_context():
             user = User.query.get(user_id)
             if not user:
-                tasks[task_id]['status'] = 'failed'
-                tasks[task_id]['error'] = '用户不存在'
+                task_queue.fail(task_id, '用户不存在')
                 return
                 
             # 获取用户的所有历史数据
@@ -305,8 +360,7 @@ def process_report_generation_task(task_id, user_id):
             
             # 如果没有足够的数据，返回错误
             if len(completed_plans) == 0 and len(all_notes) == 0:
-                tasks[task_id]['status'] = 'failed'
-                tasks[task_id]['error'] = '您还没有足够的旅行数据来生成报告，请先完成一些旅行计划并撰写游记。'
+                task_queue.fail(task_id, '您还没有足够的旅行数据来生成报告，请先完成一些旅行计划并撰写游记。')
                 return
             
             # 准备数据摘要
@@ -468,22 +522,19 @@ def process_report_generation_task(task_id, user_id):
                 report_content = response.choices[0].message.content
                 
                 # 更新任务状态
-                tasks[task_id]['status'] = 'completed'
-                tasks[task_id]['result'] = {
+                task_queue.complete(task_id, {
                     'report': report_content,
                     'data_summary': report_data['user_info'],
                     'generated_at': datetime.now().isoformat()
-                }
+                })
                 
             except Exception as e:
                 print(f"AI生成报告失败: {str(e)}")
-                tasks[task_id]['status'] = 'failed'
-                tasks[task_id]['error'] = f'生成报告失败: {str(e)}'
+                task_queue.fail(task_id, f'生成报告失败: {str(e)}')
                 
     except Exception as e:
         print(f"报告任务处理异常: {str(e)}")
-        tasks[task_id]['status'] = 'failed'
-        tasks[task_id]['error'] = f'任务处理异常: {str(e)}'
+        task_queue.fail(task_id, f'任务处理异常: {str(e)}')
 
 @app.route('/')
 def index():
@@ -533,42 +584,123 @@ def shared_plan_detail(plan_id, share_token):
 @app.route('/api/destinations')
 @login_required
 def get_destinations():
-    """获取所有目的地"""
-    destinations = Destination.query.all()
-    return jsonify([{
-        'id': d.id,
-        'name': d.name,
-        'city': d.city,
-        'province': d.province,
-        'country': d.country,
-        'latitude': d.latitude,
-        'longitude': d.longitude,
-        'description': d.description
-    } for d in destinations])
+    """
+    获取目的地列表，数据来自进程内快照
+    参数：q 名称或城市前缀，fields 逗号分隔的返回字段（默认不含description），
+    cursor 上一页返回的next_cursor，limit 每页条数
+    """
+    q = request.args.get('q', '').strip()
+    limit = request.args.get('limit', app.config['DESTINATION_PAGE_SIZE'], type=int)
+    if not limit or limit < 1:
+        return jsonify({'success': False, 'error': 'limit必须为正整数'}), 400
+    limit = min(limit, app.config['DESTINATION_MAX_PAGE_SIZE'])
+    cursor = request.args.get('cursor', type=int)
+    if request.args.get('cursor') and cursor is None:
+        return jsonify({'success': False, 'error': 'cursor无效'}), 400
+    
+    fields = DEFAULT_DESTINATION_FIELDS
+    if request.args.get('fields'):
+        fields = tuple(f.strip() for f in request.args['fields'].split(',') if f.strip())
+        unknown = [f for f in fields if f not in DESTINATION_FIELDS]
+        if unknown:
+            return jsonify({'success': False, 'error': f"不支持的字段: {', '.join(unknown)}"}), 400
+        if 'id' not in fields:
+            fields = ('id',) + fields
+    
+    # ETag只取决于快照版本和查询参数，命中时无需生成响应体
+    snapshot = destination_catalog.snapshot()
+    etag = hashlib.sha256(f'{snapshot.token}|{q}|{",".join(fields)}|{cursor}|{limit}'.encode('utf-8')).hexdigest()
+    if etag in request.if_none_match:
+        return conditional_json_response('', etag, 'private, no-cache')
+    
+    items, next_cursor = snapshot.page(q=q, fields=fields, cursor=cursor, limit=limit)
+    body = app.json.dumps({
+        'success': True,
+        'destinations': items,
+        'next_cursor': next_cursor,
+        'version': snapshot.token
+    })
+    return conditional_json_response(body, etag, 'private, no-cache')
+
+def parse_nearby_args():
+    """
+    解析附近查询参数，返回 (参数字典, 错误信息)
+    支持三种查询：lat/lng + radius（半径内，公里）、lat/lng + k（最近的k条）、
+    bbox=min_lng,min_lat,max_lng,max_lat（地图可视范围内）
+    """
+    max_results = app.config['NEARBY_MAX_RESULTS']
+    limit = min(request.args.get('limit', 50, type=int), max_results)
+    bbox = request.args.get('bbox')
+    if bbox:
+        try:
+            min_lng, min_lat, max_lng, max_lat = [float(v) for v in bbox.split(',')]
+        except ValueError:
+            return None, 'bbox格式应为 min_lng,min_lat,max_lng,max_lat'
+        if min_lat > max_lat or min_lng > max_lng:
+            return None, 'bbox范围无效'
+        return {'bbox': (min_lat, min_lng, max_lat, max_lng), 'limit': limit}, None
+
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None, '请提供有效的lat和lng参数'
+    radius = request.args.get('radius', app.config['NEARBY_DEFAULT_RADIUS'], type=float)
+    if radius is None or radius <= 0 or radius > app.config['NEARBY_MAX_RADIUS']:
+        return None, f"radius应在0到{app.config['NEARBY_MAX_RADIUS']}公里之间"
+    k = request.args.get('k', type=int)
+    if k is not None and not 0 < k <= max_results:
+        return None, f'k应在1到{max_results}之间'
+    return {'lat': lat, 'lng': lng, 'radius': radius, 'k': k, 'limit': limit}, None
+
+def query_nearby(query, model, params):
+    """按parse_nearby_args的参数执行空间查询，返回 [(记录, 距离公里或None), ...]"""
+    if 'bbox' in params:
+        rows = query.filter(bbox_filter(model, params['bbox'])).limit(params['limit']).all()
+        return [(row, None) for row in rows]
+    if params['k']:
+        return nearest(query, model, params['lat'], params['lng'], k=params['k'],
+                       max_radius_km=app.config['NEARBY_MAX_RADIUS'])
+    return nearby(query, model, params['lat'], params['lng'], params['radius'], limit=params['limit'])
+
+@app.route('/api/attractions/nearby')
+@login_required
+def get_nearby_attractions():
+    """附近的景点，按距离由近到远排序"""
+    params, error = parse_nearby_args()
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    
+    query = Attraction.query
+    if request.args.get('type'):
+        query = query.filter(Attraction.type == request.args['type'])
+    results = query_nearby(query, Attraction, params)
+    
+    return jsonify({
+        'success': True,
+        'attractions': [{
+            'id': a.id,
+            'name': a.name,
+            'type': a.type,
+            'latitude': a.latitude,
+            'longitude': a.longitude,
+            'rating': a.rating,
+            'visit_duration': a.visit_duration,
+            'ticket_price': a.ticket_price,
+            'destination_id': a.destination_id,
+            'distance_km': round(distance, 3) if distance is not None else None
+        } for a, distance in results]
+    })
 
 @app.route('/api/generate-plan', methods=['POST'])
 @login_required
 def generate_plan():
     """异步生成旅行计划，返回任务ID"""
     try:
-        # 创建任务ID
-        task_id = str(uuid.uuid4())
-        
-        # 存储任务信息
-        tasks[task_id] = {
-            'status': 'pending',
-            'created_at': datetime.now().isoformat(),
+        # 登记任务并交给后台线程池处理
+        task_id = task_queue.submit('plan_generation', session['user_id'], {
             'user_id': session['user_id'],
             'data': request.json
-        }
-        
-        # 启动后台线程处理
-        thread = threading.Thread(
-            target=process_plan_generation_task,
-            args=(task_id, session['user_id'], request.json)
-        )
-        thread.daemon = True
-        thread.start()
+        })
         
         # 立即返回任务ID
         return jsonify({
@@ -577,47 +709,163 @@ def generate_plan():
             'message': '旅行计划生成任务已提交，请稍后查询结果'
         })
         
+    except QueueFull as e:
+        return queue_full_response(e)
     except Exception as e:
         print(f"提交生成计划任务失败: {str(e)}")
         return jsonify({'success': False, 'error': f'提交任务失败: {str(e)}'}), 500
 
+def task_status_data(task):
+    """将任务状态转换为接口返回格式，version用于长轮询/SSE判断任务是否有变化"""
+    result = {
+        'success': True,
+        'status': task['status'],
+        'created_at': task['created_at'].isoformat(),
+        'version': task['updated_at'].isoformat()
+    }
+    
+    # 添加错误信息（如果有）
+    if task['status'] == 'failed' and task.get('error'):
+        result['error'] = task['error']
+    
+    # 添加结果（已完成，或流式生成中已产生的部分结果）
+    if task['status'] in ('completed', 'processing') and task.get('result'):
+        result.update(task['result'])
+    
+    return result
+
 @app.route('/api/task/<task_id>', methods=['GET'])
 @login_required
 def get_task_status(task_id):
-    """获取任务状态和结果"""
-    if task_id not in tasks:
+    """
+    获取任务状态和结果
+    传入wait=秒数时为长轮询：任务相对since（上次返回的version）有变化时立即返回，
+    未传since时等待任务结束，最长等待TASK_LONG_POLL_MAX秒。
+    本进程挂起的连接已达上限时不等待，直接返回当前状态并带上retry_after，客户端按该间隔短轮询
+    """
+    task = task_queue.get(task_id)
+    if not task:
         return jsonify({'success': False, 'error': '任务不存在'}), 404
     
-    task = tasks[task_id]
-    
     # 检查任务所有权
-    print(f"=== 查询任务状态，任务ID: {task_id}, 状态: {tasks.get(task_id, {}).get('status', '不存在')} ===")
     if task.get('user_id') != session['user_id']:
         return jsonify({'success': False, 'error': '无权访问此任务'}), 403
     
-    result = {
-        'success': True,
-        'status': task['status'],
-        'created_at': task['created_at']
-    }
-    
-    # 添加错误信息（如果有）
-    if task['status'] == 'failed' and 'error' in task:
-        result['error'] = task['error']
+    wait = request.args.get('wait', 0, type=float)
+    retry_after = None
+    if wait > 0:
+        since = request.args.get('since')
+        try:
+            since = datetime.fromisoformat(since) if since else None
+        except ValueError:
+            return jsonify({'success': False, 'error': 'since参数格式错误'}), 400
+        if task_queue.acquire_waiter():
+            try:
+                wait = min(wait, app.config['TASK_LONG_POLL_MAX'])
+                task = task_queue.wait(task_id, since=since, timeout=wait)
+            finally:
+                task_queue.release_waiter()
+            if not task:
+                return jsonify({'success': False, 'error': '任务不存在'}), 404
+        else:
+            retry_after = app.config['TASK_SHORT_POLL_INTERVAL']
     
-    # 添加结果（如果已完成）
-    if task['status'] == 'completed' and 'result' in task:
-        result.update(task['result'])
+    result = task_status_data(task)
+    if retry_after:
+        result['retry_after'] = retry_after
     
     # 清理过期任务（可选）
     if task['status'] in ['completed', 'failed']:
         # 设置结果保留时间（例如1小时）
-        created_time = datetime.fromisoformat(task['created_at'])
-        if (datetime.now() - created_time).total_seconds() > 3600:
-            tasks.pop(task_id, None)
+        if (datetime.utcnow() - task['created_at']).total_seconds() > task_queue.result_ttl:
+            task_queue.delete(task_id)
     
     return jsonify(result)
 
+@app.route('/api/task/<task_id>/events', methods=['GET'])
+@login_required
+def task_events(task_id):
+    """
+    通过Server-Sent Events推送任务状态变化，任务结束后关闭连接
+    单个连接最长保持TASK_EVENTS_MAX秒，之后由浏览器EventSource自动重连；
+    本进程挂起的连接已达上限时返回503，前端改用轮询
+    """
+    task = task_queue.get(task_id)
+    if not task:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    if task.get('user_id') != session['user_id']:
+        return jsonify({'success': False, 'error': '无权访问此任务'}), 403
+    
+    if not task_queue.acquire_waiter():
+        retry_after = app.config['TASK_SHORT_POLL_INTERVAL']
+        response = jsonify({'success': False, 'error': '推送连接数已满，请改用轮询', 'retry_after': retry_after})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 503
+    
+    max_duration = app.config['TASK_EVENTS_MAX']
+    released = []
+    
+    def release():
+        # 连接关闭时释放名额（生成器未执行也会调用）
+        if not released:
+            released.append(True)
+            task_queue.release_waiter()
+    
+    def generate():
+        deadline = time.monotonic() + max_duration
+        current = task
+        last_version = None
+        yield 'retry: 1000\n\n'
+        while current:
+            if current['updated_at'] != last_version:
+                last_version = current['updated_at']
+                data = json.dumps(task_status_data(current), ensure_ascii=False)
+                yield f"event: status\nid: {last_version.isoformat()}\ndata: {data}\n\n"
+            else:
+                # 没有变化时发送注释行保持连接
+                yield ': keep-alive\n\n'
+            if current['status'] in ('completed', 'failed'):
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            current = task_queue.wait(task_id, since=current['updated_at'], timeout=min(remaining, 15))
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(release)
+    return response
+
+@app.route('/api/task-pools', methods=['GET'])
+@login_required
+def get_task_pool_stats():
+    """获取各后台任务线程池的排队长度和等待时间，以及挂起的长轮询/SSE连接数（仅统计当前进程）"""
+    return jsonify({'success': True, 'pools': task_queue.stats(), 'waiters': task_queue.waiter_stats()})
+
+@app.route('/api/upstream-stats', methods=['GET'])
+@login_required
+def get_upstream_stats():
+    """获取各外部服务（高德地图、百度OCR）的请求延迟、错误数和熔断状态（仅统计当前进程）"""
+    return jsonify({'success': True, 'upstreams': upstream_stats()})
+
+@app.route('/api/cache-stats', methods=['GET'])
+@login_required
+def get_cache_stats():
+    """获取各进程内缓存的命中统计（仅统计当前进程）"""
+    return jsonify({
+        'success': True,
+        'caches': {
+            'plan_generation': plan_cache.stats(),
+            'plan_detail': plan_detail_cache.stats(),
+            'geocode': geo_service.stats(),
+            'route': geo_service.route_stats(),
+            'destinations': destination_catalog.stats(),
+            'friends': friend_graph.stats()
+        }
+    })
+
 @app.route('/api/plans')
 @login_required
 def get_plans():
@@ -669,53 +917,48 @@ def get_plans():
 def get_plan_detail(plan_id):
     """获取计划详情"""
     user_id = session['user_id']
-    plan = TravelPlan.query.filter_by(id=plan_id, user_id=user_id).first_or_404()
-    today = date.today()
-    # 动态判断已完成
-    plan_end_date = plan.end_date if isinstance(plan.end_date, date) else datetime.strptime(plan.end_date, '%Y-%m-%d').date()
-    if plan_end_date < today:
-        status = 'completed'
-    else:
-        status = plan.status
-    itineraries = []
-    for itinerary in plan.itineraries:
-        items = []
-        for item in itinerary.itinerary_items:
-            items.append({
-                'id': item.id,
-                'start_time': item.start_time.strftime('%H:%M'),
-                'end_time': item.end_time.strftime('%H:%M') if item.end_time else None,
-                'activity_type': item.activity_type,
-                'title': item.title,
-                'description': item.description,
-                'location': item.location,
-                'latitude': item.latitude,
-                'longitude': item.longitude,
-                'estimated_cost': item.estimated_cost,
-                'order_index': item.order_index
-            })
-        itineraries.append({
-            'id': itinerary.id,
-            'day_number': itinerary.day_number,
-            'date': itinerary.date.isoformat(),
-            'theme': itinerary.theme,
-            'notes': itinerary.notes,
-            'items': sorted(items, key=lambda x: x['order_index'])
-        })
-    return jsonify({
-        'id': plan.id,
-        'title': plan.title,
-        'start_date': plan.start_date.isoformat(),
-        'end_date': plan.end_date.isoformat(),
-        'total_days': plan.total_days,
-        'budget_min': plan.budget_min,
-        'budget_max': plan.budget_max,
-        'travel_theme': plan.travel_theme,
-        'transport_mode': plan.transport_mode,
-        'status': status,
-        'ai_generated': plan.ai_generated,
-        'itineraries': sorted(itineraries, key=lambda x: x['day_number'])
-    })
+    entry = get_plan_detail_entry(plan_id)
+    if not entry or entry['user_id'] != user_id:
+        abort(404)
+    return conditional_json_response(entry['body'], entry['etag'], 'private, no-cache')
+
+def get_plan_detail_entry(plan_id):
+    """
+    获取计划详情的缓存条目，计划不存在时返回None
+    先只查询计划的updated_at作为版本号，版本和日期（影响已完成状态）都未变化时直接使用缓存，
+    否则重新序列化；多个worker进程各自缓存，依靠版本号保证不会读到其他进程修改前的数据
+    """
+    row = db.session.query(TravelPlan.user_id, TravelPlan.updated_at).filter_by(id=plan_id).first()
+    if not row:
+        return None
+    version = (row.updated_at.isoformat() if row.updated_at else '', date.today().isoformat())
+    entry = plan_detail_cache.get(plan_id)
+    if entry and entry['version'] == version:
+        return entry
+    
+    plan = TravelPlan.query.options(joinedload(TravelPlan.user)).filter_by(id=plan_id).first()
+    if not plan:
+        return None
+    data = serialize_plan(plan)
+    body = app.json.dumps(data)
+    shared_body = app.json.dumps({'success': True, **data, 'owner': plan.user.username})
+    entry = {
+        'version': version,
+        'user_id': plan.user_id,
+        'body': body,
+        'etag': hashlib.sha256(body.encode('utf-8')).hexdigest(),
+        'shared_body': shared_body,
+        'shared_etag': hashlib.sha256(shared_body.encode('utf-8')).hexdigest()
+    }
+    plan_detail_cache.set(plan_id, entry)
+    return entry
+
+def conditional_json_response(body, etag, cache_control):
+    """返回带强ETag的JSON响应，请求头If-None-Match匹配时返回304且不带响应体"""
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
 
 @app.route('/api/geocode')
 def geocode():
@@ -725,119 +968,194 @@ def geocode():
         return jsonify({'error': '地址参数缺失'}), 400
     
     try:
-        # 使用高德地图API进行地理编码
-        url = 'https://restapi.amap.com/v3/geocode/geo'
-        params = {
-            'key': app.config['AMAP_API_KEY'],
-            'address': address,
-            'output': 'JSON'
-        }
-        
-        response = requests.get(url, params=params)
-        data = response.json()
-        
-        if data['status'] == '1' and data['geocodes']:
-            location = data['geocodes'][0]['location'].split(',')
-            return jsonify({
-                'latitude': float(location[1]),
-                'longitude': float(location[0]),
-                'formatted_address': data['geocodes'][0]['formatted_address']
-            })
+        # 先查进程内缓存和数据库缓存，未命中时再调用高德地图API
+        result = geo_service.geocode(address)
+        if result:
+            return jsonify(result)
         else:
             return jsonify({'error': '地址解析失败'}), 400
             
     except Exception as e:
         return jsonify({'error': f'地理编码失败: {str(e)}'}), 500
 
-def merge_nearby_points(points, threshold=0.1):
-    # threshold单位：公里（0.1=100米）
-    if not points:
-        return []
-    merged = [points[0]]
-    for pt in points[1:]:
-        last = merged[-1]
-        # 计算两点距离
-        d = haversine(last, pt)
-        if d < threshold:
-            continue  # 距离太近，合并
-        merged.append(pt)
-    return merged
-
-def haversine(p1, p2):
-    # 经纬度距离计算，返回公里
-    lon1, lat1 = p1
-    lon2, lat2 = p2
-    R = 6371.0
-    dlon = radians(lon2 - lon1)
-    dlat = radians(lat2 - lat1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    return R * c
+@app.route('/api/geocode/batch', methods=['POST'])
+@login_required
+def geocode_batch():
+    """
+    批量地理编码：一次请求解析多个地址（自动去重，未命中缓存的地址并发解析），需登录，避免匿名调用消耗高德配额
+    传入plan_id时（需为计划所有者），未提供addresses则解析该计划中所有缺少坐标的地点，
+    并把解析到的坐标写回行程项目，之后打开计划不再需要地理编码
+    """
+    data = request.json or {}
+    plan_id = data.get('plan_id')
+    addresses = data.get('addresses')
+    
+    plan = None
+    missing_items = []
+    if plan_id:
+        plan = TravelPlan.query.filter_by(id=plan_id, user_id=session['user_id']).first()
+        if not plan:
+            return jsonify({'success': False, 'error': '计划不存在或无权限'}), 404
+        missing_items = ItineraryItem.query.join(Itinerary).filter(
+            Itinerary.travel_plan_id == plan.id,
+            ItineraryItem.location.isnot(None),
+            ItineraryItem.location != '',
+            db.or_(ItineraryItem.latitude.is_(None), ItineraryItem.longitude.is_(None))
+        ).all()
+        if addresses is None:
+            addresses = [item.location for item in missing_items]
+    
+    if not isinstance(addresses, list) or not all(isinstance(a, str) for a in addresses):
+        return jsonify({'success': False, 'error': 'addresses必须是地址字符串列表'}), 400
+    if len(set(addresses)) > app.config['GEOCODE_BATCH_MAX']:
+        return jsonify({'success': False, 'error': f"单次最多解析{app.config['GEOCODE_BATCH_MAX']}个地址"}), 400
+    
+    try:
+        results, errors = geo_service.geocode_many(addresses, max_workers=app.config['GEOCODE_BATCH_CONCURRENCY'])
+        
+        # 把解析结果写回计划中缺少坐标的行程项目
+        updated_items = 0
+        if plan:
+            for item in missing_items:
+                result = results.get(item.location)
+                if result:
+                    item.latitude = result['latitude']
+                    item.longitude = result['longitude']
+                    updated_items += 1
+            if updated_items:
+                plan.updated_at = datetime.utcnow()
+                db.session.commit()
+                plan_detail_cache.delete(plan.id)
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'errors': errors,
+            'updated_items': updated_items
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'批量地理编码失败: {str(e)}'}), 500
+
+def split_route_segments(points, max_points=16):
+    """把途经点按高德单次请求上限切分为多段，相邻两段共用衔接点，保证拼接后路线连续"""
+    if len(points) <= max_points:
+        return [points]
+    step = max_points - 1
+    return [points[i:i + max_points] for i in range(0, len(points) - 1, step)]
+
+def parse_route_args(data):
+    """
+    解析路线规划参数，返回 (参数字典, 错误信息)
+    days为每天一组 [[经度, 纬度], ...]，未传时把waypoints视为一天；zoom为可选的地图缩放级别（0-30）
+    """
+    if not isinstance(data, dict):
+        return None, '请求体应为JSON对象'
+    days = data.get('days') or [data.get('waypoints') or []]
+    if not isinstance(days, list) or not all(isinstance(day, list) for day in days):
+        return None, 'days应为坐标点列表的数组'
+    for day in days:
+        for point in day:
+            if not (isinstance(point, (list, tuple)) and len(point) == 2 and
+                    all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in point)):
+                return None, '坐标点格式应为 [经度, 纬度]'
+            if not (-180 <= point[0] <= 180 and -90 <= point[1] <= 90):
+                return None, '坐标点超出经纬度范围'
+    if sum(len(day) for day in days) < 2:
+        return None, '至少需要2个坐标点'
+    zoom = data.get('zoom')
+    if zoom is not None:
+        try:
+            if isinstance(zoom, bool):
+                raise TypeError
+            zoom = float(zoom)
+        except (TypeError, ValueError):
+            return None, 'zoom应为数字'
+        if not 0 <= zoom <= 30:
+            return None, 'zoom应在0到30之间'
+    return {'days': days, 'zoom': zoom}, None
 
 @app.route('/api/route-planning', methods=['POST'])
 def route_planning():
-    """路线规划服务"""
-    data = request.json
-    waypoints = data.get('waypoints', [])
-    if len(waypoints) < 2:
-        return jsonify({'error': '至少需要2个坐标点'}), 400
+    """
+    路线规划服务
+    waypoints为整条路线的坐标点；也可以传days（每天一组坐标点），按天分别规划，天与天之间不连线。
+    每天（或整条路线）的坐标点合并100米内的邻近点后，按每段最多16个点切分，各段并发规划后拼接返回，
+    segments中给出每段的距离、时间以及在polyline中的起止下标。
+    可选参数：format=encoded 返回差分编码的折线字符串；zoom 为地图缩放级别，传入时按该级别简化折线
+    """
+    data = request.get_json(silent=True)
+    params, error = parse_route_args(data)
+    if error:
+        return jsonify({'error': error}), 400
+    days = params['days']
     try:
-        # 合并邻近点
-        merged_points = merge_nearby_points(waypoints, threshold=0.1)  # 100米内合并
-        # 超过16点再抽样
-        if len(merged_points) > 16:
-            # 保留首尾，均匀抽样中间点
-            keep = [merged_points[0]]
-            n = len(merged_points) - 2
-            sample_count = 14
-            if n > 0:
-                step = max(1, n // sample_count)
-                keep += merged_points[1:-1][::step][:sample_count]
-            keep.append(merged_points[-1])
-            merged_points = keep
-        # 重新组装参数
-        origin = f"{merged_points[0][0]},{merged_points[0][1]}"
-        destination = f"{merged_points[-1][0]},{merged_points[-1][1]}"
-        via_points = []
-        if len(merged_points) > 2:
-            via_points = [f"{pt[0]},{pt[1]}" for pt in merged_points[1:-1]]
-        params = {
-            'key': app.config['AMAP_API_KEY'],
-            'origin': origin,
-            'destination': destination,
-            'strategy': 0,
-            'extensions': 'all',
-            'output': 'json'
-        }
-        if via_points:
-            params['waypoints'] = ';'.join(via_points)
-        url = 'https://restapi.amap.com/v3/direction/driving'
-        response = requests.get(url, params=params)
-        data = response.json()
-        if data['status'] == '1' and data['route']['paths']:
-            route = data['route']['paths'][0]
-            distance = float(route['distance']) / 1000
-            duration = int(route['duration']) // 60
-            polyline = []
-            for step in route['steps']:
-                if 'polyline' in step:
-                    step_points = step['polyline'].split(';')
-                    for point_str in step_points:
-                        if ',' in point_str:
-                            lng, lat = point_str.split(',')
-                            polyline.append([float(lng), float(lat)])
-            return jsonify({
-                'success': True,
-                'route': {
-                    'distance': round(distance, 1),
-                    'duration': duration,
-                    'polyline': polyline,
-                    'waypoints_count': len(merged_points)
-                }
+        # 合并邻近点后按天、按16个点切分为多段
+        segments = []
+        waypoints_count = 0
+        for day_index, day_points in enumerate(days):
+            merged_points = merge_nearby_points(day_points, threshold=0.1)  # 100米内合并
+            if len(merged_points) < 2:
+                continue
+            waypoints_count += len(merged_points)
+            for points in split_route_segments(merged_points):
+                segments.append((day_index + 1, points))
+        if not segments:
+            return jsonify({'error': '至少需要2个坐标点'}), 400
+        
+        # 各段并发规划；量化后的途经点相同的段直接使用缓存的路线（含已解析的折线）
+        routes = geo_service.driving_routes(
+            [points for _, points in segments],
+            max_workers=app.config['ROUTE_SEGMENT_CONCURRENCY']
+        )
+        
+        # 传入地图缩放级别时，按该级别下1像素的误差简化折线
+        zoom = params['zoom']
+        tolerance = zoom_tolerance(zoom, segments[0][1][0][1]) if zoom is not None else None
+        
+        polyline = []
+        segment_data = []
+        prev_day = None
+        for (day, points), (route, cached) in zip(segments, routes):
+            segment_polyline = route['polyline']
+            if tolerance is not None:
+                segment_polyline = simplify_polyline(segment_polyline, tolerance)
+            # 同一天相邻两段共用衔接点，拼接时去掉重复的第一个点
+            if day == prev_day and segment_polyline[:1] == polyline[-1:]:
+                segment_polyline = segment_polyline[1:]
+            prev_day = day
+            start = len(polyline)
+            polyline.extend(segment_polyline)
+            segment_data.append({
+                'day': day if data.get('days') else None,
+                'distance': route['distance'],
+                'duration': route['duration'],
+                'waypoints_count': len(points),
+                'polyline_range': [start, len(polyline)],
+                'cached': cached
             })
-        else:
-            error_msg = data.get('info', '路线规划失败')
-            return jsonify({'error': f'路线规划失败: {error_msg}'}), 400
+        
+        route_data = {
+            'distance': round(sum(route['distance'] for route, _ in routes), 1),
+            'duration': sum(route['duration'] for route, _ in routes),
+            'polyline': polyline,
+            'waypoints_count': waypoints_count,
+            'segments': segment_data
+        }
+        # format=encoded 时返回差分编码的折线字符串（经度在前，精度1e-5），默认仍为坐标数组
+        if data.get('format') == 'encoded':
+            route_data['polyline'] = encode_polyline(polyline, precision=5)
+            route_data['polyline_format'] = 'encoded'
+            route_data['polyline_precision'] = 5
+        
+        return jsonify({
+            'success': True,
+            'route': route_data,
+            'cached': all(cached for _, cached in routes)
+        })
+    except RouteError as e:
+        return jsonify({'error': f'路线规划失败: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': f'路线规划服务错误: {str(e)}'}), 500
 
@@ -885,6 +1203,7 @@ def delete_plan(plan_id):
         
         # 提交所有更改
         db.session.commit()
+        plan_detail_cache.delete(plan_id)
         
         return jsonify({'success': True, 'msg': '计划删除成功'})
         
@@ -895,16 +1214,17 @@ def delete_plan(plan_id):
         return jsonify({'success': False, 'msg': f'删除失败: {str(e)}'}), 500
 
 @app.route('/api/plan/<int:plan_id>/confirm', methods=['POST'])
+@login_required
 def confirm_plan(plan_id):
     """确认计划，将status从draft改为confirmed"""
-    plan = TravelPlan.query.get_or_404(plan_id)
+    user_id = session['user_id']
+    plan = TravelPlan.query.filter_by(id=plan_id, user_id=user_id).first_or_404()
     if plan.status != 'draft':
         return jsonify({'success': False, 'message': '该计划已确认或已完成'}), 400
     plan.status = 'confirmed'
-    from datetime import datetime
     plan.updated_at = datetime.utcnow()
-    from database.models import db
     db.session.commit()
+    plan_detail_cache.delete(plan_id)
     return jsonify({'success': True, 'message': '计划已确认'})
 
 @app.route('/api/plan/<int:plan_id>', methods=['PUT'])
@@ -936,60 +1256,159 @@ def update_plan(plan_id):
         plan.status = data.get('status', plan.status)
         plan.updated_at = datetime.utcnow()
         
-        # 处理行程数据
+        # 处理行程数据：按行程项ID与已有记录比对，只更新有变化的行、插入新增的行、删除被移除的行
+        changes = {'updated': 0, 'inserted': 0, 'deleted': 0, 'unchanged': 0}
         if 'itineraries' in data:
-            # 获取已有行程的映射
+            # 获取已有行程的映射，并一次性取出计划下的全部行程项
             existing_itineraries = {it.day_number: it for it in plan.itineraries}
+            existing_items = {}
+            for item in ItineraryItem.query.join(Itinerary).filter(Itinerary.travel_plan_id == plan.id).all():
+                existing_items.setdefault(item.itinerary_id, []).append(item)
             
             for itinerary_data in data['itineraries']:
                 day_number = itinerary_data.get('day_number')
                 
                 if day_number in existing_itineraries:
-                    # 更新已有行程
                     itinerary = existing_itineraries[day_number]
-                    
-                    # 删除原有的所有行程项
-                    for item in itinerary.itinerary_items:
-                        db.session.delete(item)
-                    
-                    # 添加新的行程项
-                    for idx, item_data in enumerate(itinerary_data.get('items', [])):
-                        # 处理时间格式，将中文冒号转换为英文冒号
-                        start_time_str = item_data.get('start_time', '00:00')
-                        end_time_str = item_data.get('end_time', '00:00')
-                        
-                        # 替换中文冒号为英文冒号
-                        if start_time_str:
-                            start_time_str = start_time_str.replace('：', ':')
-                        if end_time_str:
-                            end_time_str = end_time_str.replace('：', ':')
-                        
-                        start_time = datetime.strptime(start_time_str, '%H:%M').time() if start_time_str else None
-                        end_time = datetime.strptime(end_time_str, '%H:%M').time() if end_time_str else None
-                        
-                        new_item = ItineraryItem(
-                            itinerary_id=itinerary.id,
-                            title=item_data.get('title', ''),
-                            start_time=start_time,
-                            end_time=end_time,
-                            location=item_data.get('location', ''),
-                            description=item_data.get('description', ''),
-                            activity_type=item_data.get('activity_type', 'visit'),
-                            estimated_cost=item_data.get('estimated_cost', 0),
-                            latitude=item_data.get('latitude'),
-                            longitude=item_data.get('longitude'),
-                            order_index=idx
-                        )
-                        db.session.add(new_item)
+                    day_changes = sync_itinerary_items(
+                        itinerary, existing_items.get(itinerary.id, []), itinerary_data.get('items', [])
+                    )
+                    for key, count in day_changes.items():
+                        changes[key] += count
         
         db.session.commit()
-        return jsonify({'success': True, 'msg': '计划更新成功'})
+        plan_detail_cache.delete(plan_id)
+        return jsonify({'success': True, 'msg': '计划更新成功', 'changes': changes})
     
     except Exception as e:
         db.session.rollback()
         print(f"更新计划时出错: {str(e)}")
         return jsonify({'success': False, 'msg': f'更新计划时出错: {str(e)}'}), 500
 
+def sync_itinerary_items(itinerary, existing_items, items_data):
+    """
+    将提交的行程项列表同步到某一天的已有行程项上，返回各类变更的行数
+    带id且属于该天的行程项原地更新（字段无变化则不写库），不带id的视为新增，未再出现的已有行程项被删除
+    """
+    changes = {'updated': 0, 'inserted': 0, 'deleted': 0, 'unchanged': 0}
+    items_by_id = {item.id: item for item in existing_items}
+    kept_ids = set()
+    
+    for idx, item_data in enumerate(items_data):
+        fields = parse_itinerary_item_fields(item_data, idx)
+        item = items_by_id.get(item_data.get('id'))
+        
+        if item is None or item.id in kept_ids:
+            db.session.add(ItineraryItem(itinerary_id=itinerary.id, **fields))
+            changes['inserted'] += 1
+            continue
+        
+        kept_ids.add(item.id)
+        changed = False
+        for key, value in fields.items():
+            if getattr(item, key) != value:
+                setattr(item, key, value)
+                changed = True
+        changes['updated' if changed else 'unchanged'] += 1
+    
+    for item in existing_items:
+        if item.id not in kept_ids:
+            db.session.delete(item)
+            changes['deleted'] += 1
+    
+    return changes
+
+@app.route('/api/plan/<int:plan_id>/optimize-route', methods=['POST'])
+@login_required
+def optimize_plan_route(plan_id):
+    """
+    优化计划每天的游览顺序（最近邻 + 2-opt，本地计算，不调用地图接口）
+    每天的第一个行程项、固定时间的行程项（用餐、住宿、交通等）以及没有坐标的行程项保持原位置；
+    其余行程项调整顺序后沿用所在位置原来的时间段。传dry_run=true只返回结果不保存
+    """
+    user_id = session['user_id']
+    plan = TravelPlan.query.filter_by(id=plan_id, user_id=user_id).first_or_404()
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'msg': '请求体应为JSON对象'}), 400
+    dry_run = bool(data.get('dry_run', False))
+    day_numbers = data.get('days')
+    if day_numbers is not None and not (
+            isinstance(day_numbers, list) and
+            all(isinstance(d, int) and not isinstance(d, bool) for d in day_numbers)):
+        return jsonify({'success': False, 'msg': 'days应为天数（整数）列表'}), 400
+    pinned_types = data.get('pinned_types')
+    if pinned_types is not None and not (
+            isinstance(pinned_types, list) and all(isinstance(t, str) for t in pinned_types)):
+        return jsonify({'success': False, 'msg': 'pinned_types应为活动类型字符串列表'}), 400
+    pinned_types = set(pinned_types or app.config['ROUTE_PINNED_ACTIVITY_TYPES'])
+    
+    try:
+        itineraries = Itinerary.query.filter_by(travel_plan_id=plan.id).order_by(Itinerary.day_number).all()
+        items_by_itinerary = {}
+        for item in ItineraryItem.query.join(Itinerary).filter(
+            Itinerary.travel_plan_id == plan.id
+        ).order_by(ItineraryItem.order_index, ItineraryItem.id).all():
+            items_by_itinerary.setdefault(item.itinerary_id, []).append(item)
+        
+        days = []
+        updated_items = 0
+        for itinerary in itineraries:
+            if day_numbers and itinerary.day_number not in day_numbers:
+                continue
+            items = items_by_itinerary.get(itinerary.id, [])
+            
+            # 只对有坐标的行程项排序，没有坐标的行程项保持原位置
+            located = [item for item in items if item.latitude is not None and item.longitude is not None]
+            points = [[item.longitude, item.latitude] for item in located]
+            fixed = [pos == 0 or item.activity_type in pinned_types for pos, item in enumerate(located)]
+            order, before, after = optimize_visit_order(points, fixed)
+            
+            changed = order != list(range(len(located)))
+            if changed:
+                slots = [(item.start_time, item.end_time) for item in located]
+                reordered = [located[i] for i in order]
+                new_sequence = iter(reordered)
+                new_items = [next(new_sequence) if item in located else item for item in items]
+                
+                if not dry_run:
+                    # 被移动的行程项沿用新位置原来的时间段，固定的行程项时间不变
+                    for pos, item in enumerate(reordered):
+                        if not fixed[pos]:
+                            item.start_time, item.end_time = slots[pos]
+                    for idx, item in enumerate(new_items):
+                        if item.order_index != idx:
+                            item.order_index = idx
+                            updated_items += 1
+                items = new_items
+            
+            days.append({
+                'day_number': itinerary.day_number,
+                'before_km': round(before, 2),
+                'after_km': round(after, 2),
+                'saved_km': round(before - after, 2),
+                'changed': changed,
+                'order': [item.id for item in items]
+            })
+        
+        if updated_items:
+            plan.updated_at = datetime.utcnow()
+            db.session.commit()
+            plan_detail_cache.delete(plan.id)
+        
+        return jsonify({
+            'success': True,
+            'dry_run': dry_run,
+            'days': days,
+            'total_saved_km': round(sum(day['saved_km'] for day in days), 2),
+            'updated_items': updated_items
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"优化路线时出错: {str(e)}")
+        return jsonify({'success': False, 'msg': f'优化路线失败: {str(e)}'}), 500
+
 @app.route('/api/plan/<int:plan_id>/notes', methods=['GET'])
 @login_required
 def get_notes(plan_id):
@@ -1205,11 +1624,7 @@ def note_detail(note_id):
             
             elif shared_moment.visibility == 'friends':
                 # 仅好友可见，检查是否是好友关系
-                from database.models import Friend
-                is_friend = Friend.query.filter(
-                    ((Friend.user_id == current_user_id) & (Friend.friend_id == shared_moment.user_id)) |
-                    ((Friend.user_id == shared_moment.user_id) & (Friend.friend_id == current_user_id))
-                ).first() is not None
+                is_friend = friend_graph.are_friends(current_user_id, shared_moment.user_id)
                 
                 if is_friend:
                     return render_template('note_detail.html', 
@@ -1239,11 +1654,7 @@ def note_detail(note_id):
                                          reason='您没有权限查看此游记，该内容为私密分享')
         
         # 2. 如果没有分享，检查是否有其他访问权限（如好友关系）
-        from database.models import Friend
-        is_friend_of_owner = Friend.query.filter(
-            ((Friend.user_id == current_user_id) & (Friend.friend_id == plan.user_id)) |
-            ((Friend.user_id == plan.user_id) & (Friend.friend_id == current_user_id))
-        ).first() is not None
+        is_friend_of_owner = friend_graph.are_friends(current_user_id, plan.user_id)
         
         if is_friend_of_owner:
             # 是游记主人的好友，可以查看（需要游记主人的设置允许）
@@ -1308,25 +1719,16 @@ def register():
     db.session.commit()
     return jsonify({'success': True})
 
-# 任务清理函数（可选）
-def cleanup_old_tasks():
-    """定期清理旧任务"""
-    current_time = datetime.now()
-    to_remove = []
-    
-    for task_id, task in tasks.items():
-        created_time = datetime.fromisoformat(task['created_at'])
-        # 已完成或失败的任务保留1小时
-        if task['status'] in ['completed', 'failed'] and (current_time - created_time).total_seconds() > 3600:
-            to_remove.append(task_id)
-        # 待处理或处理中但超过2小时的任务视为失败
-        elif task['status'] in ['pending', 'processing'] and (current_time - created_time).total_seconds() > 7200:
-            task['status'] = 'failed'
-            task['error'] = '任务处理超时'
-            to_remove.append(task_id)
-    
-    for task_id in to_remove:
-        tasks.pop(task_id, None)
+@app.cli.command('reconcile-moment-counters')
+def reconcile_moment_counters_command():
+    """按实际点赞和评论记录修正动态的冗余计数：flask reconcile-moment-counters"""
+    fixed = reconcile_moment_counters()
+    print(f"已修正 {fixed} 条动态的计数")
+
+@app.cli.command('rebuild-moment-timelines')
+def rebuild_moment_timelines_command():
+    """按现有动态和好友关系重建动态时间线（开启MOMENT_TIMELINE_ENABLED前执行一次）：flask rebuild-moment-timelines"""
+    rebuild_timelines()
 
 # 好友管理相关API
 @app.route('/friends')
@@ -1347,19 +1749,8 @@ def get_friends():
     """获取当前用户的好友列表"""
     user_id = session.get('user_id')
     
-    # 获取作为发起方的好友
-    friends_sent = Friend.query.filter_by(user_id=user_id).all()
-    friends_sent_ids = [f.friend_id for f in friends_sent]
-    
-    # 获取作为接收方的好友
-    friends_received = Friend.query.filter_by(friend_id=user_id).all()
-    friends_received_ids = [f.user_id for f in friends_received]
-    
-    # 合并好友ID
-    friend_ids = list(set(friends_sent_ids + friends_received_ids))
-    
     # 查询好友信息
-    friends = User.query.filter(User.id.in_(friend_ids)).all()
+    friends = User.query.filter(User.id.in_(friend_graph.friend_ids(user_id))).all()
     
     return jsonify({
         'success': True,
@@ -1408,13 +1799,7 @@ def search_users():
     ).limit(10).all()
     
     # 获取好友ID列表
-    friends_sent = Friend.query.filter_by(user_id=user_id).all()
-    friends_sent_ids = [f.friend_id for f in friends_sent]
-    
-    friends_received = Friend.query.filter_by(friend_id=user_id).all()
-    friends_received_ids = [f.user_id for f in friends_received]
-    
-    friend_ids = set(friends_sent_ids + friends_received_ids)
+    friend_ids = friend_graph.friend_ids(user_id)
     
     # 获取已发送请求的用户ID
     sent_requests = FriendRequest.query.filter_by(
@@ -1453,16 +1838,15 @@ def send_friend_request():
             'success': False,
             'msg': '请求参数不完整'
         })
+    try:
+        receiver_id = int(receiver_id)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'msg': '用户ID无效'}), 400
     
     sender_id = session.get('user_id')
     
     # 检查是否已经是好友
-    is_friend = Friend.query.filter(
-        ((Friend.user_id == sender_id) & (Friend.friend_id == receiver_id)) |
-        ((Friend.user_id == receiver_id) & (Friend.friend_id == sender_id))
-    ).first()
-    
-    if is_friend:
+    if friend_graph.are_friends(sender_id, receiver_id):
         return jsonify({
             'success': False,
             'msg': '你们已经是好友了'
@@ -1560,6 +1944,9 @@ def respond_friend_request():
             friend_request.status = 'accepted'
             db.session.add(friendship1)
             db.session.add(friendship2)
+            db.session.flush()
+            # 把双方已发布的动态补进对方的时间线
+            link_friends(user_id, friend_request.sender_id)
             db.session.commit()
             
             return jsonify({
@@ -1594,6 +1981,10 @@ def delete_friend():
     friend_id = request.json.get('friend_id')
     if not friend_id:
         return jsonify({'success': False, 'msg': '参数错误'})
+    try:
+        friend_id = int(friend_id)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'msg': '用户ID无效'}), 400
     
     # 找到双向的好友关系
     friend_relation1 = Friend.query.filter_by(user_id=session['user_id'], friend_id=friend_id).first()
@@ -1606,6 +1997,8 @@ def delete_friend():
         # 删除好友关系
         db.session.delete(friend_relation1)
         db.session.delete(friend_relation2)
+        db.session.flush()
+        unlink_friends(session['user_id'], friend_relation1.friend_id)
         
         # 同时删除与该好友的聊天记录
         from database.models import Message
@@ -1641,10 +2034,7 @@ def chat_page(friend_id):
     """聊天页面"""
     friend = User.query.get_or_404(friend_id)
     # 检查是否是好友关系（双向检查）
-    is_friend = Friend.query.filter(
-        ((Friend.user_id == session['user_id']) & (Friend.friend_id == friend_id)) |
-        ((Friend.user_id == friend_id) & (Friend.friend_id == session['user_id']))
-    ).first() is not None
+    is_friend = friend_graph.are_friends(session['user_id'], friend_id)
     
     if not is_friend:
         return redirect(url_for('friends_page'))
@@ -1658,19 +2048,28 @@ def get_messages(friend_id):
     from database.models import Message
     
     # 验证是否是好友关系（双向检查）
-    is_friend = Friend.query.filter(
-        ((Friend.user_id == session['user_id']) & (Friend.friend_id == friend_id)) |
-        ((Friend.user_id == friend_id) & (Friend.friend_id == session['user_id']))
-    ).first() is not None
+    is_friend = friend_graph.are_friends(session['user_id'], friend_id)
     
     if not is_friend:
         return jsonify({'success': False, 'msg': '非好友关系'})
     
-    # 获取与该好友的所有聊天记录（发送和接收的）
-    messages = Message.query.filter(
+    # 获取与该好友的聊天记录（发送和接收的）
+    query = Message.query.filter(
         ((Message.sender_id == session['user_id']) & (Message.receiver_id == friend_id)) |
         ((Message.sender_id == friend_id) & (Message.receiver_id == session['user_id']))
-    ).order_by(Message.created_at).all()
+    )
+    next_cursor = None
+    if keyset_requested(request.args) or 'limit' in request.args:
+        # 游标分页：取最近的limit条（或游标之前更早的limit条），向上滚动时用next_cursor加载更早的消息
+        try:
+            position = parse_keyset_args(request.args)
+        except InvalidCursor as e:
+            return jsonify({'success': False, 'msg': str(e)}), 400
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        messages, next_cursor = keyset_page(query, Message.created_at, Message.id, position, limit)
+        messages.reverse()
+    else:
+        messages = query.order_by(Message.created_at, Message.id).all()
     
     # 将获取的消息标记为已读
     unread_messages = Message.query.filter_by(
@@ -1697,6 +2096,7 @@ def get_messages(friend_id):
     return jsonify({
         'success': True, 
         'messages': messages_data,
+        'next_cursor': next_cursor,
         'friend': {
             'id': friend_id,
             'username': User.query.get(friend_id).username
@@ -1714,12 +2114,13 @@ def send_message():
     
     if not receiver_id or not content or not content.strip():
         return jsonify({'success': False, 'msg': '参数错误'})
+    try:
+        receiver_id = int(receiver_id)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'msg': '用户ID无效'}), 400
     
     # 验证是否是好友关系（双向检查）
-    is_friend = Friend.query.filter(
-        ((Friend.user_id == session['user_id']) & (Friend.friend_id == receiver_id)) |
-        ((Friend.user_id == receiver_id) & (Friend.friend_id == session['user_id']))
-    ).first() is not None
+    is_friend = friend_graph.are_friends(session['user_id'], receiver_id)
     
     if not is_friend:
         return jsonify({'success': False, 'msg': '非好友关系'})
@@ -1785,112 +2186,108 @@ def moments_page():
 @login_required
 def get_moments():
     """获取动态列表"""
-    from database.models import Moment, MomentLike, MomentComment, Friend
+    from database.models import Moment
     
     user_id = session['user_id']
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = max(request.args.get('per_page', 10, type=int), 1)
     filter_type = request.args.get('filter', 'all')  # all, friends, mine
     
     # 获取所有好友ID
-    friends_sent = Friend.query.filter_by(user_id=user_id).all()
-    friends_sent_ids = [f.friend_id for f in friends_sent]
+    friend_ids = friend_graph.friend_ids(user_id)
     
-    friends_received = Friend.query.filter_by(friend_id=user_id).all()
-    friends_received_ids = [f.user_id for f in friends_received]
-    
-    friend_ids = list(set(friends_sent_ids + friends_received_ids))
-    
-    # 根据筛选类型构建查询
+    # 根据筛选类型构建查询条件
     if filter_type == 'mine':
         # 只查看自己的动态
-        query = Moment.query.filter_by(user_id=user_id)
+        criteria = [Moment.user_id == user_id]
     elif filter_type == 'friends':
         # 查看好友的动态（好友可见或公开）
-        query = Moment.query.filter(
-            Moment.user_id.in_(friend_ids),
-            Moment.visibility.in_(['public', 'friends'])
-        )
+        criteria = [Moment.user_id.in_(friend_ids), Moment.visibility.in_(['public', 'friends'])]
     else:  # all
         # 查看所有可见动态：自己的所有动态 + 好友的好友可见/公开动态 + 其他人的公开动态
-        query = Moment.query.filter(
-            db.or_(
-                Moment.user_id == user_id,  # 自己的所有动态
-                db.and_(
-                    Moment.user_id.in_(friend_ids),  # 好友的动态
-                    Moment.visibility.in_(['public', 'friends'])  # 可见性为公开或好友可见
-                ),
-                db.and_(
-                    ~Moment.user_id.in_(friend_ids + [user_id]),  # 非好友且非自己的动态
-                    Moment.visibility == 'public'  # 可见性为公开
-                )
+        criteria = [visible_moments_filter(user_id, friend_ids)]
+    
+    if keyset_requested(request.args):
+        # 游标分页：按 (created_at, id) 定位，不使用OFFSET，总数只在with_total=1时统计
+        try:
+            position = parse_keyset_args(request.args)
+        except InvalidCursor as e:
+            return jsonify({'success': False, 'msg': str(e)}), 400
+        if filter_type != 'mine' and timeline_enabled():
+            # 从物化的时间线读取本页ID，再连同作者和点赞状态一次查出
+            moment_ids, next_cursor = timeline_page(
+                user_id, friend_ids, position, per_page,
+                include_self=filter_type == 'all', include_public=filter_type == 'all'
             )
-        )
+            by_id = {row[0].id: row for row in feed_query(user_id, Moment.id.in_(moment_ids)).all()}
+            rows = [by_id[moment_id] for moment_id in moment_ids if moment_id in by_id]
+        else:
+            rows, next_cursor = keyset_page(
+                feed_query(user_id, *criteria), Moment.created_at, Moment.id, position, per_page,
+                key=lambda row: (row[0].created_at, row[0].id)
+            )
+        pagination = {'per_page': per_page, 'next_cursor': next_cursor, 'has_next': next_cursor is not None}
+        if request.args.get('with_total') == '1':
+            pagination['total'] = Moment.query.filter(*criteria).count()
+        return jsonify({
+            'success': True,
+            'moments': [serialize_feed_row(row, user_id, friend_ids) for row in rows],
+            'pagination': pagination
+        })
+    
+    # 总数单独统计，列表连同作者、点赞数、评论数和点赞状态一次查出，按时间倒序分页
+    total = Moment.query.filter(*criteria).count()
+    rows = feed_query(user_id, *criteria).order_by(
+        Moment.created_at.desc(), Moment.id.desc()
+    ).limit(per_page).offset((page - 1) * per_page).all()
+    pages = (total + per_page - 1) // per_page
+    
+    # 返回分页信息
+    return jsonify({
+        'success': True,
+        'moments': [serialize_feed_row(row, user_id, friend_ids) for row in rows],
+        'pagination': {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': pages,
+            'has_next': page < pages,
+            'has_prev': page > 1
+        }
+    })
+
+@app.route('/api/moments/nearby', methods=['GET'])
+@login_required
+def get_nearby_moments():
+    """附近的动态（仅当前用户可见的），按距离由近到远排序"""
+    params, error = parse_nearby_args()
+    if error:
+        return jsonify({'success': False, 'msg': error}), 400
     
-    # 按时间倒序排序
-    query = query.order_by(Moment.created_at.desc())
+    user_id = session['user_id']
+    friend_ids = friend_graph.friend_ids(user_id)
     
-    # 分页
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-    moments = pagination.items
+    # 可见性规则与动态列表一致
+    query = Moment.query.options(joinedload(Moment.user)).filter(visible_moments_filter(user_id, friend_ids))
+    results = query_nearby(query, Moment, params)
     
-    # 格式化结果
-    result = []
-    for moment in moments:
-        # 检查当前用户是否点赞
-        is_liked = MomentLike.query.filter_by(
-            moment_id=moment.id,
-            user_id=user_id
-        ).first() is not None
-        
-        # 获取评论数量
-        comment_count = MomentComment.query.filter_by(moment_id=moment.id).count()
-        
-        # 获取点赞数量
-        like_count = MomentLike.query.filter_by(moment_id=moment.id).count()
-        
-        # 确定用户关系
-        is_self = moment.user_id == user_id
-        is_friend = moment.user_id in friend_ids
-        
-        # 格式化媒体数据
-        media = json.loads(moment.media) if moment.media else []
-        
-        moment_data = {
+    return jsonify({
+        'success': True,
+        'moments': [{
             'id': moment.id,
             'user_id': moment.user_id,
             'username': moment.user.username,
             'content': moment.content,
-            'media': media,
+            'media': json.loads(moment.media) if moment.media else [],
             'location': moment.location,
             'latitude': moment.latitude,
             'longitude': moment.longitude,
             'visibility': moment.visibility,
-            'note_id': moment.note_id,  # 添加关联的游记ID
-            'note_title': moment.note_title,  # 添加关联的游记标题
             'created_at': moment.created_at.isoformat(),
-            'updated_at': moment.updated_at.isoformat(),
-            'is_liked': is_liked,
-            'like_count': like_count,
-            'comment_count': comment_count,
-            'is_self': is_self,
-            'is_friend': is_friend,
-            'comments': []
-        }
-        result.append(moment_data)
-    
-    # 返回分页信息
-    return jsonify({
-        'success': True,
-        'moments': result,
-        'pagination': {
-            'page': page,
-            'per_page': per_page,
-            'total': pagination.total,
-            'pages': pagination.pages,
-            'has_next': pagination.has_next,
-            'has_prev': pagination.has_prev
-        }
+            'is_self': moment.user_id == user_id,
+            'is_friend': moment.user_id in friend_ids,
+            'distance_km': round(distance, 3) if distance is not None else None
+        } for moment, distance in results]
     })
 
 @app.route('/api/moments', methods=['POST'])
@@ -1918,6 +2315,9 @@ def create_moment():
         )
         
         db.session.add(moment)
+        db.session.flush()
+        # 写入作者和好友的时间线，与动态一起提交
+        fan_out_moment(moment)
         db.session.commit()
         
         return jsonify({
@@ -1933,7 +2333,7 @@ def create_moment():
 @login_required
 def get_moment_detail(moment_id):
     """获取动态详情"""
-    from database.models import Moment, MomentLike, MomentComment, Friend
+    from database.models import Moment, MomentLike, MomentComment
     
     user_id = session['user_id']
     
@@ -1941,13 +2341,7 @@ def get_moment_detail(moment_id):
     moment = Moment.query.get_or_404(moment_id)
     
     # 获取好友ID列表
-    friends_sent = Friend.query.filter_by(user_id=user_id).all()
-    friends_sent_ids = [f.friend_id for f in friends_sent]
-    
-    friends_received = Friend.query.filter_by(friend_id=user_id).all()
-    friends_received_ids = [f.user_id for f in friends_received]
-    
-    friend_ids = list(set(friends_sent_ids + friends_received_ids))
+    friend_ids = friend_graph.friend_ids(user_id)
     
     # 检查权限
     if moment.user_id != user_id:
@@ -1962,12 +2356,6 @@ def get_moment_detail(moment_id):
         user_id=user_id
     ).first() is not None
     
-    # 获取评论数量
-    comment_count = MomentComment.query.filter_by(moment_id=moment.id).count()
-    
-    # 获取点赞数量
-    like_count = MomentLike.query.filter_by(moment_id=moment.id).count()
-    
     # 获取所有评论
     comments = MomentComment.query.filter_by(
         moment_id=moment.id,
@@ -2020,8 +2408,8 @@ def get_moment_detail(moment_id):
         'created_at': moment.created_at.isoformat(),
         'updated_at': moment.updated_at.isoformat(),
         'is_liked': is_liked,
-        'like_count': like_count,
-        'comment_count': comment_count,
+        'like_count': moment.like_count,
+        'comment_count': moment.comment_count,
         'is_self': is_self,
         'is_friend': is_friend,
         'comments': comments_data
@@ -2058,11 +2446,14 @@ def update_moment(moment_id):
         moment.location = data.get('location')
         moment.latitude = data.get('latitude')
         moment.longitude = data.get('longitude')
+        previous_visibility = moment.visibility
         moment.visibility = data.get('visibility', moment.visibility)
         # 保留游记关联信息，不允许通过编辑修改
         # moment.note_id 和 moment.note_title 保持不变
         moment.updated_at = datetime.utcnow()
         
+        if moment.visibility != previous_visibility:
+            sync_moment_visibility(moment, previous_visibility)
         db.session.commit()
         
         return jsonify({
@@ -2089,6 +2480,7 @@ def delete_moment(moment_id):
         return jsonify({'success': False, 'msg': '无权删除该动态'}), 403
     
     try:
+        remove_moment(moment.id)
         db.session.delete(moment)
         db.session.commit()
         
@@ -2104,7 +2496,7 @@ def delete_moment(moment_id):
 @login_required
 def like_moment(moment_id):
     """点赞动态"""
-    from database.models import Moment, MomentLike, Friend
+    from database.models import Moment, MomentLike
     
     user_id = session['user_id']
     
@@ -2112,13 +2504,7 @@ def like_moment(moment_id):
     moment = Moment.query.get_or_404(moment_id)
     
     # 获取好友ID列表
-    friends_sent = Friend.query.filter_by(user_id=user_id).all()
-    friends_sent_ids = [f.friend_id for f in friends_sent]
-    
-    friends_received = Friend.query.filter_by(friend_id=user_id).all()
-    friends_received_ids = [f.user_id for f in friends_received]
-    
-    friend_ids = list(set(friends_sent_ids + friends_received_ids))
+    friend_ids = friend_graph.friend_ids(user_id)
     
     # 检查权限
     if moment.user_id != user_id:
@@ -2144,11 +2530,10 @@ def like_moment(moment_id):
         )
         
         db.session.add(like)
+        # 点赞记录和点赞数在同一事务中提交
+        like_count, _ = adjust_moment_counters(moment_id, likes=1)
         db.session.commit()
         
-        # 获取最新点赞数
-        like_count = MomentLike.query.filter_by(moment_id=moment_id).count()
-        
         return jsonify({
             'success': True,
             'msg': '点赞成功',
@@ -2163,6 +2548,7 @@ def like_moment(moment_id):
 def unlike_moment(moment_id):
     """取消点赞动态"""
     from database.models import MomentLike
+    from sqlalchemy import delete
     
     user_id = session['user_id']
     
@@ -2176,12 +2562,11 @@ def unlike_moment(moment_id):
         return jsonify({'success': False, 'msg': '尚未点赞该动态'}), 400
     
     try:
-        db.session.delete(like)
+        # 按实际删除的行数调整点赞数，并发重复取消时不会多减
+        deleted = db.session.execute(delete(MomentLike).where(MomentLike.id == like.id)).rowcount
+        like_count, _ = adjust_moment_counters(moment_id, likes=-deleted)
         db.session.commit()
         
-        # 获取最新点赞数
-        like_count = MomentLike.query.filter_by(moment_id=moment_id).count()
-        
         return jsonify({
             'success': True,
             'msg': '取消点赞成功',
@@ -2195,7 +2580,7 @@ def unlike_moment(moment_id):
 @login_required
 def comment_moment(moment_id):
     """评论动态"""
-    from database.models import Moment, MomentComment, Friend
+    from database.models import Moment, MomentComment
     
     user_id = session['user_id']
     
@@ -2203,13 +2588,7 @@ def comment_moment(moment_id):
     moment = Moment.query.get_or_404(moment_id)
     
     # 获取好友ID列表
-    friends_sent = Friend.query.filter_by(user_id=user_id).all()
-    friends_sent_ids = [f.friend_id for f in friends_sent]
-    
-    friends_received = Friend.query.filter_by(friend_id=user_id).all()
-    friends_received_ids = [f.user_id for f in friends_received]
-    
-    friend_ids = list(set(friends_sent_ids + friends_received_ids))
+    friend_ids = friend_graph.friend_ids(user_id)
     
     # 检查权限
     if moment.user_id != user_id:
@@ -2232,6 +2611,8 @@ def comment_moment(moment_id):
         )
         
         db.session.add(comment)
+        # 评论和评论数在同一事务中提交
+        _, comment_count = adjust_moment_counters(moment_id, comments=1)
         db.session.commit()
         
         # 格式化评论数据
@@ -2244,9 +2625,6 @@ def comment_moment(moment_id):
             'replies': []
         }
         
-        # 获取最新评论数
-        comment_count = MomentComment.query.filter_by(moment_id=moment_id).count()
-        
         return jsonify({
             'success': True,
             'msg': '评论成功',
@@ -2275,20 +2653,20 @@ def delete_comment(comment_id):
     moment_id = comment.moment_id
     
     try:
-        # 递归删除所有回复
+        # 递归删除所有回复，返回删除的回复数
         def delete_replies(comment_id):
             replies = MomentComment.query.filter_by(parent_id=comment_id).all()
+            deleted = 0
             for reply in replies:
-                delete_replies(reply.id)
+                deleted += delete_replies(reply.id) + 1
                 db.session.delete(reply)
+            return deleted
         
-        delete_replies(comment_id)
+        deleted = delete_replies(comment_id) + 1
         db.session.delete(comment)
+        _, comment_count = adjust_moment_counters(moment_id, comments=-deleted)
         db.session.commit()
         
-        # 获取最新评论数
-        comment_count = MomentComment.query.filter_by(moment_id=moment_id).count()
-        
         return jsonify({
             'success': True,
             'msg': '评论删除成功',
@@ -2326,18 +2704,28 @@ def get_expenses():
         if plan_id:
             query = query.filter_by(plan_id=plan_id)
         
-        # 按时间倒序排列
-        query = query.order_by(Expense.expense_date.desc())
-        
-        # 分页
-        pagination = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
+        if keyset_requested(request.args):
+            # 游标分页：按 (expense_date, id) 定位，不使用OFFSET，总数只在with_total=1时统计
+            try:
+                position = parse_keyset_args(request.args)
+            except InvalidCursor as e:
+                return jsonify({'success': False, 'msg': str(e)}), 400
+            items, next_cursor = keyset_page(query, Expense.expense_date, Expense.id, position, per_page)
+            pagination = None
+        else:
+            # 按时间倒序排列
+            query = query.order_by(Expense.expense_date.desc())
+            
+            # 分页
+            pagination = query.paginate(
+                page=page, 
+                per_page=per_page, 
+                error_out=False
+            )
+            items = pagination.items
         
         expenses = []
-        for expense in pagination.items:
+        for expense in items:
             expenses.append({
                 'id': expense.id,
                 'amount': expense.amount,
@@ -2355,6 +2743,18 @@ def get_expenses():
                 'created_at': expense.created_at.isoformat()
             })
         
+        if pagination is None:
+            result = {
+                'success': True,
+                'expenses': expenses,
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'has_next': next_cursor is not None
+            }
+            if request.args.get('with_total') == '1':
+                result['total'] = query.order_by(None).count()
+            return jsonify(result)
+        
         return jsonify({
             'success': True,
             'expenses': expenses,
@@ -2477,25 +2877,12 @@ def upload_receipt():
             # 获取相对路径用于存储
             relative_path = f"/static/uploads/receipts/{filename}"
             
-            # 创建异步OCR任务
-            task_id = str(uuid.uuid4())
-            
-            tasks[task_id] = {
-                'status': 'pending',
-                'created_at': datetime.now().isoformat(),
-                'user_id': session['user_id'],
-                'task_type': 'ocr_receipt',
+            # 创建异步OCR任务，交给后台线程池处理
+            # 截图保存在本机磁盘上，任务只能在本机执行
+            task_id = task_queue.submit('ocr_receipt', session['user_id'], {
                 'file_path': file_path,
                 'relative_path': relative_path
-            }
-            
-            # 启动后台线程处理OCR
-            thread = threading.Thread(
-                target=process_ocr_task,
-                args=(task_id, file_path, relative_path)
-            )
-            thread.daemon = True
-            thread.start()
+            }, pin_host=True)
             
             return jsonify({
                 'success': True,
@@ -2506,6 +2893,8 @@ def upload_receipt():
         else:
             return jsonify({'success': False, 'msg': '不支持的文件格式'}), 400
             
+    except QueueFull as e:
+        return queue_full_response(e, key='msg')
     except Exception as e:
         print(f"上传截图失败: {str(e)}")
         return jsonify({'success': False, 'msg': f'上传截图失败: {str(e)}'}), 500
@@ -2514,21 +2903,29 @@ def process_ocr_task(task_id, file_path, relative_path):
     """后台处理OCR识别任务"""
     print(f"=== OCR任务开始处理，任务ID: {task_id} ===")
     try:
-        tasks[task_id]['status'] = 'processing'
-        
         # 调用OCR识别服务
         recognition_result = ocr_service.recognize_payment_receipt(file_path)
         recognition_result['receipt_image'] = relative_path
         
         # 更新任务状态
-        tasks[task_id]['status'] = 'completed'
-        tasks[task_id]['result'] = recognition_result
+        task_queue.complete(task_id, recognition_result)
         
     except Exception as e:
         print(f"OCR识别失败: {str(e)}")
-        print(f"=== 任务状态已更新为completed，任务ID: {task_id} ===")
-        tasks[task_id]['status'] = 'failed'
-        tasks[task_id]['error'] = f'OCR识别失败: {str(e)}'
+        task_queue.fail(task_id, f'OCR识别失败: {str(e)}')
+
+# 注册后台任务处理函数，每类任务使用独立的线程池
+task_queue.register('plan_generation', process_plan_generation_task, pool='plan')
+task_queue.register('travel_report', process_report_generation_task, pool='report')
+task_queue.register('ocr_receipt', process_ocr_task, pool='ocr')
+
+def reconcile_moment_counters_job():
+    """定期修正动态的冗余点赞数/评论数（由任务队列的维护线程调用）"""
+    with app.app_context():
+        reconcile_moment_counters()
+
+task_queue.register_periodic(geo_service.cleanup)
+task_queue.register_periodic(reconcile_moment_counters_job)
 
 @app.route('/api/expenses/stats', methods=['GET'])
 @login_required
@@ -2766,24 +3163,10 @@ def reports_page():
 def generate_travel_report():
     """提交生成旅行报告的异步任务"""
     try:
-        # 创建任务ID
-        task_id = str(uuid.uuid4())
-        
-        # 存储任务信息
-        tasks[task_id] = {
-            'status': 'pending',
-            'created_at': datetime.now().isoformat(),
-            'user_id': session['user_id'],
-            'task_type': 'travel_report'
-        }
-        
-        # 启动后台线程处理
-        thread = threading.Thread(
-            target=process_report_generation_task,
-            args=(task_id, session['user_id'])
-        )
-        thread.daemon = True
-        thread.start()
+        # 登记任务并交给后台线程池处理
+        task_id = task_queue.submit('travel_report', session['user_id'], {
+            'user_id': session['user_id']
+        })
         
         # 立即返回任务ID
         return jsonify({
@@ -2792,6 +3175,8 @@ def generate_travel_report():
             'message': '旅行报告生成任务已提交，请稍后查询结果'
         })
         
+    except QueueFull as e:
+        return queue_full_response(e)
     except Exception as e:
         print(f"提交生成报告任务失败: {str(e)}")
         return jsonify({'success': False, 'error': f'提交任务失败: {str(e)}'}), 500
@@ -2885,65 +3270,18 @@ def generate_share_link(plan_id):
 def get_shared_plan_detail(plan_id, share_token):
     """获取公开分享的计划详情"""
     try:
-        plan = TravelPlan.query.get_or_404(plan_id)
+        entry = get_plan_detail_entry(plan_id)
+        if not entry:
+            return jsonify({'success': False, 'msg': '计划不存在'}), 404
         
         # 验证分享token
-        import hashlib
-        expected_token = hashlib.md5(f"{plan.id}_{plan.user_id}_travel_agent_share".encode()).hexdigest()[:8]
+        expected_token = hashlib.md5(f"{plan_id}_{entry['user_id']}_travel_agent_share".encode()).hexdigest()[:8]
         
         if share_token != expected_token:
             return jsonify({'success': False, 'msg': '分享链接无效'}), 403
         
-        # 返回计划数据（类似于原有的get_plan_detail，但不需要登录验证）
-        today = date.today()
-        plan_end_date = plan.end_date if isinstance(plan.end_date, date) else datetime.strptime(plan.end_date, '%Y-%m-%d').date()
-        if plan_end_date < today:
-            status = 'completed'
-        else:
-            status = plan.status
-            
-        itineraries = []
-        for itinerary in plan.itineraries:
-            items = []
-            for item in itinerary.itinerary_items:
-                items.append({
-                    'id': item.id,
-                    'start_time': item.start_time.strftime('%H:%M'),
-                    'end_time': item.end_time.strftime('%H:%M') if item.end_time else None,
-                    'activity_type': item.activity_type,
-                    'title': item.title,
-                    'description': item.description,
-                    'location': item.location,
-                    'latitude': item.latitude,
-                    'longitude': item.longitude,
-                    'estimated_cost': item.estimated_cost,
-                    'order_index': item.order_index
-                })
-            itineraries.append({
-                'id': itinerary.id,
-                'day_number': itinerary.day_number,
-                'date': itinerary.date.isoformat(),
-                'theme': itinerary.theme,
-                'notes': itinerary.notes,
-                'items': sorted(items, key=lambda x: x['order_index'])
-            })
-            
-        return jsonify({
-            'success': True,
-            'id': plan.id,
-            'title': plan.title,
-            'start_date': plan.start_date.isoformat(),
-            'end_date': plan.end_date.isoformat(),
-            'total_days': plan.total_days,
-            'budget_min': plan.budget_min,
-            'budget_max': plan.budget_max,
-            'travel_theme': plan.travel_theme,
-            'transport_mode': plan.transport_mode,
-            'status': status,
-            'ai_generated': plan.ai_generated,
-            'owner': plan.user.username,
-            'itineraries': sorted(itineraries, key=lambda x: x['day_number'])
-        })
+        # 返回计划数据（与get_plan_detail共用缓存和序列化逻辑，但不需要登录验证）
+        return conditional_json_response(entry['shared_body'], entry['shared_etag'], 'public, no-cache')
         
     except Exception as e:
         return jsonify({'success': False, 'msg': f'获取计划数据失败: {str(e)}'}), 500
@@ -3146,10 +3484,5 @@ if __name__ == '__main__':
     else:
         print("🏠 本地开发环境")
     
-    # 启动清理任务线程
-    cleanup_thread = threading.Thread(target=cleanup_old_tasks)
-    cleanup_thread.daemon = True
-    cleanup_thread.start()
-    
     print(f"🌍 Travel Agent启动在 {host}:{port}")
     app.run(host=host, port=port, debug=os.environ.get('DEBUG', 'False').lower() == 'true') 
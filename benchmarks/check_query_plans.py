@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+热点查询执行计划检查
+在种子数据上对各接口的热点查询执行EXPLAIN，任一查询对表做全表扫描（SQLite的 "SCAN 表名"、
+PostgreSQL的 "Seq Scan"）时以非零状态退出，用于确认组合索引已建好且被使用。
+默认使用临时SQLite数据库；设置CHECK_DATABASE_URL时改用该数据库（必须是空的测试库，会在其中建表和写入数据），
+PostgreSQL上会关闭enable_seqscan，只要存在可用索引计划器就会选择它，避免小数据量下误报
+
+用法：python benchmarks/check_query_plans.py
+      CHECK_DATABASE_URL=postgresql://... python benchmarks/check_query_plans.py
+"""
+
+import os
+import random
+import re
+import sys
+import tempfile
+from datetime import date, datetime, time as dtime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from config import Config
+
+Config.SQLALCHEMY_DATABASE_URI = os.environ.get('CHECK_DATABASE_URL') or \
+    'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'check.db')
+Config.TASK_BACKEND = 'memory'
+
+from sqlalchemy import and_, func, or_, select, text
+
+from app import app
+from database.models import (db, User, TravelPlan, Itinerary, ItineraryItem, TravelNote, Friend, FriendRequest,
+                             Message, Moment, MomentLike, MomentComment, MomentTimeline, Expense)
+from timeline_service import rebuild_timelines
+
+USERS = 200
+PLANS_PER_USER = 5
+MOMENTS_PER_USER = 20
+EXPENSES_PER_USER = 50
+MESSAGES = 20000
+
+
+def seed():
+    """写入足够多的数据，让计划器在有索引时不会倾向全表扫描"""
+    random.seed(7)
+    now = datetime.utcnow()
+    today = date.today()
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'user{i}', 'password_hash': 'x', 'created_at': now} for i in range(1, USERS + 1)
+    ])
+
+    plans, itineraries, items, notes = [], [], [], []
+    for user_id in range(1, USERS + 1):
+        for _ in range(PLANS_PER_USER):
+            start = today + timedelta(days=random.randint(-400, 200))
+            plans.append({'title': '计划', 'start_date': start, 'end_date': start + timedelta(days=2), 'total_days': 3,
+                          'status': 'draft', 'user_id': user_id, 'created_at': now, 'updated_at': now})
+    db.session.execute(TravelPlan.__table__.insert(), plans)
+    for plan_id in range(1, len(plans) + 1):
+        notes.append({'plan_id': plan_id, 'title': '游记', 'created_at': now, 'updated_at': now})
+        for day in range(1, 4):
+            itineraries.append({'day_number': day, 'date': today, 'travel_plan_id': plan_id})
+    db.session.execute(TravelNote.__table__.insert(), notes)
+    db.session.execute(Itinerary.__table__.insert(), itineraries)
+    for itinerary_id in range(1, len(itineraries) + 1):
+        for order in range(4):
+            items.append({'start_time': dtime(9 + order), 'activity_type': 'visit', 'title': '项目',
+                          'order_index': order, 'itinerary_id': itinerary_id})
+    db.session.execute(ItineraryItem.__table__.insert(), items)
+
+    friends = set()
+    while len(friends) < USERS * 5:
+        a, b = random.sample(range(1, USERS + 1), 2)
+        friends.add((a, b))
+    db.session.execute(Friend.__table__.insert(), [
+        {'user_id': a, 'friend_id': b, 'created_at': now} for a, b in friends
+    ])
+    db.session.execute(FriendRequest.__table__.insert(), [
+        {'sender_id': a, 'receiver_id': b, 'status': random.choice(['pending', 'accepted', 'rejected']),
+         'created_at': now, 'updated_at': now} for a, b in friends
+    ])
+
+    moments = []
+    for user_id in range(1, USERS + 1):
+        for i in range(MOMENTS_PER_USER):
+            moments.append({'user_id': user_id, 'content': '动态', 'note_id': random.randint(1, len(notes)) if i == 0 else None,
+                            'visibility': random.choice(['public', 'public', 'friends', 'private']),
+                            'created_at': now - timedelta(minutes=random.randint(0, 100000)), 'updated_at': now})
+    db.session.execute(Moment.__table__.insert(), moments)
+    likes, comments = set(), []
+    for _ in range(len(moments) * 3):
+        likes.add((random.randint(1, len(moments)), random.randint(1, USERS)))
+    db.session.execute(MomentLike.__table__.insert(), [
+        {'moment_id': m, 'user_id': u, 'created_at': now} for m, u in likes
+    ])
+    for i in range(len(moments) * 2):
+        comments.append({'moment_id': random.randint(1, len(moments)), 'user_id': random.randint(1, USERS),
+                         'content': '评论', 'parent_id': random.randint(1, i) if i and random.random() < 0.3 else None,
+                         'created_at': now})
+    db.session.execute(MomentComment.__table__.insert(), comments)
+
+    db.session.execute(Message.__table__.insert(), [
+        {'sender_id': random.randint(1, USERS), 'receiver_id': random.randint(1, USERS), 'content': '消息',
+         'is_read': random.random() < 0.8, 'created_at': now - timedelta(minutes=i)} for i in range(MESSAGES)
+    ])
+    db.session.execute(Expense.__table__.insert(), [
+        {'user_id': user_id, 'plan_id': random.choice([None, (user_id - 1) * PLANS_PER_USER + 1]), 'amount': 10,
+         'category': '餐饮', 'expense_date': now - timedelta(days=random.randint(0, 700)), 'created_at': now,
+         'updated_at': now}
+        for user_id in range(1, USERS + 1) for _ in range(EXPENSES_PER_USER)
+    ])
+    db.session.commit()
+    rebuild_timelines()
+
+
+def hot_queries():
+    """与各接口一致的热点查询，(名称, 语句)"""
+    user_id, friend_id, plan_id, moment_id = 7, 8, 31, 100
+    today = date.today()
+    month_start = datetime(today.year, today.month, 1)
+    friend_ids = [8, 9, 10]
+    return [
+        ('消费列表', select(Expense).where(Expense.user_id == user_id)
+            .order_by(Expense.expense_date.desc()).limit(20)),
+        ('本月消费统计', select(Expense).where(Expense.user_id == user_id, Expense.expense_date >= month_start)),
+        ('计划消费', select(Expense).where(Expense.plan_id == plan_id, Expense.user_id == user_id)),
+        ('我的动态', select(Moment).where(Moment.user_id == user_id).order_by(Moment.created_at.desc()).limit(10)),
+        ('好友动态', select(Moment).where(Moment.user_id.in_(friend_ids), Moment.visibility.in_(['public', 'friends']))
+            .order_by(Moment.created_at.desc()).limit(10)),
+        ('动态时间线', select(MomentTimeline.moment_id).where(MomentTimeline.user_id == user_id)
+            .order_by(MomentTimeline.created_at.desc(), MomentTimeline.moment_id.desc()).limit(10)),
+        ('游记分享动态', select(Moment).where(Moment.note_id == 5).limit(1)),
+        ('聊天记录', select(Message).where(or_(
+            and_(Message.sender_id == user_id, Message.receiver_id == friend_id),
+            and_(Message.sender_id == friend_id, Message.receiver_id == user_id)
+        )).order_by(Message.created_at)),
+        ('未读消息', select(Message).where(Message.sender_id == friend_id, Message.receiver_id == user_id,
+                                       Message.is_read.is_(False))),
+        ('未读消息数', select(func.count(Message.id)).where(Message.receiver_id == user_id, Message.is_read.is_(False))),
+        ('点赞数', select(func.count(MomentLike.id)).where(MomentLike.moment_id == moment_id)),
+        ('是否已点赞', select(MomentLike).where(MomentLike.moment_id == moment_id, MomentLike.user_id == user_id)),
+        ('评论数', select(func.count(MomentComment.id)).where(MomentComment.moment_id == moment_id)),
+        ('顶级评论', select(MomentComment).where(MomentComment.moment_id == moment_id, MomentComment.parent_id.is_(None))
+            .order_by(MomentComment.created_at)),
+        ('评论回复', select(MomentComment).where(MomentComment.parent_id == 3).order_by(MomentComment.created_at)),
+        ('已完成计划数', select(func.count(TravelPlan.id)).where(TravelPlan.user_id == user_id, TravelPlan.end_date < today)),
+        ('我的计划', select(TravelPlan).where(TravelPlan.user_id == user_id)),
+        ('我添加的好友', select(Friend).where(Friend.user_id == user_id)),
+        ('添加我的好友', select(Friend).where(Friend.friend_id == user_id)),
+        ('待处理好友请求', select(FriendRequest).where(FriendRequest.receiver_id == user_id,
+                                               FriendRequest.status == 'pending')),
+        ('计划行程', select(Itinerary).where(Itinerary.travel_plan_id == plan_id).order_by(Itinerary.day_number)),
+        ('计划行程项目', select(ItineraryItem).join(Itinerary).where(Itinerary.travel_plan_id == plan_id)
+            .order_by(ItineraryItem.itinerary_id, ItineraryItem.order_index)),
+        ('计划游记', select(TravelNote).where(TravelNote.plan_id == plan_id)),
+    ]
+
+
+def explain(statement):
+    """返回 (执行计划文本, 全表扫描的表名列表)"""
+    dialect = db.engine.dialect.name
+    sql = str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    if dialect == 'sqlite':
+        rows = db.session.execute(text('EXPLAIN QUERY PLAN ' + sql)).fetchall()
+        lines = [row[-1] for row in rows]
+        scans = [m.group(1) for line in lines for m in [re.match(r'SCAN (\w+)$', line)] if m]
+    else:
+        rows = db.session.execute(text('EXPLAIN ' + sql)).fetchall()
+        lines = [row[0] for row in rows]
+        scans = [m.group(1) for line in lines for m in [re.search(r'Seq Scan on (\w+)', line)] if m]
+    return '\n'.join(lines), scans
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        if db.session.execute(select(func.count(User.id))).scalar():
+            print('数据库中已有数据，请使用空的测试数据库')
+            sys.exit(2)
+        seed()
+        if db.engine.dialect.name == 'sqlite':
+            db.session.execute(text('ANALYZE'))
+        else:
+            db.session.execute(text('ANALYZE'))
+            db.session.execute(text('SET enable_seqscan = off'))
+
+        failures = 0
+        for name, statement in hot_queries():
+            plan, scans = explain(statement)
+            status = 'OK  ' if not scans else 'FAIL'
+            print(f'[{status}] {name}')
+            if scans:
+                failures += 1
+                print('       全表扫描: ' + ', '.join(scans))
+                print('       ' + plan.replace('\n', '\n       '))
+        print(f'\n共 {len(hot_queries())} 条查询，{failures} 条全表扫描')
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
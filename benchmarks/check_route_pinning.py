@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI计划路线优化检查
+按AI返回格式构造一天的行程（中午的用餐夹在两个远处景点之间），用save_generated_plan保存后调用
+/api/plan/<id>/optimize-route，确认用餐和住宿保持原来的位置和时间，只有景点被调整顺序。
+分别检查AI给出activity_type和未给出（按活动名称推断，例如旧的缓存结果）两种情况，任一失败时以非零状态退出
+
+用法：python benchmarks/check_route_pinning.py
+"""
+
+import os
+import sys
+import tempfile
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from config import Config
+
+Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'check.db')
+Config.TASK_BACKEND = 'memory'
+
+from app import app, save_generated_plan
+from database.models import db, User, ItineraryItem
+from route_optimizer import optimize_visit_order
+
+# 东西两片景点来回穿插，不固定用餐时最优顺序会把午餐挪到别处
+DAY_ITEMS = [
+    {'time': '09:00', 'activity': '参观西湖', 'activity_type': 'visit', 'longitude': 120.140, 'latitude': 30.250},
+    {'time': '10:30', 'activity': '游览东区博物馆', 'activity_type': 'visit', 'longitude': 120.240, 'latitude': 30.250},
+    {'time': '12:00', 'activity': '午餐', 'activity_type': 'meal', 'location': '西湖边餐厅',
+     'longitude': 120.141, 'latitude': 30.251},
+    {'time': '14:00', 'activity': '东区古街', 'activity_type': 'visit', 'longitude': 120.241, 'latitude': 30.251},
+    {'time': '16:00', 'activity': '西区公园', 'activity_type': 'visit', 'longitude': 120.142, 'latitude': 30.252},
+    {'time': '18:00', 'activity': '晚餐', 'activity_type': 'meal', 'location': '东区夜市',
+     'longitude': 120.242, 'latitude': 30.252},
+    {'time': '20:00', 'activity': '入住酒店', 'activity_type': 'rest', 'longitude': 120.143, 'latitude': 30.253},
+]
+PINNED = ('午餐', '晚餐', '入住酒店')
+
+
+def ai_result(with_types):
+    items = [dict(item) for item in DAY_ITEMS]
+    if not with_types:
+        for item in items:
+            item.pop('activity_type')
+    return {'title': '检查计划', 'days': [{'day': 1, 'theme': '', 'items': items}], 'total_cost': 0}
+
+
+def check(client, user, with_types):
+    plan = save_generated_plan(user, ai_result(with_types), ['杭州'], 1, 0, 1000, '', '', date.today())
+    before = {item.title: (item.order_index, item.start_time)
+              for item in ItineraryItem.query.filter(ItineraryItem.itinerary.has(travel_plan_id=plan.id))}
+
+    resp = client.post(f'/api/plan/{plan.id}/optimize-route', json={})
+    body = resp.get_json()
+    assert resp.status_code == 200 and body['success'], body
+    db.session.expire_all()
+    after = {item.title: (item.order_index, item.start_time)
+             for item in ItineraryItem.query.filter(ItineraryItem.itinerary.has(travel_plan_id=plan.id))}
+
+    label = '带activity_type' if with_types else '按名称推断'
+    failures = 0
+    for title in PINNED:
+        ok = before[title] == after[title]
+        failures += not ok
+        print(f"[{'OK  ' if ok else 'FAIL'}] {label}: {title} {before[title][1]:%H:%M} 第{before[title][0] + 1}项 -> "
+              f"{after[title][1]:%H:%M} 第{after[title][0] + 1}项")
+    moved = body['updated_items'] > 0
+    failures += not moved
+    print(f"[{'OK  ' if moved else 'FAIL'}] {label}: 景点顺序已优化，减少{body['total_saved_km']}公里")
+    return failures
+
+
+def main():
+    # 先确认数据本身会被重排：只固定第一项时用餐不会留在原位
+    points = [[item['longitude'], item['latitude']] for item in DAY_ITEMS]
+    order, _, _ = optimize_visit_order(points, [pos == 0 for pos in range(len(points))])
+    assert order[2] != 2, '测试数据不能体现固定位置的效果'
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='route_check', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user.id
+
+        failures = check(client, user, True) + check(client, user, False)
+        print(f'\n{failures} 项失败')
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
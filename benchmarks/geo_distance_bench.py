@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+距离计算基准
+对比原来逐点调用标量haversine的Python循环与geo_distance模块的批量实现：
+  - 合并邻近点（merge_nearby_points，阈值100米）
+  - 路径总长度
+  - 距离矩阵（只在1k点规模比较，10万点的矩阵需要约80GB内存）
+数据分两类：密集GPS轨迹（点间距约20米并带停留漂移，大部分点会被合并）和分散的景点坐标（大部分点会保留）
+
+用法：python benchmarks/geo_distance_bench.py
+"""
+
+import math
+import os
+import random
+import sys
+import time
+from math import radians, cos, sin, sqrt, atan2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from geo_distance import distance_matrix, merge_nearby_points, path_length
+
+SIZES = [1000, 10000, 100000]
+
+
+def scalar_haversine(p1, p2):
+    # 原app.py中的标量实现
+    lon1, lat1 = p1
+    lon2, lat2 = p2
+    R = 6371.0
+    dlon = radians(lon2 - lon1)
+    dlat = radians(lat2 - lat1)
+    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1-a))
+    return R * c
+
+
+def scalar_merge(points, threshold=0.1):
+    # 原app.py中的标量实现
+    if not points:
+        return []
+    merged = [points[0]]
+    for pt in points[1:]:
+        last = merged[-1]
+        d = scalar_haversine(last, pt)
+        if d < threshold:
+            continue
+        merged.append(pt)
+    return merged
+
+
+def scalar_path_length(points):
+    return sum(scalar_haversine(points[i], points[i + 1]) for i in range(len(points) - 1))
+
+
+def gps_track(n):
+    """
+    模拟GPS轨迹：每步约20米、方向缓慢变化地行进，
+    不时在景点停留一段时间，停留期间坐标在5米范围内漂移
+    """
+    lng, lat = 116.39, 39.91
+    heading = random.uniform(0, 2 * math.pi)
+    points = []
+    while len(points) < n:
+        if random.random() < 0.01:
+            for _ in range(random.randint(50, 300)):
+                points.append([lng + random.uniform(-5e-5, 5e-5), lat + random.uniform(-5e-5, 5e-5)])
+        heading += random.gauss(0, 0.2)
+        lng += 0.00018 * math.cos(heading) / math.cos(math.radians(lat))
+        lat += 0.00018 * math.sin(heading)
+        points.append([lng, lat])
+    return points[:n]
+
+
+def scattered(n):
+    """模拟分散的景点坐标：城市范围内均匀分布"""
+    return [[116.0 + random.random(), 39.6 + random.random()] for _ in range(n)]
+
+
+def timed(fn, *args, repeat=3):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    random.seed(42)
+    print(f"{'数据':<8} {'点数':>8} {'操作':<10} {'标量ms':>10} {'批量ms':>10} {'加速比':>8}")
+    for name, generator in (('GPS轨迹', gps_track), ('分散坐标', scattered)):
+        for n in SIZES:
+            points = generator(n)
+
+            scalar_ms, expected = timed(scalar_merge, points)
+            batch_ms, merged = timed(merge_nearby_points, points)
+            assert merged == expected, '合并结果与标量实现不一致'
+            print(f'{name:<8} {n:>8} {"合并邻近点":<10} {scalar_ms:>10.1f} {batch_ms:>10.1f} {scalar_ms / batch_ms:>7.1f}x')
+
+            scalar_ms, expected = timed(scalar_path_length, points)
+            batch_ms, total = timed(path_length, points)
+            assert abs(total - expected) < 1e-6 * max(1.0, expected)
+            print(f'{name:<8} {n:>8} {"路径长度":<10} {scalar_ms:>10.1f} {batch_ms:>10.1f} {scalar_ms / batch_ms:>7.1f}x')
+
+    points = scattered(1000)
+    scalar_ms, _ = timed(lambda pts: [[scalar_haversine(a, b) for b in pts] for a in pts], points, repeat=1)
+    batch_ms, _ = timed(distance_matrix, points)
+    print(f'{"分散坐标":<8} {1000:>8} {"距离矩阵":<10} {scalar_ms:>10.1f} {batch_ms:>10.1f} {scalar_ms / batch_ms:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
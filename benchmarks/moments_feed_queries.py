@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+动态列表查询次数回归检查
+在临时SQLite数据库中生成带点赞和评论的动态，统计 /api/moments 每页执行的SQL条数，
+并与逐条统计的结果核对点赞数、评论数和点赞状态。每页50条时SQL条数超过MAX_QUERIES
+或随每页条数增长时以非零状态退出
+
+用法：python benchmarks/moments_feed_queries.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from config import Config
+
+_db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + _db_file
+Config.TASK_BACKEND = 'memory'
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from app import app
+from friend_service import friend_graph
+from moment_service import reconcile_moment_counters
+from database.models import db, User, Friend, Moment, MomentLike, MomentComment
+
+USERS = 30
+MOMENTS = 300
+PAGE_SIZES = [10, 50]
+MAX_QUERIES = 5  # 好友查询（缓存未命中时）+ 总数 + 列表，外加余量
+REPEAT = 20
+
+
+def seed():
+    random.seed(11)
+    users = [User(username=f'user{i}', password_hash=generate_password_hash('bench')) for i in range(USERS)]
+    db.session.add_all(users)
+    db.session.flush()
+    viewer = users[0]
+    for friend in users[1:10]:
+        db.session.add(Friend(user_id=viewer.id, friend_id=friend.id))
+    moments = [Moment(user_id=random.choice(users).id, content=f'动态{i}',
+                      visibility=random.choice(['public', 'friends', 'private'])) for i in range(MOMENTS)]
+    db.session.add_all(moments)
+    db.session.flush()
+    for moment in moments:
+        for liker in random.sample(users, random.randint(0, 8)):
+            db.session.add(MomentLike(moment_id=moment.id, user_id=liker.id))
+        for _ in range(random.randint(0, 5)):
+            db.session.add(MomentComment(moment_id=moment.id, user_id=random.choice(users).id, content='评论'))
+    db.session.commit()
+    # 直接写入的点赞和评论不会更新冗余计数，由修正任务补齐
+    reconcile_moment_counters()
+    return viewer.id
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        viewer_id = seed()
+        engine = db.engine
+
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = viewer_id
+
+    failed = False
+    counts = {}
+    print(f"{'筛选':<8} {'每页':>6} {'条数':>6} {'SQL':>6} {'耗时ms':>8}")
+    for filter_type in ('all', 'friends', 'mine'):
+        for per_page in PAGE_SIZES:
+            url = f'/api/moments?filter={filter_type}&per_page={per_page}'
+            # 按好友缓存未命中统计，结果不受执行顺序影响
+            friend_graph.cache.clear()
+            statements.clear()
+            resp = client.get(url)
+            assert resp.status_code == 200, resp.get_data(as_text=True)
+            moments = resp.get_json()['moments']
+            counts[(filter_type, per_page)] = len(statements)
+
+            with app.app_context():
+                for m in moments:
+                    assert m['like_count'] == MomentLike.query.filter_by(moment_id=m['id']).count()
+                    assert m['comment_count'] == MomentComment.query.filter_by(moment_id=m['id']).count()
+                    liked = MomentLike.query.filter_by(moment_id=m['id'], user_id=viewer_id).first() is not None
+                    assert m['is_liked'] == liked
+                    assert m['username'] == db.session.get(User, m['user_id']).username
+
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                client.get(url)
+            elapsed = (time.perf_counter() - start) / REPEAT * 1000
+            print(f'{filter_type:<8} {per_page:>6} {len(moments):>6} {counts[(filter_type, per_page)]:>6} {elapsed:>8.2f}')
+
+            if per_page == 50 and counts[(filter_type, per_page)] > MAX_QUERIES:
+                print(f'  每页50条执行了 {counts[(filter_type, per_page)]} 条SQL，超过上限 {MAX_QUERIES}')
+                failed = True
+        if counts[(filter_type, PAGE_SIZES[0])] != counts[(filter_type, PAGE_SIZES[-1])]:
+            print(f'  {filter_type} 的SQL条数随每页条数增长')
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+计划详情接口查询次数基准
+在临时SQLite数据库中生成不同天数的计划，统计 /api/plan/<id> 与 /api/shared-plan/<id>/<token>
+每次请求执行的SQL条数和耗时，用于确认查询次数不随行程天数增长
+
+用法：python benchmarks/plan_detail_queries.py [每天项目数]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import date, time as dtime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from config import Config
+
+_db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + _db_file
+Config.TASK_BACKEND = 'memory'
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from app import app
+from database.models import db, User, TravelPlan, Itinerary, ItineraryItem
+
+DAY_COUNTS = [1, 3, 7, 14, 30]
+REPEAT = 20
+
+
+def create_plan(user_id, days, items_per_day):
+    start = date.today() + timedelta(days=30)
+    plan = TravelPlan(title=f'{days}日游', start_date=start, end_date=start + timedelta(days=days - 1),
+                      total_days=days, budget_min=1000, budget_max=5000, status='draft', user_id=user_id)
+    db.session.add(plan)
+    db.session.flush()
+    for d in range(1, days + 1):
+        itinerary = Itinerary(day_number=d, date=start + timedelta(days=d - 1), travel_plan_id=plan.id)
+        db.session.add(itinerary)
+        db.session.flush()
+        # 故意倒序插入，验证排序由数据库完成
+        for i in reversed(range(items_per_day)):
+            db.session.add(ItineraryItem(start_time=dtime(8 + i % 12), activity_type='visit', title=f'D{d}-{i}',
+                                         location='故宫博物院', order_index=i, itinerary_id=itinerary.id))
+    db.session.commit()
+    return plan.id
+
+
+def main():
+    items_per_day = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    import hashlib
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', password_hash=generate_password_hash('bench'))
+        db.session.add(user)
+        db.session.commit()
+        plan_ids = {days: create_plan(user.id, days, items_per_day) for days in DAY_COUNTS}
+        user_id = user.id
+        engine = db.engine
+
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+
+    print(f'每天 {items_per_day} 个行程项目，每组请求 {REPEAT} 次')
+    print(f"{'天数':>6} {'项目数':>8} {'详情SQL':>8} {'分享SQL':>8} {'详情ms':>8} {'分享ms':>8}")
+    for days, plan_id in plan_ids.items():
+        token = hashlib.md5(f"{plan_id}_{user_id}_travel_agent_share".encode()).hexdigest()[:8]
+        row = []
+        timings = []
+        for url in (f'/api/plan/{plan_id}', f'/api/shared-plan/{plan_id}/{token}'):
+            statements.clear()
+            resp = client.get(url)
+            assert resp.status_code == 200, resp.get_data(as_text=True)
+            body = resp.get_json()
+            assert [it['day_number'] for it in body['itineraries']] == list(range(1, days + 1))
+            assert all([i['order_index'] for i in it['items']] == list(range(items_per_day)) for it in body['itineraries'])
+            row.append(len(statements))
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                client.get(url)
+            timings.append((time.perf_counter() - start) / REPEAT * 1000)
+        print(f'{days:>6} {days * items_per_day:>8} {row[0]:>8} {row[1]:>8} {timings[0]:>8.2f} {timings[1]:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
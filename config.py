@@ -20,6 +20,52 @@ class Config:
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # AI计划生成是否默认使用流式模式（逐天解析并推送给前端，生成完成后批量入库），请求中的stream字段可覆盖
+    PLAN_STREAMING = os.environ.get('PLAN_STREAMING', 'true').lower() == 'true'
+    
+    # AI计划生成缓存：相同目的地/天数/预算档位/主题/交通的请求直接复用生成结果
+    PLAN_CACHE_TTL = int(os.environ.get('PLAN_CACHE_TTL') or 24 * 3600)  # 秒
+    PLAN_CACHE_SIZE = int(os.environ.get('PLAN_CACHE_SIZE') or 256)  # 最多缓存条目数
+    PLAN_CACHE_BUDGET_BAND = 500  # 预算分档宽度（元）
+    
+    # 计划详情响应缓存（按计划ID缓存序列化结果，通过updated_at校验版本）
+    PLAN_DETAIL_CACHE_TTL = int(os.environ.get('PLAN_DETAIL_CACHE_TTL') or 600)  # 秒
+    PLAN_DETAIL_CACHE_SIZE = int(os.environ.get('PLAN_DETAIL_CACHE_SIZE') or 512)
+    
+    # 后台任务配置
+    # database：任务状态存储在数据库中，所有worker进程共享；memory：仅当前进程可见（开发/测试用）
+    TASK_BACKEND = os.environ.get('TASK_BACKEND') or 'database'
+    # 每类任务独立的线程池：workers为每个进程的并发数，max_queue为最大排队数，超出时返回429
+    TASK_POOLS = {
+        'plan': {
+            'workers': int(os.environ.get('PLAN_TASK_WORKERS') or 4),
+            'max_queue': int(os.environ.get('PLAN_TASK_MAX_QUEUE') or 20)
+        },
+        'report': {
+            'workers': int(os.environ.get('REPORT_TASK_WORKERS') or 2),
+            'max_queue': int(os.environ.get('REPORT_TASK_MAX_QUEUE') or 10)
+        },
+        'ocr': {
+            'workers': int(os.environ.get('OCR_TASK_WORKERS') or 4),
+            'max_queue': int(os.environ.get('OCR_TASK_MAX_QUEUE') or 30)
+        }
+    }
+    TASK_RESULT_TTL = 3600  # 已完成/失败任务的保留时间（秒）
+    TASK_TIMEOUT = 7200  # 超过该时间仍未完成的任务视为失败（秒）
+    # 任务租约：每个进程每隔HEARTBEAT_INTERVAL秒为自己持有的任务续租，超过LEASE_TIMEOUT秒未续租
+    # （进程重启或崩溃）的任务由其他进程接管重新执行，执行中断达到MAX_ATTEMPTS次后标记为失败
+    TASK_HEARTBEAT_INTERVAL = 15
+    TASK_LEASE_TIMEOUT = 60
+    TASK_MAX_ATTEMPTS = 2
+    TASK_LONG_POLL_MAX = int(os.environ.get('TASK_LONG_POLL_MAX') or 30)  # /api/task/<id>?wait= 长轮询的最长等待时间（秒）
+    TASK_EVENTS_MAX = int(os.environ.get('TASK_EVENTS_MAX') or 30)  # /api/task/<id>/events 单个SSE连接的最长保持时间（秒）
+    # 长轮询和SSE连接各占用一个gunicorn线程：每个进程最多同时挂起TASK_MAX_WAITERS个，
+    # 超出时立即返回，客户端改为每隔TASK_SHORT_POLL_INTERVAL秒轮询一次，避免占满线程拖垮其他请求
+    TASK_MAX_WAITERS = int(os.environ.get('TASK_MAX_WAITERS') or 4)
+    TASK_SHORT_POLL_INTERVAL = 3
+    # 任务在其他进程执行时，挂起的连接每隔多少秒查询一次数据库（本进程执行的任务更新时直接唤醒）
+    TASK_WAIT_POLL_INTERVAL = float(os.environ.get('TASK_WAIT_POLL_INTERVAL') or 2.5)
+    
     # Deepseek API配置
     DEEPSEEK_API_KEY = os.environ.get('DEEPSEEK_API_KEY') or 'your-deepseek-api-key'
     DEEPSEEK_BASE_URL = 'https://api.deepseek.com'
@@ -28,6 +74,61 @@ class Config:
     AMAP_API_KEY = os.environ.get('AMAP_API_KEY') or 'your-amap-api-key'
     AMAP_WEB_KEY = os.environ.get('AMAP_WEB_KEY') or 'your-amap-web-key'
     
+    # 地理编码缓存：进程内LRU + 数据库缓存表，解析失败的地址缓存较短时间
+    GEOCODE_TIMEOUT = 5  # 调用高德接口的超时时间（秒）
+    GEOCODE_CACHE_TTL = 30 * 24 * 3600  # 解析成功结果的有效期（秒）
+    GEOCODE_NEGATIVE_TTL = 24 * 3600  # 解析失败结果的有效期（秒）
+    GEOCODE_MEMORY_CACHE_SIZE = int(os.environ.get('GEOCODE_MEMORY_CACHE_SIZE') or 2048)
+    GEOCODE_MEMORY_CACHE_TTL = 3600  # 进程内缓存有效期（秒）
+    GEOCODE_BATCH_MAX = 200  # 批量地理编码单次最多地址数（去重后）
+    GEOCODE_BATCH_CONCURRENCY = 4  # 批量地理编码并发调用高德接口的最大线程数
+    
+    # 驾车路线规划：结果按量化到100米网格的途经点缓存在进程内
+    ROUTE_TIMEOUT = 10  # 调用高德接口的超时时间（秒）
+    ROUTE_CACHE_TTL = int(os.environ.get('ROUTE_CACHE_TTL') or 24 * 3600)  # 秒
+    ROUTE_CACHE_SIZE = int(os.environ.get('ROUTE_CACHE_SIZE') or 512)
+    ROUTE_SEGMENT_CONCURRENCY = 4  # 多段路线并发请求高德接口的最大线程数
+    ROUTE_PINNED_ACTIVITY_TYPES = ['meal', 'rest', 'transport']  # 优化游览顺序时固定位置的活动类型
+    
+    # 附近查询配置（半径单位为公里）
+    NEARBY_DEFAULT_RADIUS = 5
+    NEARBY_MAX_RADIUS = 50
+    NEARBY_MAX_RESULTS = 200
+    
+    # 目的地列表：进程内快照最多每隔多少秒向数据库确认一次版本，以及分页大小
+    DESTINATION_SNAPSHOT_CHECK_INTERVAL = int(os.environ.get('DESTINATION_SNAPSHOT_CHECK_INTERVAL') or 30)
+    DESTINATION_PAGE_SIZE = 100
+    DESTINATION_MAX_PAGE_SIZE = 500
+    
+    # 动态时间线：开启后游标分页的动态列表从moment_timelines读取（写入始终维护）；
+    # 好友数超过FANOUT_LIMIT的用户发布时不逐个写入好友的时间线，由读取方直接查询
+    MOMENT_TIMELINE_ENABLED = os.environ.get('MOMENT_TIMELINE_ENABLED', 'false').lower() == 'true'
+    MOMENT_TIMELINE_FANOUT_LIMIT = int(os.environ.get('MOMENT_TIMELINE_FANOUT_LIMIT') or 500)
+    
+    # 好友ID集合的进程内缓存：本进程内好友关系变化时立即失效，其他进程最多延迟TTL秒
+    FRIEND_CACHE_TTL = int(os.environ.get('FRIEND_CACHE_TTL') or 30)  # 秒
+    FRIEND_CACHE_SIZE = int(os.environ.get('FRIEND_CACHE_SIZE') or 4096)
+    
+    # 外部服务HTTP客户端：超时（秒）、幂等请求重试次数、熔断阈值（连续失败次数）和熔断时长（秒）
+    UPSTREAMS = {
+        'amap': {
+            'connect_timeout': 3,
+            'read_timeout': 10,
+            'retries': 2,
+            'failure_threshold': 5,
+            'reset_timeout': 30,
+            'pool_size': 20
+        },
+        'baidu_ocr': {
+            'connect_timeout': 3,
+            'read_timeout': 20,
+            'retries': 1,
+            'failure_threshold': 5,
+            'reset_timeout': 60,
+            'pool_size': 10
+        }
+    }
+    
     # OCR服务配置
     # 百度OCR API配置
     BAIDU_OCR_API_KEY = os.environ.get('BAIDU_OCR_API_KEY')
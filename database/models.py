@@ -1,9 +1,24 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from sqlalchemy import Text
+from sqlalchemy.orm import validates
+
+from geo_index import geohash_encode
 
 db = SQLAlchemy()
 
+
+class GeoHashMixin:
+    """带经纬度的模型：经纬度被赋值时同步更新geohash列，供geo_index做空间查询"""
+
+    @validates('latitude', 'longitude')
+    def _sync_geohash(self, key, value):
+        latitude = value if key == 'latitude' else self.latitude
+        longitude = value if key == 'longitude' else self.longitude
+        self.geohash = geohash_encode(latitude, longitude)
+        return value
+
+
 class User(db.Model):
     """用户表 - 存储用户基本信息"""
     __tablename__ = 'users'
@@ -44,7 +59,11 @@ class Friend(db.Model):
     friend_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    __table_args__ = (db.UniqueConstraint('user_id', 'friend_id', name='unique_friendship'),)
+    # unique_friendship覆盖按user_id查询，反向查询（别人加我为好友）需要单独的friend_id索引
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'friend_id', name='unique_friendship'),
+        db.Index('ix_friends_friend_id', 'friend_id'),
+    )
 
 class FriendRequest(db.Model):
     """好友请求表"""
@@ -57,9 +76,42 @@ class FriendRequest(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    __table_args__ = (db.UniqueConstraint('sender_id', 'receiver_id', name='unique_request'),)
+    __table_args__ = (
+        db.UniqueConstraint('sender_id', 'receiver_id', name='unique_request'),
+        db.Index('ix_friend_requests_receiver_id_status', 'receiver_id', 'status'),
+    )
+
+class BackgroundTask(db.Model):
+    """后台任务表 - 存储异步任务的状态和结果，供所有worker进程共享"""
+    __tablename__ = 'background_tasks'
+    
+    id = db.Column(db.String(36), primary_key=True)  # uuid
+    task_type = db.Column(db.String(50), nullable=False)  # 任务类型：plan_generation, travel_report, ocr_receipt
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    status = db.Column(db.String(20), default='pending', index=True)  # 状态：pending, processing, completed, failed
+    payload = db.Column(db.Text, nullable=True)  # JSON字符串，任务参数
+    result = db.Column(db.Text, nullable=True)  # JSON字符串，任务结果
+    error = db.Column(db.Text, nullable=True)  # 错误信息
+    owner = db.Column(db.String(255), nullable=True)  # 持有任务的进程（主机名:pid:后缀），负责续租
+    host = db.Column(db.String(255), nullable=True)  # 非空时任务只能在该服务器上执行（依赖本地上传文件）
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # 租约最近一次续期时间，过期后由其他进程接管
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 已开始执行的次数
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class GeocodeCache(db.Model):
+    """地理编码缓存表 - 按规范化地址缓存高德地理编码结果（包括解析失败的结果）"""
+    __tablename__ = 'geocode_cache'
+    
+    address = db.Column(db.String(500), primary_key=True)  # 规范化后的地址
+    found = db.Column(db.Boolean, nullable=False, default=True)  # 是否解析成功，False为负缓存
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    formatted_address = db.Column(db.String(500), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-class Destination(db.Model):
+class Destination(GeoHashMixin, db.Model):
     """目的地表 - 存储目的地基本信息"""
     __tablename__ = 'destinations'
     
@@ -70,12 +122,14 @@ class Destination(db.Model):
     country = db.Column(db.String(50), nullable=False)
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True, index=True)  # 由经纬度计算，用于附近查询
     description = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # 目的地快照的版本号之一
     
     # 关系
     attractions = db.relationship('Attraction', backref='destination', lazy=True)
 
-class Attraction(db.Model):
+class Attraction(GeoHashMixin, db.Model):
     """景点表 - 存储具体景点信息"""
     __tablename__ = 'attractions'
     
@@ -84,6 +138,7 @@ class Attraction(db.Model):
     type = db.Column(db.String(50), nullable=False)  # 景点类型：文化、自然、娱乐等
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True, index=True)  # 由经纬度计算，用于附近查询
     rating = db.Column(db.Float, nullable=True)
     description = db.Column(db.Text, nullable=True)
     visit_duration = db.Column(db.Integer, nullable=True)  # 建议游览时长（分钟）
@@ -113,6 +168,8 @@ class TravelPlan(db.Model):
     # 外键
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
+    __table_args__ = (db.Index('ix_travel_plans_user_id_end_date', 'user_id', 'end_date'),)
+    
     # 关系
     itineraries = db.relationship('Itinerary', backref='travel_plan', lazy=True, cascade='all, delete-orphan')
 
@@ -129,10 +186,12 @@ class Itinerary(db.Model):
     # 外键
     travel_plan_id = db.Column(db.Integer, db.ForeignKey('travel_plans.id'), nullable=False)
     
+    __table_args__ = (db.Index('ix_itineraries_travel_plan_id_day_number', 'travel_plan_id', 'day_number'),)
+    
     # 关系
     itinerary_items = db.relationship('ItineraryItem', backref='itinerary', lazy=True, cascade='all, delete-orphan')
 
-class ItineraryItem(db.Model):
+class ItineraryItem(GeoHashMixin, db.Model):
     """日程项目表 - 存储具体的行程项目"""
     __tablename__ = 'itinerary_items'
     
@@ -145,12 +204,15 @@ class ItineraryItem(db.Model):
     location = db.Column(db.String(500), nullable=True)
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True, index=True)  # 由经纬度计算，用于附近查询
     estimated_cost = db.Column(db.Float, nullable=True)
     order_index = db.Column(db.Integer, nullable=False)  # 当日顺序
     
     # 外键
     itinerary_id = db.Column(db.Integer, db.ForeignKey('itineraries.id'), nullable=False)
     attraction_id = db.Column(db.Integer, db.ForeignKey('attractions.id'), nullable=True)  # 可选关联景点
+    
+    __table_args__ = (db.Index('ix_itinerary_items_itinerary_id_order_index', 'itinerary_id', 'order_index'),)
 
 # 多对多关系：旅行计划包含的目的地
 plan_destinations = db.Table('plan_destinations',
@@ -167,6 +229,7 @@ class TravelNote(db.Model):
     media = db.Column(Text, nullable=True)    # JSON字符串，存储图片/视频URL列表
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    __table_args__ = (db.Index('ix_travel_notes_plan_id', 'plan_id'),)
     plan = db.relationship('TravelPlan', backref=db.backref('notes', lazy=True)) 
 
 class Message(db.Model):
@@ -180,11 +243,17 @@ class Message(db.Model):
     is_read = db.Column(db.Boolean, default=False)  # 是否已读
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # 聊天记录按 (发送者, 接收者) 取并按时间排序；未读消息按接收者统计
+    __table_args__ = (
+        db.Index('ix_messages_sender_id_receiver_id_created_at', 'sender_id', 'receiver_id', 'created_at'),
+        db.Index('ix_messages_receiver_id_is_read', 'receiver_id', 'is_read'),
+    )
+    
     # 建立与用户的关系
     sender = db.relationship('User', foreign_keys=[sender_id], backref=db.backref('sent_messages', lazy='dynamic'))
     receiver = db.relationship('User', foreign_keys=[receiver_id], backref=db.backref('received_messages', lazy='dynamic'))
 
-class Moment(db.Model):
+class Moment(GeoHashMixin, db.Model):
     """动态表 - 存储用户发布的动态"""
     __tablename__ = 'moments'
     
@@ -195,12 +264,22 @@ class Moment(db.Model):
     location = db.Column(db.String(500), nullable=True)  # 增加到500
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True, index=True)  # 由经纬度计算，用于附近查询
     visibility = db.Column(db.String(20), default='public')  # 可见性：public（公开）, private（仅自己可见）, friends（好友可见）
     note_id = db.Column(db.Integer, nullable=True)  # 关联的游记ID，用于游记分享
     note_title = db.Column(db.String(500), nullable=True)  # 增加到500
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 点赞数，随点赞/取消点赞在同一事务中更新
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 评论数（含回复），随评论/删除评论在同一事务中更新
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # 个人动态按时间倒序；动态广场按可见性过滤后按时间倒序；游记分享按note_id查找
+    __table_args__ = (
+        db.Index('ix_moments_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_moments_visibility_created_at', 'visibility', 'created_at'),
+        db.Index('ix_moments_note_id', 'note_id'),
+    )
+    
     # 建立与用户的关系
     user = db.relationship('User', backref=db.backref('moments', lazy='dynamic'))
     
@@ -219,7 +298,7 @@ class MomentLike(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # 确保一个用户只能给一个动态点赞一次
+    # 确保一个用户只能给一个动态点赞一次，同时作为按moment_id统计点赞的索引
     __table_args__ = (db.UniqueConstraint('moment_id', 'user_id', name='unique_moment_like'),)
     
     # 建立与用户的关系
@@ -236,11 +315,34 @@ class MomentComment(db.Model):
     parent_id = db.Column(db.Integer, db.ForeignKey('moment_comments.id'), nullable=True)  # 回复的评论ID
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # 顶级评论按 (动态, parent_id为空) 取，回复按parent_id取，都按时间正序
+    __table_args__ = (
+        db.Index('ix_moment_comments_moment_id_parent_id_created_at', 'moment_id', 'parent_id', 'created_at'),
+        db.Index('ix_moment_comments_parent_id_created_at', 'parent_id', 'created_at'),
+    )
+    
     # 建立与用户的关系
     user = db.relationship('User', backref=db.backref('moment_comments', lazy='dynamic'))
     
     # 自引用关系，用于回复评论
-    replies = db.relationship('MomentComment', backref=db.backref('parent', remote_side=[id]), lazy='dynamic') 
+    replies = db.relationship('MomentComment', backref=db.backref('parent', remote_side=[id]), lazy='dynamic')
+
+class MomentTimeline(db.Model):
+    """动态时间线表 - 发布时写入，每行表示user_id可以在动态列表中看到的一条自己或好友的动态"""
+    __tablename__ = 'moment_timelines'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)  # 时间线所属用户
+    moment_id = db.Column(db.Integer, db.ForeignKey('moments.id'), nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)  # 动态作者，冗余自moments.user_id
+    created_at = db.Column(db.DateTime, nullable=False)  # 冗余自moments.created_at，用于排序
+
+    # 每个用户的时间线按 (created_at, moment_id) 倒序读取；删除或收回动态时按moment_id删除
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'moment_id', name='unique_timeline_entry'),
+        db.Index('ix_moment_timelines_user_id_created_at', 'user_id', 'created_at', 'moment_id'),
+        db.Index('ix_moment_timelines_moment_id', 'moment_id'),
+    )
 
 class Expense(db.Model):
     """开销记录表 - 存储用户的消费记录"""
@@ -265,6 +367,12 @@ class Expense(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # 消费列表和统计都按用户取并按消费时间排序/过滤；计划的消费按plan_id取
+    __table_args__ = (
+        db.Index('ix_expenses_user_id_expense_date', 'user_id', 'expense_date'),
+        db.Index('ix_expenses_plan_id_user_id', 'plan_id', 'user_id'),
+    )
+    
     # 建立关系
     user = db.relationship('User', backref=db.backref('expenses', lazy='dynamic'))
     plan = db.relationship('TravelPlan', backref=db.backref('expenses', lazy='dynamic'))
@@ -0,0 +1,138 @@
+"""
+目的地目录服务模块
+目的地是很少变化的参考数据，每个进程在内存中保存一份带版本号的快照：
+版本号由行数、最大id和最大updated_at组成，最多每隔check_interval秒查询一次数据库确认是否变化，
+本进程内提交了目的地的增删改时立即重新检查。字段投影、名称/城市前缀搜索和游标分页都在快照上完成
+"""
+
+import hashlib
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from flask import current_app
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from database.models import db, Destination
+
+DESTINATION_FIELDS = ('id', 'name', 'city', 'province', 'country', 'latitude', 'longitude', 'description')
+DEFAULT_DESTINATION_FIELDS = ('id', 'name', 'city', 'province', 'country', 'latitude', 'longitude')
+
+
+class DestinationSnapshot:
+    """某一版本的全部目的地，按id排序，并为名称和城市建立小写前缀索引"""
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.token = hashlib.sha256(repr(version).encode('utf-8')).hexdigest()[:16]
+        self.rows = rows
+        self.ids = [row['id'] for row in rows]
+        self.name_index = sorted(((row['name'] or '').lower(), i) for i, row in enumerate(rows))
+        self.city_index = sorted(((row['city'] or '').lower(), i) for i, row in enumerate(rows))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _prefix_positions(self, index, prefix):
+        start = bisect_left(index, (prefix,))
+        end = bisect_right(index, (prefix + '\U0010ffff',))
+        return {position for _, position in index[start:end]}
+
+    def search(self, prefix):
+        """名称或城市以prefix开头（忽略大小写）的目的地在rows中的下标，按id升序"""
+        prefix = prefix.lower()
+        return sorted(self._prefix_positions(self.name_index, prefix) | self._prefix_positions(self.city_index, prefix))
+
+    def page(self, q=None, fields=DEFAULT_DESTINATION_FIELDS, cursor=None, limit=100):
+        """
+        按id升序分页，cursor为上一页最后一条的id
+        返回 (目的地列表, 下一页的cursor)，没有下一页时cursor为None
+        """
+        if q:
+            positions = self.search(q)
+            if cursor is not None:
+                positions = positions[bisect_right([self.ids[p] for p in positions], cursor):]
+        else:
+            start = bisect_right(self.ids, cursor) if cursor is not None else 0
+            positions = range(start, len(self.rows))
+
+        selected = positions[:limit + 1]
+        has_more = len(selected) > limit
+        selected = selected[:limit]
+        items = [{field: self.rows[p][field] for field in fields} for p in selected]
+        next_cursor = self.ids[selected[-1]] if has_more else None
+        return items, next_cursor
+
+
+class DestinationCatalog:
+    """目的地快照的持有者，线程安全，按需刷新"""
+
+    def __init__(self, check_interval=30):
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.version_checks = 0
+
+    def init_app(self, app):
+        self.check_interval = app.config.get('DESTINATION_SNAPSHOT_CHECK_INTERVAL', self.check_interval)
+        event.listen(Session, 'after_flush', _track_destination_changes)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', lambda session: session.info.pop('destinations_changed', None))
+
+    def _after_commit(self, session):
+        if session.info.pop('destinations_changed', False):
+            self.mark_stale()
+
+    def mark_stale(self):
+        """下次访问时立即向数据库确认版本"""
+        self._checked_at = 0.0
+
+    def snapshot(self):
+        """当前快照；距上次确认超过check_interval秒时先查询版本号，变化了才重新加载"""
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._snapshot
+            version = self._load_version()
+            self.version_checks += 1
+            if self._snapshot is None or self._snapshot.version != version:
+                # 先取版本再取数据，期间若有修改，下次检查会发现版本变化并再次加载
+                self._snapshot = DestinationSnapshot(version, self._load_rows())
+                self.reloads += 1
+                current_app.logger.info("目的地快照已刷新: %d 条, 版本 %s", len(self._snapshot), self._snapshot.token)
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def _load_version(self):
+        count, max_id, max_updated = db.session.execute(
+            select(func.count(Destination.id), func.max(Destination.id), func.max(Destination.updated_at))
+        ).one()
+        return (count, max_id, max_updated.isoformat() if max_updated else None)
+
+    def _load_rows(self):
+        columns = [getattr(Destination, field) for field in DESTINATION_FIELDS]
+        result = db.session.execute(select(*columns).order_by(Destination.id))
+        return [dict(row._mapping) for row in result]
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'size': len(snapshot) if snapshot else 0,
+            'version': snapshot.token if snapshot else None,
+            'check_interval': self.check_interval,
+            'version_checks': self.version_checks,
+            'reloads': self.reloads
+        }
+
+
+def _track_destination_changes(session, flush_context):
+    """flush中包含目的地的增删改时做标记，提交后再让快照失效，避免其他线程读到未提交前的版本"""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Destination):
+            session.info['destinations_changed'] = True
+            return
+
+
+destination_catalog = DestinationCatalog()
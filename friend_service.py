@@ -0,0 +1,90 @@
+"""
+好友关系服务模块
+好友ID集合的统一读取入口：同一请求内只查询一次数据库（保存在flask.g），跨请求保存在短TTL的进程内缓存中。
+本进程提交了好友关系的增删后立即让双方的缓存失效，其他进程最多在TTL秒后看到变化
+"""
+
+from flask import g, has_app_context
+from sqlalchemy import event, select, union
+from sqlalchemy.orm import Session
+
+from cache import TTLCache
+from database.models import db, Friend
+
+
+class FriendGraph:
+    """好友关系的读取缓存，friend_ids和are_friends在首次加载后都是集合查找"""
+
+    def __init__(self, ttl=30, maxsize=4096):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.loads = 0
+
+    def init_app(self, app):
+        self.cache = TTLCache(
+            maxsize=app.config.get('FRIEND_CACHE_SIZE', 4096),
+            ttl=app.config.get('FRIEND_CACHE_TTL', 30)
+        )
+        event.listen(Session, 'after_flush', _track_friend_changes)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', lambda session: session.info.pop('friends_changed', None))
+
+    def _after_commit(self, session):
+        changed = session.info.pop('friends_changed', None)
+        if changed:
+            self.invalidate(*changed)
+
+    def _request_memo(self):
+        if not has_app_context():
+            return None
+        if '_friend_ids' not in g:
+            g._friend_ids = {}
+        return g._friend_ids
+
+    def friend_ids(self, user_id):
+        """用户的全部好友ID（frozenset），好友关系两个方向都算"""
+        user_id = int(user_id)
+        memo = self._request_memo()
+        if memo is not None and user_id in memo:
+            return memo[user_id]
+        ids = self.cache.get(user_id)
+        if ids is None:
+            ids = self._load(user_id)
+            self.cache.set(user_id, ids)
+        if memo is not None:
+            memo[user_id] = ids
+        return ids
+
+    def are_friends(self, user_id, other_id):
+        """other_id无法转换为用户ID（请求参数不合法）时视为不是好友"""
+        try:
+            other_id = int(other_id)
+        except (TypeError, ValueError):
+            return False
+        return other_id in self.friend_ids(user_id)
+
+    def invalidate(self, *user_ids):
+        """让这些用户的好友集合在本进程内失效（包括当前请求内的记录）"""
+        memo = self._request_memo()
+        for user_id in user_ids:
+            self.cache.delete(int(user_id))
+            if memo is not None:
+                memo.pop(int(user_id), None)
+
+    def _load(self, user_id):
+        self.loads += 1
+        sent = select(Friend.friend_id).where(Friend.user_id == user_id)
+        received = select(Friend.user_id).where(Friend.friend_id == user_id)
+        return frozenset(db.session.execute(union(sent, received)).scalars())
+
+    def stats(self):
+        return dict(self.cache.stats(), loads=self.loads)
+
+
+def _track_friend_changes(session, flush_context):
+    """记录本次flush中好友关系变化涉及的用户，提交后再让缓存失效，回滚则丢弃"""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Friend):
+            session.info.setdefault('friends_changed', set()).update((obj.user_id, obj.friend_id))
+
+
+friend_graph = FriendGraph()
@@ -0,0 +1,139 @@
+"""
+地理距离计算模块
+基于NumPy批量计算球面距离（haversine公式），坐标统一为[经度, 纬度]，距离单位为公里
+"""
+
+import math
+from bisect import bisect_left
+from itertools import chain
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+# 合并邻近点时先逐点比较的点数，以及之后批量查找的初始窗口大小
+_MERGE_PROBES = 4
+_MERGE_WINDOW = 32
+
+
+def _as_radians(points):
+    """把[[经度, 纬度], ...]转换为 (经度弧度数组, 纬度弧度数组)"""
+    if isinstance(points, np.ndarray):
+        coords = points.astype(float).reshape(-1, 2)
+    else:
+        # 嵌套列表用fromiter展开比np.asarray快数倍
+        coords = np.fromiter(chain.from_iterable(points), dtype=float, count=2 * len(points)).reshape(-1, 2)
+    coords = np.radians(coords)
+    return coords[:, 0], coords[:, 1]
+
+
+def _haversine(lng1, lat1, lng2, lat2):
+    """弧度坐标数组之间逐元素的球面距离（支持广播）"""
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine(p1, p2):
+    """两点之间的距离（公里）"""
+    return float(pairwise_distances([p1], [p2])[0])
+
+
+def pairwise_distances(points_a, points_b):
+    """两组等长坐标逐对的距离（第i个点对第i个点），返回长度为n的数组"""
+    lng_a, lat_a = _as_radians(points_a)
+    lng_b, lat_b = _as_radians(points_b)
+    return _haversine(lng_a, lat_a, lng_b, lat_b)
+
+
+def distance_matrix(points_a, points_b=None):
+    """
+    两组坐标两两之间的距离矩阵（公里），points_b为空时计算points_a内部的距离矩阵
+    返回形状为 (len(points_a), len(points_b)) 的数组
+    """
+    lng_a, lat_a = _as_radians(points_a)
+    lng_b, lat_b = (lng_a, lat_a) if points_b is None else _as_radians(points_b)
+    return _haversine(lng_a[:, None], lat_a[:, None], lng_b[None, :], lat_b[None, :])
+
+
+def path_length(points, cumulative=False):
+    """
+    按顺序经过各点的路径长度（公里）
+    cumulative=True时返回每个点处的累计长度数组（第一个点为0），否则返回总长度
+    """
+    segments = _segment_lengths(*_as_radians(points))
+    if cumulative:
+        return np.concatenate(([0.0], np.cumsum(segments)))
+    return float(segments.sum())
+
+
+def _segment_lengths(lng, lat):
+    """相邻两点之间的距离数组，长度为n-1"""
+    return _haversine(lng[:-1], lat[:-1], lng[1:], lat[1:])
+
+
+def merge_nearby_points(points, threshold=0.1):
+    """
+    合并邻近点：依次保留与上一个保留点距离不小于threshold公里的点（threshold=0.1即100米）
+    结果与逐点比较一致，但不再逐点调用三角函数：
+      - 相邻点距离和累计路径长度一次批量算出，相邻距离都不小于阈值的连续点整段保留
+      - 直线距离不超过路径长度，累计长度不足阈值的点一定会被合并，用二分查找跳过
+      - 跳过后的前几个点逐点计算，仍被合并时（停留时的GPS漂移点）按倍增窗口批量计算，一次找到窗口内第一个需要保留的点
+    """
+    n = len(points)
+    if n == 0:
+        return []
+
+    lng, lat = _as_radians(points)
+    cos_lat = np.cos(lat)
+    segments = _segment_lengths(lng, lat)
+    cum = np.concatenate(([0.0], np.cumsum(segments))).tolist()
+    # 与下一个点距离小于阈值的点的下标，两个短段之间的点与前一点相距足够远，会连续保留
+    short = np.flatnonzero(segments < threshold).tolist()
+    lng_list, lat_list, cos_list = lng.tolist(), lat.tolist(), cos_lat.tolist()
+
+    keep = [0]
+    k = 0
+    j = 1
+    while j < n:
+        if k == j - 1:
+            idx = bisect_left(short, k)
+            stop = short[idx] if idx < len(short) else n - 1
+            if stop > k:
+                keep.extend(range(k + 1, stop + 1))
+                k = stop
+            # k与下一点之间是短段，下一点一定被合并
+            j = k + 2
+            if j >= n:
+                break
+        if cum[j - 1] - cum[k] < threshold:
+            j = bisect_left(cum, cum[k] + threshold, j)
+            if j >= n:
+                break
+        # 跳过之后的前几个点通常就有需要保留的，逐点计算比启动一次批量运算便宜
+        end = min(j + _MERGE_PROBES, n)
+        while j < end:
+            a = (math.sin((lat_list[j] - lat_list[k]) / 2) ** 2
+                 + cos_list[k] * cos_list[j] * math.sin((lng_list[j] - lng_list[k]) / 2) ** 2)
+            if 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0))) >= threshold:
+                break
+            j += 1
+        if j < end:
+            keep.append(j)
+            k = j
+            j += 1
+            continue
+
+        window = _MERGE_WINDOW
+        while j < n:
+            end = min(j + window, n)
+            distances = _haversine(lng[k], lat[k], lng[j:end], lat[j:end])
+            far = np.flatnonzero(distances >= threshold)
+            if far.size:
+                j += int(far[0])
+                keep.append(j)
+                k = j
+                j += 1
+                break
+            j = end
+            window *= 2
+    return [points[i] for i in keep]
@@ -0,0 +1,171 @@
+"""
+地理空间索引模块
+为带经纬度的表（目的地、景点、行程项目、动态）维护geohash列，并基于geohash前缀做范围查询：
+矩形范围查询先换算成少量geohash单元格，每个单元格对应索引上的一段连续区间，
+再用经纬度精确过滤；附近查询和k近邻在此基础上按球面距离排序。
+geohash是普通字符串列上的B树索引，SQLite和PostgreSQL都能使用，不依赖PostGIS等扩展
+"""
+
+import math
+
+from sqlalchemy import and_, or_
+
+from geo_distance import distance_matrix
+
+GEOHASH_PRECISION = 9  # 存储精度，单元格约4.8米 x 4.8米
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+KM_PER_DEGREE_LAT = 111.32
+
+# 一次查询最多展开的单元格数，单元格越多区间越多，越少则每个单元格覆盖的无关行越多
+MAX_CELLS = 16
+
+# 附近查询从该半径开始逐圈扩大，每圈最多读取limit的CANDIDATE_FACTOR倍候选记录
+START_RADIUS_KM = 1.0
+CANDIDATE_FACTOR = 4
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """经纬度编码为geohash字符串，坐标为空时返回None"""
+    if latitude is None or longitude is None:
+        return None
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True  # 偶数位编码经度，奇数位编码纬度
+    while len(chars) < precision:
+        target, rng = (longitude, lng_range) if even else (latitude, lat_range)
+        mid = (rng[0] + rng[1]) / 2
+        if target >= mid:
+            value = value * 2 + 1
+            rng[0] = mid
+        else:
+            value = value * 2
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """指定精度下单元格的 (纬度跨度, 经度跨度)，单位为度"""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def bbox_for_radius(latitude, longitude, radius_km):
+    """以(latitude, longitude)为中心、半径radius_km公里的外接矩形 (min_lat, min_lng, max_lat, max_lng)"""
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(latitude))
+    dlng = 180.0 if cos_lat < 1e-6 else min(180.0, radius_km / (KM_PER_DEGREE_LAT * cos_lat))
+    return (max(-90.0, latitude - dlat), max(-180.0, longitude - dlng),
+            min(90.0, latitude + dlat), min(180.0, longitude + dlng))
+
+
+def covering_cells(bbox, max_cells=MAX_CELLS):
+    """
+    覆盖矩形的geohash单元格前缀列表
+    选择单元格数不超过max_cells的最高精度，矩形越小精度越高，扫描的无关行越少
+    """
+    min_lat, min_lng, max_lat, max_lng = bbox
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lng_step = cell_size(precision)
+        rows = range(math.floor((min_lat + 90) / lat_step), math.floor((max_lat + 90) / lat_step) + 1)
+        cols = range(math.floor((min_lng + 180) / lng_step), math.floor((max_lng + 180) / lng_step) + 1)
+        if len(rows) * len(cols) > max_cells and precision > 1:
+            continue
+        cells = set()
+        for row in rows:
+            lat = min(90.0, -90 + (row + 0.5) * lat_step)
+            for col in cols:
+                lng = min(180.0, -180 + (col + 0.5) * lng_step)
+                cells.add(geohash_encode(lat, lng, precision))
+        return sorted(cells)
+    return []
+
+
+def bbox_filter(model, bbox):
+    """
+    矩形范围查询条件：geohash前缀区间（走索引）+ 经纬度精确过滤
+    前缀区间写成 >= prefix AND <= prefix+'zzz'，而不是LIKE，PostgreSQL在非C排序规则下LIKE用不上B树索引
+    """
+    min_lat, min_lng, max_lat, max_lng = bbox
+    ranges = [
+        and_(model.geohash >= prefix, model.geohash <= prefix + 'z' * (GEOHASH_PRECISION - len(prefix)))
+        for prefix in covering_cells(bbox)
+    ]
+    return and_(
+        or_(*ranges),
+        model.latitude.between(min_lat, max_lat),
+        model.longitude.between(min_lng, max_lng)
+    )
+
+
+def within_bbox(query, model, bbox, limit=None):
+    """矩形范围内的记录"""
+    query = query.filter(bbox_filter(model, bbox))
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def _candidates(query, model, latitude, longitude, radius_km, cap=None):
+    """
+    半径radius_km外接矩形内的候选记录
+    指定cap时由数据库按平面近似距离（经度差按纬度余弦缩放）排序后只返回前cap条
+    """
+    query = query.filter(bbox_filter(model, bbox_for_radius(latitude, longitude, radius_km)))
+    if cap:
+        cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+        dlat = model.latitude - latitude
+        dlng = (model.longitude - longitude) * cos_lat
+        query = query.order_by(dlat * dlat + dlng * dlng).limit(cap)
+    return query.all()
+
+
+def _within_radius(candidates, latitude, longitude, radius_km):
+    """候选记录中球面距离不超过radius_km的，按距离由近到远排序"""
+    if not candidates:
+        return []
+    distances = distance_matrix(
+        [[longitude, latitude]],
+        [[obj.longitude, obj.latitude] for obj in candidates]
+    )[0].tolist()
+    return sorted(
+        ((obj, dist) for obj, dist in zip(candidates, distances) if dist <= radius_km),
+        key=lambda pair: pair[1]
+    )
+
+
+def nearby(query, model, latitude, longitude, radius_km, limit=50, start_radius_km=START_RADIUS_KM):
+    """
+    半径radius_km公里内最近的limit条记录，按距离由近到远排序
+    搜索半径从start_radius_km开始按4倍逐圈扩大，某一圈内已有limit条时它们一定就是整个半径内最近的limit条，
+    外圈的记录不再读取；每圈只取数据库按近似距离排序的前limit*CANDIDATE_FACTOR条，
+    密集区域的大半径查询不会把整个外接矩形内的记录都加载到内存。limit为None时一次读取半径内的全部记录
+    返回 [(记录, 距离公里), ...]
+    """
+    if not limit:
+        return _within_radius(_candidates(query, model, latitude, longitude, radius_km),
+                              latitude, longitude, radius_km)
+    radius = min(start_radius_km, radius_km)
+    while True:
+        candidates = _candidates(query, model, latitude, longitude, radius, cap=limit * CANDIDATE_FACTOR)
+        results = _within_radius(candidates, latitude, longitude, radius)
+        if len(results) >= limit or radius >= radius_km:
+            return results[:limit]
+        radius = min(radius * 4, radius_km)
+
+
+def nearest(query, model, latitude, longitude, k=10, start_radius_km=START_RADIUS_KM, max_radius_km=200.0):
+    """
+    k近邻：max_radius_km公里内最近的k条记录，搜索半径从start_radius_km开始逐圈扩大（见nearby）
+    返回 [(记录, 距离公里), ...]
+    """
+    return nearby(query, model, latitude, longitude, max_radius_km, limit=k, start_radius_km=start_radius_km)
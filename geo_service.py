@@ -0,0 +1,424 @@
+"""
+地理服务模块
+封装高德地图地理编码和驾车路线规划接口。
+地理编码使用两级缓存：进程内LRU缓存 + 数据库缓存表（所有worker进程共享），
+解析失败的地址也会缓存较短时间（负缓存），避免反复请求无法解析的地址。
+路线规划结果按量化后的途经点缓存在进程内，缓存的是已解析好的折线坐标。
+"""
+
+import math
+import re
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import requests
+from sqlalchemy.exc import IntegrityError
+
+from cache import TTLCache
+from upstream import get_upstream
+from database.models import db, GeocodeCache
+
+AMAP_GEOCODE_URL = 'https://restapi.amap.com/v3/geocode/geo'
+AMAP_DRIVING_URL = 'https://restapi.amap.com/v3/direction/driving'
+
+
+def normalize_address(address):
+    """规范化地址作为缓存键：全角转半角、合并空白、英文统一小写"""
+    address = unicodedata.normalize('NFKC', address or '')
+    address = re.sub(r'\s+', ' ', address).strip().lower()
+    return address[:500]
+
+
+def quantize_point(point, cell_km=0.1):
+    """把[经度, 纬度]吸附到边长约cell_km公里的网格上，返回网格坐标（整数二元组）"""
+    lng, lat = float(point[0]), float(point[1])
+    lat_step = cell_km / 111.32
+    lng_step = lat_step / max(math.cos(math.radians(lat)), 0.01)
+    return (round(lng / lng_step), round(lat / lat_step))
+
+
+def route_cache_key(points, strategy=0, cell_km=0.1):
+    """按量化后的途经点序列和路线策略计算路线缓存键，间距小于网格的坐标抖动会命中同一条缓存"""
+    cells = ';'.join(f'{x},{y}' for x, y in (quantize_point(p, cell_km) for p in points))
+    return f'{strategy}|{cells}'
+
+
+def zoom_tolerance(zoom, latitude):
+    """地图缩放级别下一个像素对应的距离（换算为纬度度数），作为折线简化的容差"""
+    meters_per_pixel = 156543.03392 * math.cos(math.radians(latitude)) / (2 ** zoom)
+    return meters_per_pixel / 111320.0
+
+
+def simplify_polyline(points, tolerance):
+    """
+    Douglas-Peucker折线简化，tolerance为纬度度数；经度按所在纬度的余弦缩放，使两个方向的误差一致
+    保留首尾点，返回简化后的[[经度, 纬度], ...]
+    """
+    if len(points) < 3 or tolerance <= 0:
+        return list(points)
+
+    scale = math.cos(math.radians(sum(p[1] for p in points) / len(points)))
+    xs = [p[0] * scale for p in points]
+    ys = [p[1] for p in points]
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    tolerance_sq = tolerance * tolerance
+
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        ax, ay = xs[start], ys[start]
+        dx, dy = xs[end] - ax, ys[end] - ay
+        length_sq = dx * dx + dy * dy
+        max_dist_sq = -1.0
+        index = None
+        for i in range(start + 1, end):
+            px, py = xs[i] - ax, ys[i] - ay
+            if length_sq == 0:
+                dist_sq = px * px + py * py
+            else:
+                t = max(0.0, min(1.0, (px * dx + py * dy) / length_sq))
+                ex, ey = px - t * dx, py - t * dy
+                dist_sq = ex * ex + ey * ey
+            if dist_sq > max_dist_sq:
+                max_dist_sq = dist_sq
+                index = i
+        if index is not None and max_dist_sq > tolerance_sq:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def encode_polyline(points, precision=5):
+    """
+    把[[经度, 纬度], ...]编码为差分折线字符串（Google Encoded Polyline算法，坐标顺序保持经度在前）
+    每个坐标乘以10^precision取整后与上一个点做差，再按5位一组编码为可打印字符
+    """
+    factor = 10 ** precision
+    output = []
+    prev_lng = prev_lat = 0
+    for lng, lat in points:
+        lng_i = int(round(lng * factor))
+        lat_i = int(round(lat * factor))
+        for delta in (lng_i - prev_lng, lat_i - prev_lat):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                output.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            output.append(chr(value + 63))
+        prev_lng, prev_lat = lng_i, lat_i
+    return ''.join(output)
+
+
+class RouteError(Exception):
+    """高德路线规划接口返回失败（非网络错误）"""
+
+
+class GeoService:
+    """地理编码服务类"""
+
+    def __init__(self):
+        self.app = None
+        self.api_key = None
+        self.http = get_upstream('amap')
+        self.timeout = 5
+        self.ttl = 30 * 24 * 3600
+        self.negative_ttl = 24 * 3600
+        self.memory_cache = TTLCache(maxsize=2048, ttl=3600)
+        self._stats_lock = threading.Lock()
+        self._counters = {
+            'memory_hits': 0,
+            'db_hits': 0,
+            'negative_hits': 0,
+            'upstream_calls': 0,
+            'upstream_errors': 0
+        }
+        self.route_timeout = 10
+        self.route_cache = TTLCache(maxsize=512, ttl=24 * 3600)
+
+    def init_app(self, app):
+        """读取高德密钥、超时时间和缓存配置"""
+        self.app = app
+        self.api_key = app.config.get('AMAP_API_KEY')
+        self.timeout = app.config.get('GEOCODE_TIMEOUT', 5)
+        self.ttl = app.config.get('GEOCODE_CACHE_TTL', self.ttl)
+        self.negative_ttl = app.config.get('GEOCODE_NEGATIVE_TTL', self.negative_ttl)
+        self.memory_cache = TTLCache(
+            maxsize=app.config.get('GEOCODE_MEMORY_CACHE_SIZE', 2048),
+            ttl=app.config.get('GEOCODE_MEMORY_CACHE_TTL', 3600)
+        )
+        self.route_timeout = app.config.get('ROUTE_TIMEOUT', 10)
+        self.route_cache = TTLCache(
+            maxsize=app.config.get('ROUTE_CACHE_SIZE', 512),
+            ttl=app.config.get('ROUTE_CACHE_TTL', 24 * 3600)
+        )
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._counters[name] += amount
+
+    def geocode(self, address):
+        """
+        解析地址为经纬度
+
+        Returns:
+            dict: {'latitude', 'longitude', 'formatted_address'}；地址无法解析时返回None
+
+        Raises:
+            requests.RequestException: 调用高德接口失败（网络错误、超时），这类失败不会被缓存
+        """
+        key = normalize_address(address)
+        if not key:
+            return None
+
+        # 第一级：进程内缓存
+        entry = self.memory_cache.get(key)
+        if entry is not None:
+            self._count('memory_hits')
+            return self._result(entry, cached=True)
+
+        # 第二级：数据库缓存表
+        entry = self._load(key)
+        if entry is not None:
+            self._count('db_hits')
+            self._remember(key, entry)
+            return self._result(entry, cached=True)
+
+        # 缓存未命中，调用高德接口
+        return self._result(self._resolve(key, address))
+
+    def geocode_many(self, addresses, max_workers=4):
+        """
+        批量解析地址：先去重，再依次查进程内缓存、一次性查数据库缓存，剩余的地址并发调用高德接口（最多max_workers个并发）
+
+        Returns:
+            tuple: (results, errors)，results为 {原始地址: 结果dict或None}，
+                   errors为 {原始地址: 错误信息}（调用高德接口失败的地址，不会出现在results中）
+        """
+        keys = {}
+        for address in addresses:
+            key = normalize_address(address)
+            if key:
+                keys.setdefault(key, []).append(address)
+
+        entries = {}
+        pending = []
+        for key in keys:
+            entry = self.memory_cache.get(key)
+            if entry is not None:
+                self._count('memory_hits')
+                entries[key] = self._result(entry, cached=True)
+            else:
+                pending.append(key)
+
+        if pending:
+            for key, entry in self._load_many(pending).items():
+                self._count('db_hits')
+                self._remember(key, entry)
+                entries[key] = self._result(entry, cached=True)
+            pending = [key for key in pending if key not in entries]
+
+        failed = {}
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+                futures = {executor.submit(self._resolve, key, keys[key][0]): key for key in pending}
+                for future in as_completed(futures):
+                    key = futures[future]
+                    try:
+                        entries[key] = self._result(future.result())
+                    except (requests.RequestException, ValueError) as e:
+                        failed[key] = str(e)
+
+        results = {}
+        errors = {}
+        for key, originals in keys.items():
+            for address in originals:
+                if key in failed:
+                    errors[address] = failed[key]
+                else:
+                    results[address] = entries[key]
+        return results, errors
+
+    def _resolve(self, key, address):
+        """调用高德接口解析并写入两级缓存"""
+        entry = self._fetch(address)
+        ttl = self.ttl if entry['found'] else self.negative_ttl
+        entry['expires_at'] = datetime.utcnow() + timedelta(seconds=ttl)
+        self._store(key, entry)
+        self._remember(key, entry)
+        return entry
+
+    def _result(self, entry, cached=False):
+        if not entry['found']:
+            if cached:
+                self._count('negative_hits')
+            return None
+        return {
+            'latitude': entry['latitude'],
+            'longitude': entry['longitude'],
+            'formatted_address': entry['formatted_address']
+        }
+
+    def _remember(self, key, entry):
+        """写入进程内缓存，有效期不超过数据库记录的剩余有效期"""
+        remaining = (entry['expires_at'] - datetime.utcnow()).total_seconds()
+        if remaining > 0:
+            self.memory_cache.set(key, entry, ttl=min(self.memory_cache.ttl, remaining))
+
+    def _fetch(self, address):
+        self._count('upstream_calls')
+        params = {
+            'key': self.api_key,
+            'address': address,
+            'output': 'JSON'
+        }
+        try:
+            response = self.http.get(AMAP_GEOCODE_URL, params=params, read_timeout=self.timeout)
+            data = response.json()
+        except (requests.RequestException, ValueError):
+            self._count('upstream_errors')
+            raise
+
+        if data.get('status') == '1' and data.get('geocodes'):
+            geocode = data['geocodes'][0]
+            location = geocode['location'].split(',')
+            return {
+                'found': True,
+                'latitude': float(location[1]),
+                'longitude': float(location[0]),
+                'formatted_address': geocode.get('formatted_address')
+            }
+        if data.get('status') != '1':
+            # 密钥无效、配额用尽等接口错误不是地址本身的问题，不做负缓存
+            self._count('upstream_errors')
+            raise requests.RequestException(data.get('info', '地理编码接口返回错误'))
+        return {'found': False, 'latitude': None, 'longitude': None, 'formatted_address': None}
+
+    def _load(self, key):
+        table = GeocodeCache.__table__
+        with self.app.app_context(), db.engine.connect() as conn:
+            row = conn.execute(table.select().where(
+                table.c.address == key,
+                table.c.expires_at > datetime.utcnow()
+            )).mappings().first()
+        return dict(row) if row else None
+
+    def _load_many(self, keys):
+        table = GeocodeCache.__table__
+        with self.app.app_context(), db.engine.connect() as conn:
+            rows = conn.execute(table.select().where(
+                table.c.address.in_(keys),
+                table.c.expires_at > datetime.utcnow()
+            )).mappings().all()
+        return {row['address']: dict(row) for row in rows}
+
+    def _store(self, key, entry):
+        """写入数据库缓存表；使用独立连接，不影响调用方session中的事务"""
+        table = GeocodeCache.__table__
+        values = {
+            'found': entry['found'],
+            'latitude': entry['latitude'],
+            'longitude': entry['longitude'],
+            'formatted_address': entry['formatted_address'],
+            'expires_at': entry['expires_at']
+        }
+        try:
+            with self.app.app_context(), db.engine.begin() as conn:
+                updated = conn.execute(table.update().where(table.c.address == key).values(**values)).rowcount
+                if not updated:
+                    conn.execute(table.insert().values(address=key, created_at=datetime.utcnow(), **values))
+        except IntegrityError:
+            # 其他进程同时写入了同一地址，保留对方的结果即可
+            pass
+
+    def driving_route(self, points, strategy=0):
+        """
+        驾车路线规划，points为[[经度, 纬度], ...]（至少2个，首尾为起终点）
+
+        Returns:
+            tuple: (route, cached)，route为 {'distance'(公里), 'duration'(分钟), 'polyline'([[经度, 纬度], ...])}
+
+        Raises:
+            RouteError: 高德接口返回规划失败
+            requests.RequestException: 调用高德接口失败（网络错误、超时）
+        """
+        key = route_cache_key(points, strategy)
+        route = self.route_cache.get(key)
+        if route is not None:
+            return route, True
+
+        route = self._fetch_route(points, strategy)
+        self.route_cache.set(key, route)
+        return route, False
+
+    def driving_routes(self, segments, strategy=0, max_workers=4):
+        """
+        并发规划多段路线（最多max_workers个并发），按输入顺序返回 [(route, cached), ...]
+        任一段失败时抛出该段的异常
+        """
+        if len(segments) == 1:
+            return [self.driving_route(segments[0], strategy)]
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(segments)))) as executor:
+            futures = [executor.submit(self.driving_route, points, strategy) for points in segments]
+            return [future.result() for future in futures]
+
+    def _fetch_route(self, points, strategy):
+        params = {
+            'key': self.api_key,
+            'origin': f"{points[0][0]},{points[0][1]}",
+            'destination': f"{points[-1][0]},{points[-1][1]}",
+            'strategy': strategy,
+            'extensions': 'all',
+            'output': 'json'
+        }
+        if len(points) > 2:
+            params['waypoints'] = ';'.join(f"{pt[0]},{pt[1]}" for pt in points[1:-1])
+        response = self.http.get(AMAP_DRIVING_URL, params=params, read_timeout=self.route_timeout)
+        data = response.json()
+
+        if data.get('status') != '1' or not data.get('route', {}).get('paths'):
+            raise RouteError(data.get('info', '路线规划失败'))
+
+        path = data['route']['paths'][0]
+        polyline = []
+        for step in path['steps']:
+            if 'polyline' in step:
+                for point_str in step['polyline'].split(';'):
+                    if ',' in point_str:
+                        lng, lat = point_str.split(',')
+                        polyline.append([float(lng), float(lat)])
+        return {
+            'distance': round(float(path['distance']) / 1000, 1),
+            'duration': int(path['duration']) // 60,
+            'polyline': polyline
+        }
+
+    def cleanup(self):
+        """清除进程内地理编码/路线缓存中的过期条目，并删除数据库中已过期的缓存记录，返回数据库删除条数"""
+        self.memory_cache.prune()
+        self.route_cache.prune()
+        table = GeocodeCache.__table__
+        with self.app.app_context(), db.engine.begin() as conn:
+            return conn.execute(table.delete().where(table.c.expires_at <= datetime.utcnow())).rowcount
+
+    def stats(self):
+        """地理编码缓存的命中统计（当前进程）"""
+        with self._stats_lock:
+            counters = dict(self._counters)
+        lookups = counters['memory_hits'] + counters['db_hits'] + counters['upstream_calls']
+        hits = counters['memory_hits'] + counters['db_hits']
+        counters['hit_rate'] = round(hits / lookups, 3) if lookups else 0
+        counters['memory'] = self.memory_cache.stats()
+        return counters
+
+    def route_stats(self):
+        """路线缓存的命中统计（当前进程）"""
+        return self.route_cache.stats()
+
+
+# 创建全局地理服务实例
+geo_service = GeoService()
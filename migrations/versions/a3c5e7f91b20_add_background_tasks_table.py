@@ -0,0 +1,39 @@
+"""Add background_tasks table
+
+Revision ID: a3c5e7f91b20
+Revises: f69aa6d23254
+Create Date: 2026-10-18 10:12:03.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c5e7f91b20'
+down_revision = 'f69aa6d23254'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 后台任务表，替代进程内的tasks字典，使多个worker进程可以共享任务状态
+    op.create_table('background_tasks',
+    sa.Column('id', sa.String(length=36), nullable=False),
+    sa.Column('task_type', sa.String(length=50), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=True),
+    sa.Column('result', sa.Text(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_background_tasks_status'), 'background_tasks', ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_background_tasks_status'), table_name='background_tasks')
+    op.drop_table('background_tasks')
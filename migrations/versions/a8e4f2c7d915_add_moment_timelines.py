@@ -0,0 +1,54 @@
+"""Add moment_timelines table
+
+Revision ID: a8e4f2c7d915
+Revises: f3c8d1a6b472
+Create Date: 2026-10-18 20:05:41.318264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8e4f2c7d915'
+down_revision = 'f3c8d1a6b472'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 动态时间线表，发布动态时写入作者和好友的时间线，动态列表按用户做范围扫描
+    op.create_table('moment_timelines',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('moment_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['moment_id'], ['moments.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'moment_id', name='unique_timeline_entry')
+    )
+    op.create_index('ix_moment_timelines_user_id_created_at', 'moment_timelines', ['user_id', 'created_at', 'moment_id'], unique=False)
+    op.create_index('ix_moment_timelines_moment_id', 'moment_timelines', ['moment_id'], unique=False)
+
+    # 按现有数据回填：自己的全部动态 + 好友的公开/好友可见动态（好友关系两个方向合并去重）
+    # 好友过多的作者也一并回填，读取时与拉取结果去重；之后可用 flask rebuild-moment-timelines 重建
+    op.execute(
+        'INSERT INTO moment_timelines (user_id, moment_id, author_id, created_at) '
+        'SELECT user_id, id, user_id, created_at FROM moments WHERE created_at IS NOT NULL'
+    )
+    op.execute(
+        'INSERT INTO moment_timelines (user_id, moment_id, author_id, created_at) '
+        'SELECT pairs.viewer_id, moments.id, moments.user_id, moments.created_at FROM moments '
+        'JOIN (SELECT user_id AS viewer_id, friend_id AS author_id FROM friends '
+        'UNION SELECT friend_id, user_id FROM friends) AS pairs ON pairs.author_id = moments.user_id '
+        "WHERE moments.visibility IN ('public', 'friends') AND moments.created_at IS NOT NULL"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_moment_timelines_moment_id', table_name='moment_timelines')
+    op.drop_index('ix_moment_timelines_user_id_created_at', table_name='moment_timelines')
+    op.drop_table('moment_timelines')
@@ -0,0 +1,33 @@
+"""Add lease columns to background_tasks
+
+Revision ID: b1d7e3f9c264
+Revises: a8e4f2c7d915
+Create Date: 2026-10-19 10:12:36.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b1d7e3f9c264'
+down_revision = 'a8e4f2c7d915'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 任务租约：持有进程、绑定的服务器、最近续租时间和执行次数，进程退出后由其他进程接管任务
+    with op.batch_alter_table('background_tasks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('owner', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('host', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('background_tasks', schema=None) as batch_op:
+        batch_op.drop_column('attempts')
+        batch_op.drop_column('heartbeat_at')
+        batch_op.drop_column('host')
+        batch_op.drop_column('owner')
@@ -0,0 +1,36 @@
+"""Add geocode_cache table
+
+Revision ID: b7d2c4e8a915
+Revises: a3c5e7f91b20
+Create Date: 2026-10-18 14:36:45.502117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2c4e8a915'
+down_revision = 'a3c5e7f91b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 地理编码缓存表，多个worker进程共享，避免重复调用高德接口
+    op.create_table('geocode_cache',
+    sa.Column('address', sa.String(length=500), nullable=False),
+    sa.Column('found', sa.Boolean(), nullable=False),
+    sa.Column('latitude', sa.Float(), nullable=True),
+    sa.Column('longitude', sa.Float(), nullable=True),
+    sa.Column('formatted_address', sa.String(length=500), nullable=True),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('address')
+    )
+    op.create_index(op.f('ix_geocode_cache_expires_at'), 'geocode_cache', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_geocode_cache_expires_at'), table_name='geocode_cache')
+    op.drop_table('geocode_cache')
@@ -0,0 +1,56 @@
+"""Add geohash columns for spatial queries
+
+Revision ID: c4f8a2d6e317
+Revises: b7d2c4e8a915
+Create Date: 2026-10-18 17:58:12.604381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from geo_index import geohash_encode
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f8a2d6e317'
+down_revision = 'b7d2c4e8a915'
+branch_labels = None
+depends_on = None
+
+GEO_TABLES = ['destinations', 'attractions', 'itinerary_items', 'moments']
+BATCH_SIZE = 5000
+
+
+def upgrade():
+    # 为带经纬度的表增加geohash列和索引，附近查询按geohash前缀走索引范围扫描
+    for table in GEO_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('geohash', sa.String(length=12), nullable=True))
+            batch_op.create_index(batch_op.f(f'ix_{table}_geohash'), ['geohash'], unique=False)
+
+    # 回填已有数据，按主键分批处理，避免一次把整张表读进内存
+    conn = op.get_bind()
+    for table in GEO_TABLES:
+        t = sa.table(table, sa.column('id', sa.Integer), sa.column('latitude', sa.Float),
+                     sa.column('longitude', sa.Float), sa.column('geohash', sa.String))
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                sa.select(t.c.id, t.c.latitude, t.c.longitude)
+                .where(t.c.id > last_id, t.c.latitude.isnot(None), t.c.longitude.isnot(None))
+                .order_by(t.c.id).limit(BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            conn.execute(
+                t.update().where(t.c.id == sa.bindparam('row_id')).values(geohash=sa.bindparam('hash')),
+                [{'row_id': row.id, 'hash': geohash_encode(row.latitude, row.longitude)} for row in rows]
+            )
+            last_id = rows[-1].id
+
+
+def downgrade():
+    for table in reversed(GEO_TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_geohash'))
+            batch_op.drop_column('geohash')
@@ -0,0 +1,29 @@
+"""Add updated_at to destinations
+
+Revision ID: d2a9e6b4c851
+Revises: c4f8a2d6e317
+Create Date: 2026-10-18 18:21:40.118925
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a9e6b4c851'
+down_revision = 'c4f8a2d6e317'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 目的地修改时间，和行数、最大id一起作为进程内目的地快照的版本号
+    with op.batch_alter_table('destinations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_destinations_updated_at'), ['updated_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('destinations', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_destinations_updated_at'))
+        batch_op.drop_column('updated_at')
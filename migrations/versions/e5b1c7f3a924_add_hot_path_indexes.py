@@ -0,0 +1,48 @@
+"""Add composite indexes for hot query paths
+
+Revision ID: e5b1c7f3a924
+Revises: d2a9e6b4c851
+Create Date: 2026-10-18 18:47:03.530217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b1c7f3a924'
+down_revision = 'd2a9e6b4c851'
+branch_labels = None
+depends_on = None
+
+# (索引名, 表名, 列)
+INDEXES = [
+    ('ix_expenses_user_id_expense_date', 'expenses', ['user_id', 'expense_date']),
+    ('ix_expenses_plan_id_user_id', 'expenses', ['plan_id', 'user_id']),
+    ('ix_moments_user_id_created_at', 'moments', ['user_id', 'created_at']),
+    ('ix_moments_visibility_created_at', 'moments', ['visibility', 'created_at']),
+    ('ix_moments_note_id', 'moments', ['note_id']),
+    ('ix_messages_sender_id_receiver_id_created_at', 'messages', ['sender_id', 'receiver_id', 'created_at']),
+    ('ix_messages_receiver_id_is_read', 'messages', ['receiver_id', 'is_read']),
+    ('ix_moment_comments_moment_id_parent_id_created_at', 'moment_comments', ['moment_id', 'parent_id', 'created_at']),
+    ('ix_moment_comments_parent_id_created_at', 'moment_comments', ['parent_id', 'created_at']),
+    ('ix_travel_plans_user_id_end_date', 'travel_plans', ['user_id', 'end_date']),
+    ('ix_friends_friend_id', 'friends', ['friend_id']),
+    ('ix_friend_requests_receiver_id_status', 'friend_requests', ['receiver_id', 'status']),
+    ('ix_itineraries_travel_plan_id_day_number', 'itineraries', ['travel_plan_id', 'day_number']),
+    ('ix_itinerary_items_itinerary_id_order_index', 'itinerary_items', ['itinerary_id', 'order_index']),
+    ('ix_travel_notes_plan_id', 'travel_notes', ['plan_id']),
+]
+
+
+def upgrade():
+    # 热点查询的组合索引；PostgreSQL上并发建索引，不阻塞线上读写（需要在事务外执行）
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
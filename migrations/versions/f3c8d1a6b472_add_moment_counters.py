@@ -0,0 +1,36 @@
+"""Add like_count and comment_count to moments
+
+Revision ID: f3c8d1a6b472
+Revises: e5b1c7f3a924
+Create Date: 2026-10-18 19:12:27.841095
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8d1a6b472'
+down_revision = 'e5b1c7f3a924'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 动态的冗余点赞数和评论数，列表和详情不再逐条COUNT
+    with op.batch_alter_table('moments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+
+    # 按现有的点赞和评论记录回填
+    op.execute(
+        'UPDATE moments SET '
+        'like_count = (SELECT COUNT(*) FROM moment_likes WHERE moment_likes.moment_id = moments.id), '
+        'comment_count = (SELECT COUNT(*) FROM moment_comments WHERE moment_comments.moment_id = moments.id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('moments', schema=None) as batch_op:
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('like_count')
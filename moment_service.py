@@ -0,0 +1,119 @@
+"""
+动态服务模块
+动态列表的可见性条件、查询和序列化：作者用户名和当前用户是否点赞与动态本身在同一条SQL中取回，
+每页的查询次数与每页条数无关。点赞数和评论数是Moment上的冗余计数列，
+在点赞、评论的同一事务中原子更新，并由reconcile_moment_counters定期修正偏差
+"""
+
+import json
+
+from sqlalchemy import exists, func, or_, and_, select, update
+
+from database.models import db, Moment, MomentLike, MomentComment, User
+
+
+def visible_moments_filter(user_id, friend_ids):
+    """当前用户可见的动态：自己的全部动态 + 好友的公开/好友可见动态 + 其他人的公开动态"""
+    friend_ids = list(friend_ids)
+    return or_(
+        Moment.user_id == user_id,
+        and_(Moment.user_id.in_(friend_ids), Moment.visibility.in_(['public', 'friends'])),
+        and_(~Moment.user_id.in_(friend_ids + [user_id]), Moment.visibility == 'public')
+    )
+
+
+def feed_query(viewer_id, *criteria):
+    """
+    动态列表查询，每行为 (Moment, 作者用户名, 当前用户是否点赞)
+    点赞状态是关联子查询，只对分页后的行执行，走moment_likes上的唯一索引
+    """
+    is_liked = exists().where(
+        MomentLike.moment_id == Moment.id,
+        MomentLike.user_id == viewer_id
+    ).correlate(Moment)
+
+    return db.session.query(
+        Moment,
+        User.username,
+        is_liked.label('is_liked')
+    ).join(User, User.id == Moment.user_id).filter(*criteria)
+
+
+def serialize_feed_row(row, viewer_id, friend_ids):
+    """把feed_query的一行转换为动态列表接口的字典"""
+    moment, username, is_liked = row
+    return {
+        'id': moment.id,
+        'user_id': moment.user_id,
+        'username': username,
+        'content': moment.content,
+        'media': json.loads(moment.media) if moment.media else [],
+        'location': moment.location,
+        'latitude': moment.latitude,
+        'longitude': moment.longitude,
+        'visibility': moment.visibility,
+        'note_id': moment.note_id,  # 关联的游记ID
+        'note_title': moment.note_title,  # 关联的游记标题
+        'created_at': moment.created_at.isoformat(),
+        'updated_at': moment.updated_at.isoformat(),
+        'is_liked': bool(is_liked),
+        'like_count': moment.like_count,
+        'comment_count': moment.comment_count,
+        'is_self': moment.user_id == viewer_id,
+        'is_friend': moment.user_id in friend_ids,
+        'comments': []
+    }
+
+
+def adjust_moment_counters(moment_id, likes=0, comments=0):
+    """
+    在当前事务中原子地增减动态的点赞数和评论数（UPDATE ... SET x = x + n），
+    与点赞/评论记录的写入一起提交或回滚。返回更新后的 (点赞数, 评论数)，动态不存在时返回 (0, 0)
+    """
+    row = db.session.execute(
+        update(Moment).where(Moment.id == moment_id).values(
+            like_count=Moment.like_count + likes,
+            comment_count=Moment.comment_count + comments
+        ).returning(Moment.like_count, Moment.comment_count),
+        execution_options={'synchronize_session': False}
+    ).first()
+    return (row.like_count, row.comment_count) if row else (0, 0)
+
+
+def reconcile_moment_counters(batch_size=1000):
+    """
+    修正与实际点赞/评论记录不一致的计数，按主键分批比对，只更新有偏差的动态
+    更新时在同一条语句里重新计数，不会覆盖比对之后并发提交的点赞或评论。返回修正的动态数
+    """
+    actual_likes = select(func.count(MomentLike.id)).where(
+        MomentLike.moment_id == Moment.id
+    ).correlate(Moment).scalar_subquery()
+    actual_comments = select(func.count(MomentComment.id)).where(
+        MomentComment.moment_id == Moment.id
+    ).correlate(Moment).scalar_subquery()
+
+    fixed = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Moment.id, Moment.like_count, Moment.comment_count,
+                   actual_likes.label('actual_likes'), actual_comments.label('actual_comments'))
+            .where(Moment.id > last_id).order_by(Moment.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        drifted = [row.id for row in rows
+                   if row.like_count != row.actual_likes or row.comment_count != row.actual_comments]
+        if drifted:
+            db.session.execute(
+                update(Moment).where(Moment.id.in_(drifted)).values(
+                    like_count=actual_likes, comment_count=actual_comments
+                ),
+                execution_options={'synchronize_session': False}
+            )
+            db.session.commit()
+            fixed += len(drifted)
+        last_id = rows[-1].id
+    if fixed:
+        print(f"动态计数修正: {fixed} 条")
+    return fixed
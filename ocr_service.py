@@ -3,13 +3,13 @@ OCR服务集成模块
 支持多种OCR服务提供商，用于识别支付截图
 """
 
-import requests
 import json
 import base64
 import os
 from datetime import datetime
 import re
 from config import Config
+from upstream import get_upstream
 
 class OCRService:
     """OCR服务类"""
@@ -19,6 +19,8 @@ class OCRService:
         self.baidu_secret_key = os.environ.get('BAIDU_OCR_SECRET_KEY')
         self.tencent_secret_id = os.environ.get('TENCENT_SECRET_ID')
         self.tencent_secret_key = os.environ.get('TENCENT_SECRET_KEY')
+        # 百度OCR共用连接池、超时、重试和熔断设置；识别接口只读，可以安全重试
+        self.baidu_http = get_upstream('baidu_ocr')
         
     def recognize_payment_receipt(self, image_path):
         """
@@ -58,7 +60,7 @@ class OCRService:
                 'client_secret': self.baidu_secret_key
             }
             
-            token_response = requests.post(token_url, params=token_params)
+            token_response = self.baidu_http.post(token_url, idempotent=True, params=token_params)
             access_token = token_response.json().get('access_token')
             
             if not access_token:
@@ -80,7 +82,7 @@ class OCRService:
                     'recognize_granularity': 'big',
                     'accuracy': 'high'
                 }
-                receipt_response = requests.post(receipt_url, data=receipt_data)
+                receipt_response = self.baidu_http.post(receipt_url, idempotent=True, data=receipt_data)
                 receipt_result = receipt_response.json()
                 
                 if 'words_result' in receipt_result:
@@ -102,7 +104,7 @@ class OCRService:
                     'language_type': 'CHN_ENG',
                     'recognize_granularity': 'big'
                 }
-                accurate_response = requests.post(accurate_url, data=accurate_data)
+                accurate_response = self.baidu_http.post(accurate_url, idempotent=True, data=accurate_data)
                 accurate_result = accurate_response.json()
                 
                 if 'words_result' in accurate_result:
@@ -123,7 +125,7 @@ class OCRService:
                     'detect_direction': 'true',
                     'language_type': 'CHN_ENG'
                 }
-                general_response = requests.post(general_url, data=general_data)
+                general_response = self.baidu_http.post(general_url, idempotent=True, data=general_data)
                 general_result = general_response.json()
                 
                 if 'words_result' in general_result:
@@ -0,0 +1,81 @@
+"""
+游标分页模块
+按 (时间, id) 倒序的键集分页：游标记录上一页最后一行的排序键，下一页用
+WHERE 时间 < t OR (时间 = t AND id < i) 直接在索引上定位，不使用OFFSET，翻到第几页代价都相同。
+游标对客户端是不透明的字符串，总数只在调用方需要时单独统计
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+class InvalidCursor(ValueError):
+    """游标或before参数无法解析"""
+
+
+def encode_cursor(timestamp, row_id):
+    """把排序键编码为URL安全的不透明字符串"""
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析encode_cursor生成的游标，返回 (时间, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor('cursor无效')
+
+
+def keyset_requested(args):
+    """请求参数中带有cursor或before时使用游标分页（cursor为空表示第一页）"""
+    return 'cursor' in args or 'before' in args
+
+
+def parse_keyset_args(args):
+    """
+    从请求参数解析起始位置，返回 (时间, id)；id为None表示只按时间过滤，None表示从最新一条开始
+    cursor为上一页返回的next_cursor，before为ISO格式时间，只返回早于该时间的记录
+    """
+    cursor = args.get('cursor')
+    if cursor:
+        return decode_cursor(cursor)
+    before = args.get('before')
+    if before:
+        try:
+            return datetime.fromisoformat(before), None
+        except ValueError:
+            raise InvalidCursor('before应为ISO格式时间')
+    return None
+
+
+def keyset_page(query, time_column, id_column, position, limit, key=None):
+    """
+    取position之后（更旧）的limit行，按 (时间, id) 倒序
+    key从每行取出 (时间, id)，默认读取与列同名的属性；返回 (行列表, 下一页游标或None)
+    """
+    if position is not None:
+        timestamp, row_id = position
+        if row_id is None:
+            query = query.filter(time_column < timestamp)
+        else:
+            query = query.filter(or_(
+                time_column < timestamp,
+                and_(time_column == timestamp, id_column < row_id)
+            ))
+    rows = query.order_by(time_column.desc(), id_column.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    if key is None:
+        last = rows[-1]
+        timestamp, row_id = getattr(last, time_column.key), getattr(last, id_column.key)
+    else:
+        timestamp, row_id = key(rows[-1])
+    return rows, encode_cursor(timestamp, row_id)
@@ -0,0 +1,286 @@
+"""
+旅行计划服务模块
+处理AI生成的计划数据：预算修正、行程记录构建、生成结果缓存、流式响应的增量解析，
+以及计划详情的序列化
+"""
+
+import hashlib
+import json
+from datetime import date, datetime, timedelta
+
+from database.models import Itinerary, ItineraryItem
+
+ACTIVITY_TYPES = ('visit', 'meal', 'transport', 'rest')
+
+# AI未返回（或返回了无法识别的）activity_type时，按活动名称和地点中的关键词推断类型，
+# 路线优化依赖这些类型固定用餐、住宿、交通的位置和时间
+ACTIVITY_KEYWORDS = [
+    ('meal', ('早餐', '午餐', '晚餐', '早饭', '午饭', '晚饭', '早茶', '用餐', '就餐', '夜宵', '宵夜', '餐厅', '饭店', '美食')),
+    ('rest', ('酒店', '入住', '退房', '住宿', '民宿', '客栈', '休息')),
+    ('transport', ('机场', '火车站', '高铁', '动车', '航班', '登机', '返程', '乘坐', '接驳', '自驾'))
+]
+
+
+def apply_budget_limits(ai_result, budget_min, budget_max):
+    """校验并修正AI返回的费用，使总费用落在用户设定的预算范围内（原地修改ai_result）"""
+    total_cost = ai_result.get('total_cost', 0)
+    calculated_cost = 0
+
+    # 计算所有行程项目的实际费用
+    for day_data in ai_result.get('days', []):
+        for item in day_data.get('items', []):
+            calculated_cost += item.get('cost', 0)
+
+    # 预算验证和修正
+    if total_cost > budget_max or calculated_cost > budget_max:
+        print(f"预算超出限制，AI生成费用: {total_cost}, 计算费用: {calculated_cost}, 预算上限: {budget_max}")
+        # 按比例缩减费用
+        scale_factor = budget_max * 0.9 / max(total_cost, calculated_cost)
+
+        # 修正每个项目的费用
+        for day_data in ai_result.get('days', []):
+            for item in day_data.get('items', []):
+                item['cost'] = round(item.get('cost', 0) * scale_factor)
+
+        # 重新计算总费用
+        calculated_cost = 0
+        for day_data in ai_result.get('days', []):
+            for item in day_data.get('items', []):
+                calculated_cost += item.get('cost', 0)
+
+        ai_result['total_cost'] = calculated_cost
+        total_cost = calculated_cost
+
+    # 最终验证
+    if total_cost < budget_min * 0.8:
+        print(f"预算过低，调整为最低预算的80%: {budget_min * 0.8}")
+        ai_result['total_cost'] = int(budget_min * 0.8)
+
+    return ai_result
+
+
+def plan_cache_key(destinations, days, budget_min, budget_max, theme, transport, budget_band=500):
+    """
+    根据规范化后的用户输入计算缓存键
+    目的地去除空白并忽略大小写，预算按budget_band元分档，命中后会按实际预算重新修正费用
+    """
+    normalized = {
+        'destinations': [d.strip().lower() for d in destinations if d and d.strip()],
+        'days': int(days),
+        'budget_band': [int(budget_min // budget_band), int(budget_max // budget_band)],
+        'theme': (theme or '').strip().lower(),
+        'transport': (transport or '').strip().lower()
+    }
+    raw = json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def rebase_plan_dates(ai_result, start_date):
+    """将缓存的计划日期平移到新的出发日期（原地修改ai_result）"""
+    for day_data in ai_result.get('days', []):
+        day_date = start_date + timedelta(days=day_data.get('day', 1) - 1)
+        day_data['date'] = day_date.isoformat()
+    return ai_result
+
+
+def build_itinerary(day_data, start_date, travel_plan_id):
+    """根据AI返回的单日数据构建Itinerary"""
+    return Itinerary(
+        day_number=day_data.get('day', 1),
+        date=start_date + timedelta(days=day_data.get('day', 1) - 1),
+        theme=day_data.get('theme', ''),
+        travel_plan_id=travel_plan_id
+    )
+
+
+def classify_activity(item):
+    """返回AI行程项的活动类型：优先使用AI给出的activity_type，否则先按活动名称、再按地点推断，默认为visit"""
+    activity_type = str(item.get('activity_type') or '').strip().lower()
+    if activity_type in ACTIVITY_TYPES:
+        return activity_type
+    for field in ('activity', 'location'):
+        text = item.get(field) or ''
+        for candidate, keywords in ACTIVITY_KEYWORDS:
+            if any(keyword in text for keyword in keywords):
+                return candidate
+    return 'visit'
+
+
+def build_itinerary_items(day_data, itinerary_id):
+    """根据AI返回的单日数据构建当天的ItineraryItem列表"""
+    items = []
+    for idx, item in enumerate(day_data.get('items', [])):
+        # 处理时间格式，将中文冒号转换为英文冒号
+        time_str = item.get('time', '09:00')
+        if time_str:
+            time_str = time_str.replace('：', ':')
+
+        items.append(ItineraryItem(
+            start_time=datetime.strptime(time_str, '%H:%M').time(),
+            activity_type=classify_activity(item),
+            title=item.get('activity', ''),
+            description=item.get('description', ''),
+            location=item.get('location', ''),
+            latitude=item.get('latitude'),
+            longitude=item.get('longitude'),
+            estimated_cost=item.get('cost', 0),
+            order_index=idx,
+            itinerary_id=itinerary_id
+        ))
+    return items
+
+
+def parse_itinerary_item_fields(item_data, order_index):
+    """把编辑接口提交的单个行程项转换为ItineraryItem字段字典"""
+    # 处理时间格式，将中文冒号转换为英文冒号
+    start_time_str = item_data.get('start_time', '00:00')
+    end_time_str = item_data.get('end_time', '00:00')
+
+    # 替换中文冒号为英文冒号
+    if start_time_str:
+        start_time_str = start_time_str.replace('：', ':')
+    if end_time_str:
+        end_time_str = end_time_str.replace('：', ':')
+
+    return {
+        'title': item_data.get('title', ''),
+        'start_time': datetime.strptime(start_time_str, '%H:%M').time() if start_time_str else None,
+        'end_time': datetime.strptime(end_time_str, '%H:%M').time() if end_time_str else None,
+        'location': item_data.get('location', ''),
+        'description': item_data.get('description', ''),
+        'activity_type': item_data.get('activity_type', 'visit'),
+        'estimated_cost': item_data.get('estimated_cost', 0),
+        'latitude': item_data.get('latitude'),
+        'longitude': item_data.get('longitude'),
+        'order_index': order_index
+    }
+
+
+def model_rows(objects):
+    """
+    把尚未入库的模型对象转换为批量INSERT使用的字典列表
+    每行包含相同的列（主键除外），保证可以合并为一次executemany
+    """
+    rows = []
+    for obj in objects:
+        columns = obj.__table__.columns
+        rows.append({c.key: getattr(obj, c.key) for c in columns if not c.primary_key})
+    return rows
+
+
+class DayStreamParser:
+    """
+    流式JSON增量解析器
+    逐段喂入模型输出，每当顶层 "days" 数组中的一个对象完整闭合时即解析并返回，
+    不必等待整个JSON响应结束
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_key = None
+        self._expect_days = False
+        self._days_depth = None
+        self._days_done = False
+        self._day_start = None
+
+    def feed(self, text):
+        """追加一段输出，返回本次新解析出的完整日程列表"""
+        self.buffer += text
+        days = []
+        buffer = self.buffer
+        while self._pos < len(buffer):
+            ch = buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = buffer[self._string_start + 1:self._pos]
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = self._pos
+            elif ch == ':':
+                self._expect_days = self._depth == 1 and self._last_key == 'days' and not self._days_done
+            elif ch in '{[':
+                self._depth += 1
+                if ch == '[' and self._expect_days:
+                    self._days_depth = self._depth
+                elif ch == '{' and self._days_depth is not None and self._depth == self._days_depth + 1:
+                    self._day_start = self._pos
+                self._expect_days = False
+            elif ch in '}]':
+                if ch == '}' and self._day_start is not None and self._depth == self._days_depth + 1:
+                    try:
+                        days.append(json.loads(buffer[self._day_start:self._pos + 1]))
+                    except ValueError:
+                        pass
+                    self._day_start = None
+                elif ch == ']' and self._days_depth is not None and self._depth == self._days_depth:
+                    self._days_depth = None
+                    self._days_done = True
+                self._depth -= 1
+            self._pos += 1
+        return days
+
+
+def serialize_plan(plan):
+    """
+    序列化计划详情（含每日行程和行程项目），供计划详情和分享接口共用
+    无论行程天数多少，只执行两次查询：一次取全部行程，一次取全部行程项目，排序由数据库完成
+    """
+    itineraries = Itinerary.query.filter_by(travel_plan_id=plan.id).order_by(
+        Itinerary.day_number, Itinerary.id
+    ).all()
+    items = ItineraryItem.query.join(Itinerary).filter(
+        Itinerary.travel_plan_id == plan.id
+    ).order_by(ItineraryItem.itinerary_id, ItineraryItem.order_index, ItineraryItem.id).all()
+
+    items_by_itinerary = {}
+    for item in items:
+        items_by_itinerary.setdefault(item.itinerary_id, []).append({
+            'id': item.id,
+            'start_time': item.start_time.strftime('%H:%M'),
+            'end_time': item.end_time.strftime('%H:%M') if item.end_time else None,
+            'activity_type': item.activity_type,
+            'title': item.title,
+            'description': item.description,
+            'location': item.location,
+            'latitude': item.latitude,
+            'longitude': item.longitude,
+            'estimated_cost': item.estimated_cost,
+            'order_index': item.order_index
+        })
+
+    # 动态判断已完成
+    plan_end_date = plan.end_date if isinstance(plan.end_date, date) else datetime.strptime(plan.end_date, '%Y-%m-%d').date()
+    status = 'completed' if plan_end_date < date.today() else plan.status
+
+    return {
+        'id': plan.id,
+        'title': plan.title,
+        'start_date': plan.start_date.isoformat(),
+        'end_date': plan.end_date.isoformat(),
+        'total_days': plan.total_days,
+        'budget_min': plan.budget_min,
+        'budget_max': plan.budget_max,
+        'travel_theme': plan.travel_theme,
+        'transport_mode': plan.transport_mode,
+        'status': status,
+        'ai_generated': plan.ai_generated,
+        'itineraries': [{
+            'id': itinerary.id,
+            'day_number': itinerary.day_number,
+            'date': itinerary.date.isoformat(),
+            'theme': itinerary.theme,
+            'notes': itinerary.notes,
+            'items': items_by_itinerary.get(itinerary.id, [])
+        } for itinerary in itineraries]
+    }
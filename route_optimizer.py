@@ -0,0 +1,101 @@
+"""
+行程顺序优化模块
+在本地距离矩阵上用最近邻构造 + 2-opt改进求解单日游览顺序（开放路径，不回到起点），不调用任何外部接口。
+固定位置的行程项（如用餐、住宿）保持原位置不动，只在其余位置之间调整顺序。
+"""
+
+import numpy as np
+
+from geo_distance import distance_matrix
+
+
+def order_length(dist, order):
+    """按order顺序依次经过各点的总距离"""
+    order = np.asarray(order)
+    return float(dist[order[:-1], order[1:]].sum())
+
+
+def _nearest_neighbour(dist, fixed):
+    """按位置依次填充：固定位置保持原点，其余位置选择离上一个点最近的未使用点"""
+    n = len(fixed)
+    order = list(range(n))
+    free = [i for i in range(n) if not fixed[i]]
+    remaining = set(free)
+    prev = None
+    for pos in range(n):
+        if fixed[pos]:
+            prev = pos
+            continue
+        if prev is None:
+            # 第一个位置没有前驱时保留原来的起点
+            choice = pos if pos in remaining else min(remaining)
+        else:
+            choice = min(remaining, key=lambda i: dist[prev, i])
+        remaining.remove(choice)
+        order[pos] = choice
+        prev = choice
+    return order
+
+
+def _free_runs(fixed):
+    """固定位置把序列切分成若干段连续的可调整位置，返回 [(起始位置, 结束位置), ...]"""
+    runs = []
+    start = None
+    for pos, is_fixed in enumerate(list(fixed) + [True]):
+        if not is_fixed and start is None:
+            start = pos
+        elif is_fixed and start is not None:
+            runs.append((start, pos - 1))
+            start = None
+    return runs
+
+
+def _two_opt(dist, order, fixed):
+    """在每段连续的可调整位置内反转子路径，直到没有能缩短总距离的反转"""
+    n = len(order)
+    improved = True
+    while improved:
+        improved = False
+        for run_start, run_end in _free_runs(fixed):
+            for i in range(run_start, run_end):
+                for j in range(i + 1, run_end + 1):
+                    before = 0.0
+                    after = 0.0
+                    if i > 0:
+                        before += dist[order[i - 1], order[i]]
+                        after += dist[order[i - 1], order[j]]
+                    if j < n - 1:
+                        before += dist[order[j], order[j + 1]]
+                        after += dist[order[i], order[j + 1]]
+                    if after < before - 1e-9:
+                        order[i:j + 1] = reversed(order[i:j + 1])
+                        improved = True
+    return order
+
+
+def optimize_visit_order(points, fixed):
+    """
+    优化游览顺序
+
+    Args:
+        points: [[经度, 纬度], ...]，按当前顺序排列
+        fixed: 与points等长的布尔列表，True表示该位置的点不能移动
+
+    Returns:
+        tuple: (新顺序（原下标列表）, 优化前总距离, 优化后总距离)，距离单位为公里
+    """
+    n = len(points)
+    identity = list(range(n))
+    if n < 2:
+        return identity, 0.0, 0.0
+
+    dist = distance_matrix(points)
+    before = order_length(dist, identity)
+    if n < 3 or all(fixed):
+        return identity, before, before
+
+    order = _two_opt(dist, _nearest_neighbour(dist, fixed), fixed)
+    after = order_length(dist, order)
+    if after >= before - 1e-9:
+        return identity, before, before
+    return order, before, after
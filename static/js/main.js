@@ -134,9 +134,11 @@ class TravelAgent {
         }
     }
 
-    // 轮询任务状态
-    async pollTaskStatus(taskId, interval = 3000, maxAttempts = 100) {
-        let attempts = 0;
+    // 监听任务状态：优先使用SSE推送，浏览器不支持或连接失败时退回长轮询
+    pollTaskStatus(taskId, timeoutMs = 300000) {
+        const startedAt = Date.now();
+        let finished = false;
+        let renderedDays = 0;
         
         // 状态消息元素
         const statusElement = document.createElement('div');
@@ -148,83 +150,137 @@ class TravelAgent {
             statusElement.querySelector('span').textContent = `正在生成您的旅行计划 (${percent}%)...`;
         };
         
-        const checkStatus = async () => {
-            try {
-                const response = await fetch(`/api/task/${taskId}`, {
-                    credentials: 'include'
-                });
-                
-                if (!response.ok) {
-                    throw new Error('获取任务状态失败');
-                }
-                
-                const result = await response.json();
-                attempts++;
-                
-                // 更新进度百分比（简单模拟）
-                let progressPercent = Math.min(Math.round((attempts / maxAttempts) * 80), 80);
-                
-                // 根据任务状态处理
-                switch (result.status) {
-                    case 'completed':
-                        // 成功完成
-                        updateProgress(100);
-                        setTimeout(() => {
-                            document.body.removeChild(statusElement);
-                            this.showPlanResult(result.plan);
-                            this.loadPlans(); // 重新加载计划列表
-                            this.showSuccessMessage('旅行方案生成成功！');
-                            this.setLoading(false);
-                        }, 500);
-                        return;
-                        
-                    case 'failed':
-                        // 任务失败
-                        document.body.removeChild(statusElement);
-                        this.showErrorMessage(result.error || '生成失败，请重试');
+        const finish = () => {
+            finished = true;
+            if (statusElement.parentNode) {
+                document.body.removeChild(statusElement);
+            }
+        };
+        
+        const fail = (message) => {
+            finish();
+            this.showErrorMessage(message);
+            this.loadPlans();
+            this.setLoading(false);
+        };
+        
+        // 处理一次任务状态，任务结束时返回true
+        const handleResult = (result) => {
+            if (finished) {
+                return true;
+            }
+            
+            // 按已等待时间估算进度
+            const ratio = (Date.now() - startedAt) / timeoutMs;
+            
+            switch (result.status) {
+                case 'completed':
+                    // 成功完成
+                    finished = true;
+                    updateProgress(100);
+                    setTimeout(() => {
+                        finish();
+                        this.showPlanResult(result.plan);
+                        this.loadPlans(); // 重新加载计划列表
+                        this.showSuccessMessage('旅行方案生成成功！');
                         this.setLoading(false);
-                        return;
-                        
-                    case 'processing':
-                        // 处理中，进度稍微更快一些
-                        progressPercent = Math.min(50 + Math.round((attempts / maxAttempts) * 30), 80);
-                        updateProgress(progressPercent);
-                        break;
-                        
-                    case 'pending':
-                        // 等待处理
-                        updateProgress(progressPercent);
-                        break;
-                }
-                
-                // 达到最大尝试次数
-                if (attempts >= maxAttempts) {
-                    document.body.removeChild(statusElement);
-                    this.showErrorMessage('生成超时，请稍后查看您的计划列表');
-                    this.loadPlans();
+                    }, 500);
+                    return true;
+                    
+                case 'failed':
+                    // 任务失败
+                    finish();
+                    this.showErrorMessage(result.error || '生成失败，请重试');
                     this.setLoading(false);
+                    return true;
+                    
+                case 'processing':
+                    // 处理中，进度稍微更快一些
+                    updateProgress(Math.min(50 + Math.round(ratio * 30), 80));
+                    // 流式生成时先展示已经生成好的天数
+                    if (result.partial && result.plan && result.plan.days.length > renderedDays) {
+                        this.showPlanResult(result.plan, renderedDays === 0);
+                        renderedDays = result.plan.days.length;
+                    }
+                    break;
+                    
+                case 'pending':
+                    // 等待处理
+                    updateProgress(Math.min(Math.round(ratio * 80), 80));
+                    break;
+            }
+            return false;
+        };
+        
+        // 长轮询：服务端在任务变化时立即返回，否则最多挂起25秒
+        const longPoll = async (since) => {
+            let failures = 0;
+            while (!finished) {
+                if (Date.now() - startedAt > timeoutMs) {
+                    fail('生成超时，请稍后查看您的计划列表');
                     return;
                 }
-                
-                // 继续轮询
-                setTimeout(checkStatus, interval);
-                
-            } catch (error) {
-                console.error('轮询任务状态失败:', error);
-                // 错误时继续尝试
-                if (attempts < maxAttempts) {
-                    setTimeout(checkStatus, interval);
-                } else {
-                    document.body.removeChild(statusElement);
-                    this.showErrorMessage('无法获取任务状态，请稍后查看您的计划列表');
-                    this.loadPlans();
-                    this.setLoading(false);
+                try {
+                    const params = new URLSearchParams({ wait: 25 });
+                    if (since) {
+                        params.set('since', since);
+                    }
+                    const response = await fetch(`/api/task/${taskId}?${params}`, {
+                        credentials: 'include'
+                    });
+                    
+                    if (!response.ok) {
+                        throw new Error('获取任务状态失败');
+                    }
+                    
+                    const result = await response.json();
+                    since = result.version;
+                    failures = 0;
+                    if (handleResult(result)) {
+                        return;
+                    }
+                    // 服务端挂起的连接已满时没有等待，按retry_after间隔短轮询
+                    if (result.retry_after) {
+                        await new Promise(resolve => setTimeout(resolve, result.retry_after * 1000));
+                    }
+                } catch (error) {
+                    console.error('轮询任务状态失败:', error);
+                    // 错误时稍后重试
+                    if (++failures >= 5) {
+                        fail('无法获取任务状态，请稍后查看您的计划列表');
+                        return;
+                    }
+                    await new Promise(resolve => setTimeout(resolve, 3000));
                 }
             }
         };
         
-        // 开始轮询
-        setTimeout(checkStatus, 1000);
+        if (!window.EventSource) {
+            longPoll(null);
+            return;
+        }
+        
+        let lastVersion = null;
+        const source = new EventSource(`/api/task/${taskId}/events`, { withCredentials: true });
+        source.addEventListener('status', (event) => {
+            const result = JSON.parse(event.data);
+            lastVersion = result.version;
+            if (handleResult(result)) {
+                source.close();
+            }
+        });
+        source.onerror = () => {
+            // 服务端定期关闭连接时EventSource会自动重连，只有连接被彻底关闭时才改用长轮询
+            if (!finished && source.readyState === EventSource.CLOSED) {
+                longPoll(lastVersion);
+            }
+        };
+        setTimeout(() => {
+            if (!finished) {
+                source.close();
+                fail('生成超时，请稍后查看您的计划列表');
+            }
+        }, timeoutMs);
     }
 
     getFormData() {
@@ -266,7 +322,7 @@ class TravelAgent {
         }
     }
 
-    showPlanResult(plan) {
+    showPlanResult(plan, scroll = true) {
         const resultSection = document.getElementById('resultSection');
         const planResult = document.getElementById('planResult');
 
@@ -377,7 +433,9 @@ class TravelAgent {
         }
         
         // 滚动到结果区域
-        resultSection.scrollIntoView({ behavior: 'smooth' });
+        if (scroll) {
+            resultSection.scrollIntoView({ behavior: 'smooth' });
+        }
     }
 
     getBudgetStatus(totalCost, calculatedCost) {
@@ -161,7 +161,8 @@ class TravelMap {
             strokeColor = '#FF6B6B',
             strokeWeight = 6,
             strokeOpacity = 0.8,
-            forceRefresh = false // 强制刷新标志
+            forceRefresh = false, // 强制刷新标志
+            days = null // 可选：按天分组的坐标点，后端按天分段规划
         } = options;
 
         // 验证输入参数
@@ -185,15 +186,13 @@ class TravelMap {
             return;
         }
 
-        // 限制中间点数量并进行抽样
-        let processedWaypoints = validWaypoints;
-        if (validWaypoints.length > 8) {
-            processedWaypoints = this.sampleWaypoints(validWaypoints, 6);
-            console.log(`坐标点过多，抽样为${processedWaypoints.length}个点`);
-        }
+        // 不再在前端抽样：后端会按天、按每段16个点切分并发规划，保留全部途经点
+        const processedWaypoints = validWaypoints;
 
-        // 计算当前路径的哈希值
-        const waypointsHash = this.calculateWaypointsHash(processedWaypoints);
+        // 计算当前路径的哈希值（按天分组时每天之间加分隔，分组变化也会重新规划）
+        const waypointsHash = this.calculateWaypointsHash(
+            days ? days.flatMap(day => [...day, [0, 0]]) : processedWaypoints
+        );
         
         // 检查是否需要重新计算路线
         if (!forceRefresh && 
@@ -228,12 +227,20 @@ class TravelMap {
                 },
                 credentials: 'include',
                 body: JSON.stringify({
-                    waypoints: waypoints
+                    waypoints: waypoints,
+                    days: options.days || null,
+                    // 请求差分编码的折线，并按缩放级别在服务端简化，减少传输数据量
+                    format: 'encoded',
+                    zoom: Math.max(this.map.getZoom(), 15)
                 })
             });
 
             const result = await response.json();
 
+            if (result.success && result.route && result.route.polyline_format === 'encoded') {
+                result.route.polyline = MapUtils.decodePolyline(result.route.polyline, result.route.polyline_precision);
+            }
+
             if (result.success && result.route) {
                 console.log('后端路线规划成功');
                 
@@ -272,18 +279,38 @@ class TravelMap {
             return;
         }
 
+        // 按天分段规划时每天单独绘制，避免把前一天终点和后一天起点连起来
+        const paths = [];
+        if (routeData.segments && routeData.segments.some(segment => segment.day)) {
+            let currentDay = null;
+            routeData.segments.forEach(segment => {
+                const [start, end] = segment.polyline_range;
+                const points = routeData.polyline.slice(start, end);
+                if (segment.day === currentDay && paths.length > 0) {
+                    paths[paths.length - 1].push(...points);
+                } else {
+                    paths.push(points);
+                    currentDay = segment.day;
+                }
+            });
+        } else {
+            paths.push(routeData.polyline);
+        }
+
         // 创建路线
-        const polyline = new AMap.Polyline({
-            path: routeData.polyline,
-            strokeColor: strokeColor,
-            strokeWeight: strokeWeight,
-            strokeOpacity: strokeOpacity,
-            lineJoin: 'round',
-            lineCap: 'round'
-        });
+        paths.forEach(path => {
+            const polyline = new AMap.Polyline({
+                path: path,
+                strokeColor: strokeColor,
+                strokeWeight: strokeWeight,
+                strokeOpacity: strokeOpacity,
+                lineJoin: 'round',
+                lineCap: 'round'
+            });
 
-        this.map.add(polyline);
-        this.polylines.push(polyline);
+            this.map.add(polyline);
+            this.polylines.push(polyline);
+        });
 
         console.log(`路线绘制完成: ${routeData.distance}公里, ${routeData.duration}分钟`);
     }
@@ -308,25 +335,6 @@ class TravelMap {
         }
     }
 
-    // 抽样航点，保留起点、终点和关键中间点
-    sampleWaypoints(waypoints, maxPoints) {
-        if (waypoints.length <= maxPoints) {
-            return waypoints;
-        }
-
-        const result = [waypoints[0]]; // 起点
-        const step = Math.floor((waypoints.length - 2) / (maxPoints - 2));
-        
-        for (let i = step; i < waypoints.length - 1; i += step) {
-            if (result.length < maxPoints - 1) {
-                result.push(waypoints[i]);
-            }
-        }
-        
-        result.push(waypoints[waypoints.length - 1]); // 终点
-        return result;
-    }
-
     // 计算两点间距离（米）
     calculateDistance(point1, point2) {
         if (!point1 || !point2) return Infinity;
@@ -593,6 +601,33 @@ class MapUtils {
         }
     }
 
+    // 解码后端返回的差分编码折线，返回[[经度, 纬度], ...]
+    static decodePolyline(encoded, precision = 5) {
+        const factor = Math.pow(10, precision);
+        const points = [];
+        let index = 0;
+        let lng = 0;
+        let lat = 0;
+        while (index < encoded.length) {
+            const deltas = [];
+            for (let k = 0; k < 2; k++) {
+                let result = 0;
+                let shift = 0;
+                let byte;
+                do {
+                    byte = encoded.charCodeAt(index++) - 63;
+                    result |= (byte & 0x1f) << shift;
+                    shift += 5;
+                } while (byte >= 0x20);
+                deltas.push(result & 1 ? ~(result >> 1) : result >> 1);
+            }
+            lng += deltas[0];
+            lat += deltas[1];
+            points.push([lng / factor, lat / factor]);
+        }
+        return points;
+    }
+
     // 计算两点间距离
     static calculateDistance(pos1, pos2) {
         return AMap.GeometryUtil.distance(pos1, pos2);
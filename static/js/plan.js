@@ -67,6 +67,42 @@ class PlanDetailPage {
             throw new Error('获取计划数据失败');
         }
         this.planData = await response.json();
+        await this.fillMissingCoordinates();
+    }
+
+    // 一次请求批量解析所有缺少坐标的地点，服务端会把坐标写回计划，之后打开计划不再需要解析
+    async fillMissingCoordinates() {
+        const missing = [];
+        (this.planData.itineraries || []).forEach(itinerary => {
+            (itinerary.items || []).forEach(item => {
+                if (item.location && (!item.latitude || !item.longitude)) {
+                    missing.push(item);
+                }
+            });
+        });
+        if (missing.length === 0) return;
+
+        try {
+            const response = await fetch('/api/geocode/batch', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                credentials: 'include',
+                body: JSON.stringify({ plan_id: this.planData.id })
+            });
+            const data = await response.json();
+            if (!data.success) return;
+            missing.forEach(item => {
+                const result = data.results[item.location];
+                if (result) {
+                    item.latitude = result.latitude;
+                    item.longitude = result.longitude;
+                }
+            });
+        } catch (error) {
+            console.error('批量地理编码失败:', error);
+        }
     }
 
     initMap() {
@@ -224,6 +260,14 @@ class PlanDetailPage {
             });
         }
 
+        // 优化游览顺序按钮
+        const optimizeRouteBtn = document.getElementById('optimizeRouteBtn');
+        if (optimizeRouteBtn) {
+            optimizeRouteBtn.addEventListener('click', () => {
+                this.optimizeRoute();
+            });
+        }
+
         // 适应视图按钮
         const fitViewBtn = document.getElementById('fitViewBtn');
         if (fitViewBtn) {
@@ -315,6 +359,41 @@ class PlanDetailPage {
         }
     }
 
+    // 按距离优化每天的游览顺序（用餐、住宿等固定时间的行程不动），保存后重新加载计划
+    async optimizeRoute() {
+        try {
+            this.showLoading(true);
+            const response = await fetch(`/api/plan/${this.planId}/optimize-route`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                credentials: 'include',
+                body: JSON.stringify({})
+            });
+            const result = await response.json();
+            if (!result.success) {
+                this.showError(result.msg || '优化失败');
+                return;
+            }
+            if (result.updated_items === 0) {
+                this.showMessage('当前游览顺序已经是最优', 'info');
+                return;
+            }
+
+            this.showMessage(`游览顺序已优化，预计减少约${result.total_saved_km}公里`, 'success');
+            await this.loadPlanData();
+            this.initMap();
+            this.renderItinerary();
+            this.calculateStats();
+        } catch (error) {
+            console.error('优化游览顺序失败:', error);
+            this.showError('优化游览顺序失败');
+        } finally {
+            this.showLoading(false);
+        }
+    }
+
     // 强制刷新路线（重新计算）
     forceRefreshRoute() {
         if (!this.map) {
@@ -338,30 +417,36 @@ class PlanDetailPage {
         }
         
         if (this.planData) {
-            // 提取所有有坐标的点
+            // 提取所有有坐标的点，同时按天分组（后端按天分段规划）
             const waypoints = [];
+            const days = [];
             const seenCoordinates = new Set();
             
             this.planData.itineraries.forEach(itinerary => {
+                const dayPoints = [];
                 if (itinerary.items) {
                     itinerary.items.forEach(item => {
                         if (item.latitude && item.longitude) {
+                            const point = [item.longitude, item.latitude];
                             // 检查坐标是否重复（保留4位小数精度）
                             const coordKey = `${item.longitude.toFixed(4)},${item.latitude.toFixed(4)}`;
                             if (!seenCoordinates.has(coordKey)) {
                                 seenCoordinates.add(coordKey);
-                                waypoints.push([item.longitude, item.latitude]);
+                                waypoints.push(point);
                             }
+                            // 同一天内相邻的重复点由后端合并，这里保留原始顺序
+                            dayPoints.push(point);
                         }
                     });
                 }
+                days.push(dayPoints);
             });
 
             console.log(`收集到${waypoints.length}个不重复坐标点`);
 
             if (waypoints.length > 1) {
                 // 使用地图对象的路线规划方法（已经更新为使用后端API）
-                this.map.drawRoute(waypoints, { forceRefresh });
+                this.map.drawRoute(waypoints, { forceRefresh, days });
                 
                 if (forceRefresh) {
                     this.showMessage(`强制重新规划包含${waypoints.length}个地点的路线...`, 'info');
@@ -433,7 +518,7 @@ class PlanDetailPage {
             if (day.items && day.items.length > 0) {
                 day.items.forEach((item, itemIndex) => {
                     itemsHtml += `
-                    <div class="edit-item" data-item-index="${itemIndex}">
+                    <div class="edit-item" data-item-index="${itemIndex}" data-item-id="${item.id || ''}">
                         <div class="item-header">
                             <h4>行程项 #${itemIndex + 1}</h4>
                             <button type="button" class="btn-icon delete-item" onclick="planDetail.removeItineraryItem(${day.day_number}, ${itemIndex})">🗑️</button>
@@ -790,6 +875,8 @@ class PlanDetailPage {
                     }
                     
                     const updatedItem = {
+                        // 已有行程项带上ID，服务端据此只更新有变化的项；新增项没有ID
+                        id: parseInt(itemElement.dataset.itemId) || null,
                         title: itemElement.querySelector('.item-title').value.trim(),
                         start_time: startTime,
                         end_time: endTime,
@@ -0,0 +1,615 @@
+"""
+后台任务队列模块
+提供可插拔的任务状态存储（内存 / 数据库表）和有界的工作线程池。
+使用数据库存储时，任务状态对所有gunicorn worker进程可见。每个进程定期为自己持有的任务续租（heartbeat_at），
+进程退出后租约过期的任务由其他进程接管重新执行，超过重试次数的标记为失败。
+"""
+
+import json
+import math
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func
+
+from database.models import db, BackgroundTask
+
+ACTIVE_STATUSES = ('pending', 'processing')
+HOST_LOST_ERROR = '任务所在的服务器已重启，请重新提交'
+INTERRUPTED_ERROR = '任务执行多次中断，请重新提交'
+
+
+def _to_json(value):
+    return json.dumps(value, ensure_ascii=False) if value is not None else None
+
+
+def _from_json(value):
+    return json.loads(value) if value else None
+
+
+class MemoryTaskBackend:
+    """内存任务存储，仅在单进程内有效，主要用于本地开发和测试"""
+
+    def __init__(self):
+        self._tasks = {}
+        self._lock = threading.Condition()
+
+    def create(self, task_id, task_type, user_id, payload, owner=None, host=None):
+        now = datetime.utcnow()
+        with self._lock:
+            self._tasks[task_id] = {
+                'id': task_id,
+                'task_type': task_type,
+                'user_id': user_id,
+                'status': 'pending',
+                'payload': payload,
+                'result': None,
+                'error': None,
+                'owner': owner,
+                'host': host,
+                'heartbeat_at': now,
+                'attempts': 0,
+                'created_at': now,
+                'updated_at': now
+            }
+
+    def get(self, task_id):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return dict(task) if task else None
+
+    def claim(self, task_id, owner=None):
+        """将任务从pending原子地切换为processing，返回是否抢占成功"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if not task or task['status'] != 'pending':
+                return False
+            now = datetime.utcnow()
+            task.update(status='processing', owner=owner, heartbeat_at=now, updated_at=now,
+                        attempts=task['attempts'] + 1)
+            self._lock.notify_all()
+            return True
+
+    def heartbeat(self, owner):
+        now = datetime.utcnow()
+        with self._lock:
+            for task in self._tasks.values():
+                if task['owner'] == owner and task['status'] in ACTIVE_STATUSES:
+                    task['heartbeat_at'] = now
+
+    def update(self, task_id, **fields):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task:
+                task.update(fields)
+                task['updated_at'] = datetime.utcnow()
+                self._lock.notify_all()
+
+    def wait_for_update(self, task_id, since, timeout):
+        """阻塞直到任务的updated_at不同于since，或超时；返回最新的任务状态"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                task = self._tasks.get(task_id)
+                remaining = deadline - time.monotonic()
+                if not task or task['updated_at'] != since or remaining <= 0:
+                    return dict(task) if task else None
+                self._lock.wait(remaining)
+
+    def delete(self, task_id):
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def pending_tasks(self, owner):
+        with self._lock:
+            return [(t['id'], t['task_type']) for t in self._tasks.values()
+                    if t['status'] == 'pending' and t['owner'] == owner]
+
+    def release_expired(self, lease_before, owner, host, max_attempts):
+        """接管租约过期的任务，规则与DatabaseTaskBackend.release_expired相同"""
+        now = datetime.utcnow()
+        with self._lock:
+            for task in self._tasks.values():
+                if task['status'] not in ACTIVE_STATUSES or task['heartbeat_at'] >= lease_before:
+                    continue
+                if task['host'] and task['host'] != host:
+                    task.update(status='failed', error=HOST_LOST_ERROR, updated_at=now)
+                elif task['status'] == 'processing' and task['attempts'] >= max_attempts:
+                    task.update(status='failed', error=INTERRUPTED_ERROR, updated_at=now)
+                else:
+                    task.update(status='pending', owner=owner, heartbeat_at=now, updated_at=now)
+            self._lock.notify_all()
+
+    def expire(self, finished_before, stale_before):
+        """删除过期的已结束任务，将长时间未完成的任务标记为失败（并唤醒等待这些任务的连接）"""
+        now = datetime.utcnow()
+        with self._lock:
+            for task_id, task in list(self._tasks.items()):
+                if task['status'] in ('completed', 'failed') and task['created_at'] < finished_before:
+                    self._tasks.pop(task_id, None)
+                elif task['status'] in ('pending', 'processing') and task['created_at'] < stale_before:
+                    task.update(status='failed', error='任务处理超时', updated_at=now)
+            self._lock.notify_all()
+
+
+class DatabaseTaskBackend:
+    """
+    数据库任务存储（SQLite / PostgreSQL），使用独立连接读写，不影响业务代码的session事务
+    本进程内的任务更新会直接唤醒等待者；其他进程的更新只能靠每隔poll_interval秒查询一次数据库发现
+    """
+
+    def __init__(self, app, poll_interval=2.5):
+        self.app = app
+        self.table = BackgroundTask.__table__
+        self.poll_interval = poll_interval
+        # 本进程内每个任务的更新次数，用于唤醒wait_for_update
+        self._changed = threading.Condition()
+        self._versions = {}
+
+    def _notify(self, task_id):
+        with self._changed:
+            self._versions[task_id] = self._versions.get(task_id, 0) + 1
+            self._changed.notify_all()
+
+    def _execute(self, statement):
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                result = conn.execute(statement)
+                if result.returns_rows:
+                    return result.mappings().all()
+                return result.rowcount
+
+    def create(self, task_id, task_type, user_id, payload, owner=None, host=None):
+        now = datetime.utcnow()
+        self._execute(self.table.insert().values(
+            id=task_id,
+            task_type=task_type,
+            user_id=user_id,
+            status='pending',
+            payload=_to_json(payload),
+            owner=owner,
+            host=host,
+            heartbeat_at=now,
+            attempts=0,
+            created_at=now,
+            updated_at=now
+        ))
+
+    def get(self, task_id):
+        rows = self._execute(self.table.select().where(self.table.c.id == task_id))
+        if not rows:
+            return None
+        task = dict(rows[0])
+        task['payload'] = _from_json(task['payload'])
+        task['result'] = _from_json(task['result'])
+        return task
+
+    def claim(self, task_id, owner=None):
+        """将任务从pending原子地切换为processing并记录执行者，多个进程同时抢占时只有一个会成功"""
+        now = datetime.utcnow()
+        rowcount = self._execute(self.table.update().where(
+            self.table.c.id == task_id,
+            self.table.c.status == 'pending'
+        ).values(status='processing', owner=owner, heartbeat_at=now, updated_at=now,
+                 attempts=func.coalesce(self.table.c.attempts, 0) + 1))
+        if rowcount == 1:
+            self._notify(task_id)
+        return rowcount == 1
+
+    def update(self, task_id, **fields):
+        if 'result' in fields:
+            fields['result'] = _to_json(fields['result'])
+        if 'payload' in fields:
+            fields['payload'] = _to_json(fields['payload'])
+        fields['updated_at'] = datetime.utcnow()
+        self._execute(self.table.update().where(self.table.c.id == task_id).values(**fields))
+        self._notify(task_id)
+
+    def delete(self, task_id):
+        self._execute(self.table.delete().where(self.table.c.id == task_id))
+
+    def wait_for_update(self, task_id, since, timeout):
+        """
+        等待任务的updated_at不同于since或超时：任务在本进程执行时由更新直接唤醒，
+        否则每隔poll_interval秒查询一次数据库（其他进程的更新无法通过内存通知）
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._changed:
+                seen = self._versions.get(task_id, 0)
+            rows = self._execute(
+                db.select(self.table.c.updated_at).where(self.table.c.id == task_id)
+            )
+            if not rows or rows[0]['updated_at'] != since or time.monotonic() >= deadline:
+                return self.get(task_id)
+            next_poll = min(time.monotonic() + self.poll_interval, deadline)
+            with self._changed:
+                while self._versions.get(task_id, 0) == seen:
+                    remaining = next_poll - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+
+    def heartbeat(self, owner):
+        """为本进程创建、接管或正在执行的任务续租；不修改updated_at，不会唤醒等待任务变化的客户端"""
+        self._execute(self.table.update().where(
+            self.table.c.owner == owner,
+            self.table.c.status.in_(ACTIVE_STATUSES)
+        ).values(heartbeat_at=datetime.utcnow()))
+
+    def pending_tasks(self, owner):
+        rows = self._execute(
+            db.select(self.table.c.id, self.table.c.task_type)
+            .where(self.table.c.status == 'pending', self.table.c.owner == owner)
+            .order_by(self.table.c.created_at)
+        )
+        return [(row['id'], row['task_type']) for row in rows]
+
+    def release_expired(self, lease_before, owner, host, max_attempts):
+        """
+        处理租约过期（所属进程已退出）的未完成任务：
+        绑定在其他服务器上的任务（依赖该服务器上的本地文件）直接失败；
+        执行中断次数达到max_attempts的任务失败；其余改为pending并由owner接管
+        """
+        t = self.table
+        now = datetime.utcnow()
+        expired = and_(t.c.status.in_(ACTIVE_STATUSES),
+                       func.coalesce(t.c.heartbeat_at, t.c.updated_at) < lease_before)
+        self._execute(t.update().where(expired, t.c.host.isnot(None), t.c.host != host)
+                      .values(status='failed', error=HOST_LOST_ERROR, updated_at=now))
+        self._execute(t.update().where(expired, t.c.status == 'processing',
+                                       func.coalesce(t.c.attempts, 0) >= max_attempts)
+                      .values(status='failed', error=INTERRUPTED_ERROR, updated_at=now))
+        self._execute(t.update().where(expired)
+                      .values(status='pending', owner=owner, heartbeat_at=now, updated_at=now))
+
+    def expire(self, finished_before, stale_before):
+        """删除过期的已结束任务，将长时间未完成的任务标记为失败"""
+        self._execute(self.table.delete().where(
+            self.table.c.status.in_(['completed', 'failed']),
+            self.table.c.created_at < finished_before
+        ))
+        self._execute(self.table.update().where(
+            self.table.c.status.in_(['pending', 'processing']),
+            self.table.c.created_at < stale_before
+        ).values(status='failed', error='任务处理超时', updated_at=datetime.utcnow()))
+        with self._changed:
+            self._versions.clear()
+
+
+class QueueFull(Exception):
+    """线程池排队已满，retry_after为建议的重试等待秒数"""
+
+    def __init__(self, pool_name, retry_after):
+        super().__init__(f'任务池 {pool_name} 排队已满')
+        self.pool_name = pool_name
+        self.retry_after = retry_after
+
+
+class WorkerPool:
+    """固定大小、有界排队的工作线程池，线程在第一次提交任务时才启动（兼容gunicorn的fork模型）"""
+
+    def __init__(self, name='default', max_workers=4, max_queue=50):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        # 统计信息
+        self._stats_lock = threading.Lock()
+        self.active = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.finished = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def _ensure_threads(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for _ in range(self.max_workers - len(self._threads)):
+                thread = threading.Thread(target=self._worker_loop, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker_loop(self):
+        while True:
+            fn, args, queued_at = self._queue.get()
+            started_at = time.monotonic()
+            wait = started_at - queued_at
+            with self._stats_lock:
+                self.active += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"工作线程执行任务异常: {str(e)}")
+            finally:
+                with self._stats_lock:
+                    self.active -= 1
+                    self.finished += 1
+                    self.total_run += time.monotonic() - started_at
+                self._queue.task_done()
+
+    def submit(self, fn, *args):
+        """提交任务，排队已满时抛出QueueFull"""
+        self._ensure_threads()
+        try:
+            self._queue.put_nowait((fn, args, time.monotonic()))
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            raise QueueFull(self.name, self.retry_after())
+        with self._stats_lock:
+            self.submitted += 1
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def retry_after(self):
+        """根据排队长度和平均执行时间估算多少秒后会有空位"""
+        with self._stats_lock:
+            avg_run = self.total_run / self.finished if self.finished else 5.0
+        rounds = (self._queue.qsize() + self.active) / max(self.max_workers, 1)
+        return max(1, math.ceil(rounds * avg_run))
+
+    def stats(self):
+        with self._stats_lock:
+            started = self.finished + self.active
+            return {
+                'workers': self.max_workers,
+                'active': self.active,
+                'queue_depth': self._queue.qsize(),
+                'max_queue': self.max_queue,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'finished': self.finished,
+                'avg_wait_ms': round(self.total_wait / started * 1000, 1) if started else 0,
+                'max_wait_ms': round(self.max_wait * 1000, 1),
+                'avg_run_ms': round(self.total_run / self.finished * 1000, 1) if self.finished else 0
+            }
+
+
+class TaskQueue:
+    """异步任务队列：负责任务登记、调度执行、状态查询和过期清理"""
+
+    def __init__(self):
+        self.backend = None
+        self.pools = {}
+        self.handlers = {}
+        self._queued = set()
+        self._queued_lock = threading.Lock()
+        self.result_ttl = 3600
+        self.task_timeout = 7200
+        self.cleanup_interval = 600
+        # 与任务清理一起每cleanup_interval秒执行一次的维护函数（缓存清理、计数修正等）
+        self.periodic_jobs = []
+        # 租约：每heartbeat_interval秒续租一次，超过lease_timeout秒未续租的任务视为所属进程已退出
+        self.heartbeat_interval = 15
+        self.lease_timeout = 60
+        self.max_attempts = 2
+        self.host = socket.gethostname()
+        self._owner = None
+        self._owner_pid = None
+        # 每个进程同时挂起的长轮询/SSE连接数上限，超出时立即返回，由客户端短轮询
+        self.max_waiters = 4
+        self._waiters = 0
+        self._waiters_lock = threading.Lock()
+        self.waiters_rejected = 0
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        """根据配置选择任务存储后端并为每种任务创建独立的工作线程池"""
+        backend = app.config.get('TASK_BACKEND', 'database')
+        if backend == 'memory':
+            self.backend = MemoryTaskBackend()
+        elif backend == 'database':
+            self.backend = DatabaseTaskBackend(app, app.config.get('TASK_WAIT_POLL_INTERVAL', 2.5))
+        else:
+            raise ValueError(f'不支持的任务存储后端: {backend}')
+
+        for name, options in app.config.get('TASK_POOLS', {}).items():
+            self.pools[name] = WorkerPool(name, options.get('workers', 4), options.get('max_queue', 50))
+        self.result_ttl = app.config.get('TASK_RESULT_TTL', 3600)
+        self.task_timeout = app.config.get('TASK_TIMEOUT', 7200)
+        self.max_waiters = app.config.get('TASK_MAX_WAITERS', 4)
+        self.heartbeat_interval = app.config.get('TASK_HEARTBEAT_INTERVAL', 15)
+        self.lease_timeout = app.config.get('TASK_LEASE_TIMEOUT', 60)
+        self.max_attempts = app.config.get('TASK_MAX_ATTEMPTS', 2)
+
+    def register(self, task_type, handler, pool='default'):
+        """注册任务处理函数，处理函数签名为 handler(task_id, **payload)，任务在指定的线程池中执行"""
+        if pool not in self.pools:
+            self.pools[pool] = WorkerPool(pool)
+        self.handlers[task_type] = (handler, pool)
+
+    def register_periodic(self, job):
+        """注册定期维护函数，由维护线程在清理旧任务后调用（无参数，需要时自行进入应用上下文）"""
+        self.periodic_jobs.append(job)
+
+    @property
+    def owner(self):
+        """当前进程的标识（主机名:pid:随机后缀），gunicorn fork出的每个进程各不相同"""
+        if self._owner_pid != os.getpid():
+            self._owner = f'{self.host}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+            self._owner_pid = os.getpid()
+        return self._owner
+
+    def submit(self, task_type, user_id, payload=None, pin_host=False):
+        """
+        登记任务并放入对应线程池，立即返回任务ID；线程池排队已满时抛出QueueFull
+        pin_host为True时任务只能在当前服务器上执行（例如参数中包含本机上传文件的路径）
+        """
+        if task_type not in self.handlers:
+            raise ValueError(f'未注册的任务类型: {task_type}')
+        self._ensure_started()
+
+        task_id = str(uuid.uuid4())
+        self.backend.create(task_id, task_type, user_id, payload or {},
+                            owner=self.owner, host=self.host if pin_host else None)
+        try:
+            self._enqueue(task_id, task_type)
+        except QueueFull:
+            self.backend.delete(task_id)
+            raise
+        return task_id
+
+    def stats(self):
+        """各线程池的排队长度、等待时间等统计信息"""
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+    def get(self, task_id):
+        self._ensure_started()
+        return self.backend.get(task_id)
+
+    def update(self, task_id, **fields):
+        self.backend.update(task_id, **fields)
+
+    def complete(self, task_id, result):
+        self.backend.update(task_id, status='completed', result=result)
+
+    def fail(self, task_id, error):
+        self.backend.update(task_id, status='failed', error=error)
+
+    def delete(self, task_id):
+        self.backend.delete(task_id)
+
+    def acquire_waiter(self):
+        """占用一个挂起连接的名额，已达max_waiters时返回False，调用方应立即返回当前状态"""
+        with self._waiters_lock:
+            if self._waiters >= self.max_waiters:
+                self.waiters_rejected += 1
+                return False
+            self._waiters += 1
+            return True
+
+    def release_waiter(self):
+        with self._waiters_lock:
+            self._waiters -= 1
+
+    def waiter_stats(self):
+        with self._waiters_lock:
+            return {'active': self._waiters, 'max': self.max_waiters, 'rejected': self.waiters_rejected}
+
+    def wait(self, task_id, since=None, timeout=25):
+        """
+        长轮询等待任务变化
+        since为上次看到的updated_at，任务有新变化时立即返回；
+        未提供since时等待任务结束（completed/failed）。超时后返回当前状态。
+        """
+        self._ensure_started()
+        deadline = time.monotonic() + timeout
+        task = self.backend.get(task_id)
+        while task:
+            if task['status'] in ('completed', 'failed'):
+                return task
+            if since is not None and task['updated_at'] != since:
+                return task
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return task
+            task = self.backend.wait_for_update(task_id, task['updated_at'], remaining)
+        return task
+
+    def cleanup(self):
+        """已结束的任务保留result_ttl秒，未结束但超过task_timeout秒的任务视为失败"""
+        now = datetime.utcnow()
+        self.backend.expire(
+            finished_before=now - timedelta(seconds=self.result_ttl),
+            stale_before=now - timedelta(seconds=self.task_timeout)
+        )
+
+    def recover(self):
+        """
+        接管租约过期的任务（所属进程已退出，包括执行到一半的任务），并调度本进程持有的pending任务，
+        排队已满的留到下一轮
+        """
+        self.backend.release_expired(
+            lease_before=datetime.utcnow() - timedelta(seconds=self.lease_timeout),
+            owner=self.owner, host=self.host, max_attempts=self.max_attempts
+        )
+        for task_id, task_type in self.backend.pending_tasks(self.owner):
+            if task_type not in self.handlers:
+                continue
+            try:
+                self._enqueue(task_id, task_type)
+            except QueueFull:
+                continue
+
+    def _enqueue(self, task_id, task_type):
+        with self._queued_lock:
+            if task_id in self._queued:
+                return
+            self._queued.add(task_id)
+        pool = self.pools[self.handlers[task_type][1]]
+        try:
+            pool.submit(self._run, task_id)
+        except QueueFull:
+            with self._queued_lock:
+                self._queued.discard(task_id)
+            raise
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        try:
+            self.recover()
+        except Exception as e:
+            print(f"恢复未完成任务失败: {str(e)}")
+        threading.Thread(target=self._maintenance_loop, daemon=True).start()
+
+    def _maintenance_loop(self):
+        """定期续租、接管过期任务，每cleanup_interval秒清理一次旧任务并执行注册的维护函数"""
+        last_cleanup = time.monotonic()
+        while True:
+            time.sleep(self.heartbeat_interval)
+            try:
+                self.backend.heartbeat(self.owner)
+                self.recover()
+            except Exception as e:
+                print(f"任务维护失败: {str(e)}")
+            if time.monotonic() - last_cleanup < self.cleanup_interval:
+                continue
+            last_cleanup = time.monotonic()
+            # 各维护函数互不影响，一个失败不会跳过其余的
+            for job in [self.cleanup, *self.periodic_jobs]:
+                try:
+                    job()
+                except Exception as e:
+                    print(f"定期维护 {getattr(job, '__name__', job)} 失败: {str(e)}")
+
+    def _run(self, task_id):
+        with self._queued_lock:
+            self._queued.discard(task_id)
+        # 其他进程可能已经抢占了同一个任务
+        if not self.backend.claim(task_id, self.owner):
+            return
+        task = self.backend.get(task_id)
+        handler, _ = self.handlers[task['task_type']]
+        try:
+            handler(task_id, **(task['payload'] or {}))
+        except Exception as e:
+            print(f"任务处理异常: {str(e)}")
+            self.fail(task_id, f'任务处理异常: {str(e)}')
+            return
+
+        # 处理函数没有设置最终状态时，视为异常结束
+        task = self.backend.get(task_id)
+        if task and task['status'] == 'processing':
+            self.fail(task_id, '任务未返回结果')
+
+
+task_queue = TaskQueue()
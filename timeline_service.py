@@ -0,0 +1,195 @@
+"""
+动态时间线模块
+写入时扩散：发布动态时把动态写入作者自己和每个好友的moment_timelines，读取好友/全部动态时
+只需在 (user_id, created_at, moment_id) 索引上做一次范围扫描，不再对整个moments表做OR过滤后排序。
+好友数超过MOMENT_TIMELINE_FANOUT_LIMIT的作者发布时只写入自己的时间线，读取方按作者直接查询（拉取）。
+可见性变化、添加/删除好友时同步增删时间线；rebuild_timelines可按现有数据整体重建
+"""
+
+import heapq
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, select, union
+
+from database.models import db, Friend, Moment, MomentTimeline
+from pagination import encode_cursor, keyset_page
+
+# 好友可以看到的可见性
+SHARED_VISIBILITY = ('public', 'friends')
+
+
+def timeline_enabled():
+    return current_app.config.get('MOMENT_TIMELINE_ENABLED', False)
+
+
+def _fanout_limit():
+    return current_app.config.get('MOMENT_TIMELINE_FANOUT_LIMIT', 500)
+
+
+def _friend_ids(user_id):
+    """
+    用户的全部好友ID（好友关系可能只存了单向记录，两个方向都查）
+    写时间线时直接查库，不用friend_graph的缓存：缓存在提交后才失效，其他进程还可能滞后TTL秒，
+    按过期的好友列表扩散的记录不会再被补上
+    """
+    sent = select(Friend.friend_id).where(Friend.user_id == user_id)
+    received = select(Friend.user_id).where(Friend.friend_id == user_id)
+    return set(db.session.execute(union(sent, received)).scalars())
+
+
+def _pull_authors_query():
+    """好友数超过扩散上限的用户，发布时不写入好友的时间线"""
+    return select(Friend.user_id).group_by(Friend.user_id).having(func.count(Friend.id) > _fanout_limit())
+
+
+def pull_authors(user_ids):
+    """user_ids中需要由读取方直接拉取动态的作者"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+    query = _pull_authors_query().where(Friend.user_id.in_(user_ids))
+    return set(db.session.execute(query).scalars())
+
+
+def _insert_from_moments(viewer_id, *criteria):
+    """把满足条件、尚未在viewer_id时间线中的动态写入其时间线"""
+    already = select(MomentTimeline.id).where(
+        MomentTimeline.user_id == viewer_id,
+        MomentTimeline.moment_id == Moment.id
+    ).exists()
+    db.session.execute(insert(MomentTimeline).from_select(
+        ['user_id', 'moment_id', 'author_id', 'created_at'],
+        select(literal(viewer_id), Moment.id, Moment.user_id, Moment.created_at).where(*criteria, ~already)
+    ))
+
+
+def fan_out_moment(moment):
+    """
+    把新动态写入作者和好友的时间线，在发布动态的同一事务中调用（动态需已flush取得id）
+    私密动态只写入作者自己；作者好友过多时好友改为读取时拉取
+    """
+    entries = [{'user_id': moment.user_id, 'moment_id': moment.id,
+                'author_id': moment.user_id, 'created_at': moment.created_at}]
+    if moment.visibility in SHARED_VISIBILITY and not pull_authors([moment.user_id]):
+        entries += [{'user_id': friend_id, 'moment_id': moment.id,
+                     'author_id': moment.user_id, 'created_at': moment.created_at}
+                    for friend_id in _friend_ids(moment.user_id)]
+    db.session.execute(insert(MomentTimeline), entries)
+
+
+def sync_moment_visibility(moment, previous_visibility):
+    """动态可见性变化后同步好友的时间线：改为私密时收回，从私密改为公开/好友可见时补发"""
+    was_shared = previous_visibility in SHARED_VISIBILITY
+    is_shared = moment.visibility in SHARED_VISIBILITY
+    if was_shared and not is_shared:
+        db.session.execute(delete(MomentTimeline).where(
+            MomentTimeline.moment_id == moment.id,
+            MomentTimeline.user_id != moment.user_id
+        ))
+    elif is_shared and not was_shared and not pull_authors([moment.user_id]):
+        for friend_id in _friend_ids(moment.user_id):
+            _insert_from_moments(friend_id, Moment.id == moment.id)
+
+
+def remove_moment(moment_id):
+    """删除动态前清除所有时间线中的记录"""
+    db.session.execute(delete(MomentTimeline).where(MomentTimeline.moment_id == moment_id))
+
+
+def link_friends(user_id, friend_id):
+    """成为好友后，把双方已发布的公开/好友可见动态补进对方的时间线"""
+    pulled = pull_authors([user_id, friend_id])
+    for viewer_id, author_id in ((user_id, friend_id), (friend_id, user_id)):
+        if author_id not in pulled:
+            _insert_from_moments(viewer_id, Moment.user_id == author_id, Moment.visibility.in_(SHARED_VISIBILITY))
+
+
+def unlink_friends(user_id, friend_id):
+    """
+    删除好友后从双方时间线中移除对方的动态（好友关系需已删除并flush）
+    若一方因此回到扩散上限以内，之前只能拉取的动态要补进其好友的时间线
+    """
+    db.session.execute(delete(MomentTimeline).where(
+        ((MomentTimeline.user_id == user_id) & (MomentTimeline.author_id == friend_id)) |
+        ((MomentTimeline.user_id == friend_id) & (MomentTimeline.author_id == user_id))
+    ))
+    pulled = pull_authors([user_id, friend_id])
+    for author_id in (user_id, friend_id):
+        if author_id in pulled:
+            continue
+        remaining = db.session.execute(
+            select(func.count(Friend.id)).where(Friend.user_id == author_id)
+        ).scalar()
+        if remaining == _fanout_limit():
+            for viewer_id in _friend_ids(author_id):
+                _insert_from_moments(viewer_id, Moment.user_id == author_id,
+                                     Moment.visibility.in_(SHARED_VISIBILITY))
+
+
+def rebuild_timelines():
+    """按现有动态和好友关系重建全部时间线，返回写入的记录数"""
+    db.session.execute(delete(MomentTimeline))
+    columns = ['user_id', 'moment_id', 'author_id', 'created_at']
+    # 自己的全部动态
+    db.session.execute(insert(MomentTimeline).from_select(
+        columns, select(Moment.user_id, Moment.id, Moment.user_id, Moment.created_at)
+        .where(Moment.created_at.isnot(None))
+    ))
+    # 好友的公开/好友可见动态，好友关系两个方向合并去重，跳过需要拉取的作者
+    pairs = union(
+        select(Friend.user_id.label('viewer_id'), Friend.friend_id.label('author_id')),
+        select(Friend.friend_id.label('viewer_id'), Friend.user_id.label('author_id'))
+    ).subquery()
+    db.session.execute(insert(MomentTimeline).from_select(
+        columns,
+        select(pairs.c.viewer_id, Moment.id, Moment.user_id, Moment.created_at)
+        .join(pairs, pairs.c.author_id == Moment.user_id)
+        .where(Moment.created_at.isnot(None), Moment.visibility.in_(SHARED_VISIBILITY),
+               Moment.user_id.not_in(_pull_authors_query()))
+    ))
+    db.session.commit()
+    total = db.session.execute(select(func.count(MomentTimeline.id))).scalar()
+    print(f"动态时间线已重建: {total} 条")
+    return total
+
+
+def timeline_page(viewer_id, friend_ids, position, limit, include_self=True, include_public=True):
+    """
+    从时间线读取一页可见动态的ID，按 (created_at, id) 倒序，与pagination.keyset_page的游标兼容
+    合并三个来源，各自都是索引上的范围扫描：
+      1. 当前用户的时间线（自己的动态和已扩散的好友动态）
+      2. 好友中需要拉取的作者的公开/好友可见动态
+      3. include_public时，非好友的公开动态
+    返回 (动态ID列表, 下一页游标或None)
+    """
+    key = lambda row: (row.created_at, row.id)
+    friend_ids = set(friend_ids)
+    timeline = db.session.query(MomentTimeline.moment_id.label('id'), MomentTimeline.created_at).filter(
+        MomentTimeline.user_id == viewer_id
+    )
+    if not include_self:
+        timeline = timeline.filter(MomentTimeline.author_id != viewer_id)
+    sources = [(timeline, MomentTimeline.created_at, MomentTimeline.moment_id)]
+
+    pulled = pull_authors(friend_ids)
+    if pulled:
+        sources.append((db.session.query(Moment.id, Moment.created_at).filter(
+            Moment.user_id.in_(pulled), Moment.visibility.in_(SHARED_VISIBILITY)
+        ), Moment.created_at, Moment.id))
+    if include_public:
+        sources.append((db.session.query(Moment.id, Moment.created_at).filter(
+            Moment.visibility == 'public', ~Moment.user_id.in_(list(friend_ids | {viewer_id}))
+        ), Moment.created_at, Moment.id))
+
+    pages = [keyset_page(query, time_column, id_column, position, limit, key=key)
+             for query, time_column, id_column in sources]
+    # 拉取的作者在扩散上限附近变化时，同一动态可能同时出现在时间线和拉取结果中
+    merged, seen = [], set()
+    for row in heapq.merge(*(rows for rows, _ in pages), key=key, reverse=True):
+        if row.id not in seen:
+            seen.add(row.id)
+            merged.append(row)
+    has_more = len(merged) > limit or any(cursor for _, cursor in pages)
+    merged = merged[:limit]
+    next_cursor = encode_cursor(merged[-1].created_at, merged[-1].id) if has_more and merged else None
+    return [row.id for row in merged], next_cursor
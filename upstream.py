@@ -0,0 +1,211 @@
+"""
+上游HTTP服务客户端模块
+为高德地图、百度OCR等外部服务提供统一的请求入口：
+每个服务使用独立的requests.Session（按主机复用keep-alive连接池），所有请求都带连接/读取超时，
+幂等请求失败时按带抖动的指数退避重试，连续失败达到阈值后熔断一段时间，并统计每个服务的延迟和错误数。
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamUnavailable(requests.RequestException):
+    """服务处于熔断状态，请求未发出"""
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败failure_threshold次后打开，reset_timeout秒内直接拒绝请求；
+    之后进入半开状态，只放行一个试探请求，成功则关闭，失败则重新打开。
+    _probing记录正在试探的线程，试探请求未记录结果就结束时由该线程调用release让出
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and self._probing is None:
+                self._probing = threading.get_ident()
+                return True
+            return False
+
+    def release(self):
+        """当前线程的试探请求没有结果（非网络异常）时让出试探资格，下一个请求可以重新试探"""
+        with self._lock:
+            if self._probing == threading.get_ident():
+                self._probing = None
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = None
+
+
+class UpstreamClient:
+    """单个上游服务的HTTP客户端"""
+
+    def __init__(self, name, connect_timeout=3, read_timeout=10, retries=2, backoff=0.3,
+                 failure_threshold=5, reset_timeout=30, pool_size=10):
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=200)
+        self._counters = {
+            'requests': 0,
+            'errors': 0,
+            'retries': 0,
+            'rejected': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0
+        }
+
+    def get(self, url, **kwargs):
+        """GET请求，默认视为幂等，失败时重试"""
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, idempotent=False, **kwargs):
+        """POST请求，只有调用方声明idempotent=True时才会重试"""
+        return self.request('POST', url, idempotent=idempotent, **kwargs)
+
+    def request(self, method, url, idempotent=None, read_timeout=None, **kwargs):
+        """
+        发送请求并返回Response；网络错误、超时以及可重试的状态码（429/5xx）计为失败
+        熔断状态只在请求开始时检查一次；重试期间熔断器打开时不再重试，直接抛出最后一次的真实错误
+
+        Raises:
+            UpstreamUnavailable: 服务处于熔断状态，请求未发出
+            requests.RequestException: 重试次数用尽（或熔断器已打开）后仍然失败
+        """
+        if idempotent is None:
+            idempotent = method in ('GET', 'HEAD', 'OPTIONS')
+        attempts = 1 + (self.retries if idempotent else 0)
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise UpstreamUnavailable(f'{self.name} 服务暂时不可用（熔断中）')
+
+        try:
+            for attempt in range(attempts):
+                start = time.monotonic()
+                try:
+                    response = self.session.request(method, url, timeout=timeout, **kwargs)
+                    if response.status_code in RETRY_STATUS:
+                        raise requests.HTTPError(f'{self.name} 返回状态码 {response.status_code}', response=response)
+                except requests.RequestException:
+                    self._record(start, failed=True)
+                    self.breaker.record_failure()
+                    if attempt + 1 >= attempts or self.breaker.state == 'open':
+                        raise
+                    self._count('retries')
+                    # 指数退避并加入随机抖动，避免多个线程同时重试
+                    time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+                    continue
+
+                self._record(start, failed=False)
+                self.breaker.record_success()
+                return response
+        finally:
+            # 非网络异常（参数错误等）不计入熔断，但半开状态下的试探资格要让出
+            self.breaker.release()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._counters[name] += 1
+
+    def _record(self, start, failed):
+        elapsed_ms = (time.monotonic() - start) * 1000
+        with self._stats_lock:
+            self._counters['requests'] += 1
+            if failed:
+                self._counters['errors'] += 1
+            self._counters['total_ms'] += elapsed_ms
+            self._counters['max_ms'] = max(self._counters['max_ms'], elapsed_ms)
+            self._latencies.append(elapsed_ms)
+
+    def stats(self):
+        """请求数、错误数、重试数、熔断拒绝数以及延迟统计"""
+        with self._stats_lock:
+            counters = dict(self._counters)
+            latencies = sorted(self._latencies)
+        requests_count = counters.pop('requests')
+        total_ms = counters.pop('total_ms')
+        return {
+            'requests': requests_count,
+            'errors': counters['errors'],
+            'retries': counters['retries'],
+            'rejected': counters['rejected'],
+            'circuit': self.breaker.state,
+            'avg_ms': round(total_ms / requests_count, 1) if requests_count else 0,
+            'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 1) if latencies else 0,
+            'max_ms': round(counters['max_ms'], 1)
+        }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_upstream(name):
+    """获取（首次调用时创建）指定服务的客户端，参数来自Config.UPSTREAMS"""
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            client = UpstreamClient(name, **getattr(Config, 'UPSTREAMS', {}).get(name, {}))
+            _clients[name] = client
+        return client
+
+
+def upstream_stats():
+    """所有已创建客户端的统计信息"""
+    with _clients_lock:
+        clients = dict(_clients)
+    return {name: client.stats() for name, client in clients.items()}